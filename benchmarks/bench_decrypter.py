@@ -0,0 +1,60 @@
+'''
+Decrypter 解密吞吐量: 整个ts留在内存中时, 解密到新缓冲区再追加与直接解密到预先分配的缓冲区(output=)的对比
+
+用法: python -m benchmarks.bench_decrypter [数据大小MiB] [重复次数]
+'''
+import os
+import sys
+import time
+from typing import Callable
+
+from Crypto.Cipher import AES
+
+from src.utils.Decrypter import Decrypter
+from src.utils.EnumType import DecrptyType
+
+CHUNK_SIZES = (64 * 1024, 256 * 1024, 1024 * 1024)
+
+def throughput(run : Callable[[], None], nbytes : int, repeat : int) -> float:
+    '''
+    返回每秒解密的MiB数
+    '''
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    return nbytes * repeat / (time.perf_counter() - start) / (1024 * 1024)
+
+def main() -> None:
+    size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 64 * 1024 * 1024
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    key, iv = os.urandom(16), os.urandom(16)
+    ciphertext = AES.new(key, AES.MODE_CBC, iv).encrypt(os.urandom(size))
+    decrypter = Decrypter(DecrptyType.AES)
+    hex_iv = '0x' + iv.hex()
+    print(f"数据大小 {size // (1024 * 1024)} MiB, 重复{repeat}次")
+    for chunk_size in CHUNK_SIZES:
+        # 与下载时相同, 按块解密, 每块的iv为上一块最后16字节密文
+        chunks = [ciphertext[i:i + chunk_size] for i in range(0, size, chunk_size)]
+        ivs = [hex_iv] + [chunk[-16:] for chunk in chunks[:-1]]
+
+        def append() -> None:
+            buffer = bytearray()
+            for chunk, chunk_iv in zip(chunks, ivs):
+                buffer += decrypter.decrypt(chunk, key, chunk_iv)
+
+        def into() -> None:
+            buffer = bytearray(size)
+            view = memoryview(buffer)
+            offset = 0
+            for chunk, chunk_iv in zip(chunks, ivs):
+                decrypter.decrypt(chunk, key, chunk_iv, output=view[offset:offset + len(chunk)])
+                offset += len(chunk)
+
+        print(
+            f"分块 {chunk_size // 1024:>5} KiB"
+            f"  解密后追加 {throughput(append, size, repeat):>8.0f} MiB/s"
+            f"  解密到预分配缓冲区 {throughput(into, size, repeat):>8.0f} MiB/s"
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+'''
+比较 m3u8.loads 与项目内的媒体m3u8解析器的耗时和常驻内存
+
+用法: python -m benchmarks.bench_m3u8_parser [ts数量] [重复次数]
+'''
+import sys
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+import m3u8
+
+from src.utils.M3u8Parser import parse_media_playlist
+from src.utils.DownloadPlan import DownloadPlan
+
+def make_playlist(count : int) -> str:
+    lines = [
+        '#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:3', '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-KEY:METHOD=AES-128,URI="https://example.com/keys/abc123.key",IV=0x5f1c3a0bd2e44e1a9c0d1e2f3a4b5c6d',
+    ]
+    for i in range(count):
+        lines += ['#EXTINF:2.002,', f'abc123{i}.ts?e=1893456000&t=Zx9-Q']
+    return '\n'.join(lines + ['#EXT-X-ENDLIST', ''])
+
+def measure(parse : Callable[[str], object], text : str, repeat : int) -> Tuple[float, int]:
+    '''
+    返回单次解析的平均秒数以及解析结果占用的内存字节数
+    '''
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parse(text)
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    result = parse(text)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, retained
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    text = make_playlist(count)
+    candidates = {
+        'm3u8.loads' : m3u8.loads,
+        'parse_media_playlist' : parse_media_playlist,
+        # 直接构建以绕过按内容缓存
+        'DownloadPlan' : lambda text: DownloadPlan._build('', text),
+    }
+    print(f"{count}个ts, 重复{repeat}次")
+    for name, parse in candidates.items():
+        elapsed, retained = measure(parse, text, repeat)
+        print(f"{name:<22}{elapsed * 1000:>10.1f} ms{retained / 1024:>12.0f} KiB")
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ from typing import Any, Dict, Union
 
 from ..utils.EnumType import Page
 from ..utils.Logger import Logger
+from ..utils.HttpClient import http_client
 from ..Config.Config import config
 from ..Error.Exception import NotFoundError, ForbiddenError
 from ..PageParse.utils.PageValidation import validation
@@ -74,7 +75,7 @@ class VideoCrawlerBase(ABC):
         NotFound_count = 0
         for retry_count in range(config.max_retries):
             try:
-                response = requests.get(self.url, headers=config.headers, proxies=config.proxies, timeout=10)
+                response = http_client.get(self.url)
                 if response.status_code == 200:
                     return response.text
                 elif response.status_code == 403:
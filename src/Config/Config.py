@@ -1,3 +1,4 @@
+import os
 import json
 from pathlib import Path
 
@@ -20,15 +21,13 @@ class Config:
         self.config_dir = Path(config_dir).absolute().resolve()
 
         self.tmp_m3u8_dir = self.tmp_dir / 'm3u8'
-        self.tmp_key_dir = self.tmp_dir / 'key'
-        self.tmp_iv_dir = self.tmp_dir / 'iv'
         self.tmp_ts_dir = self.tmp_dir / 'ts'
+        self.tmp_journal_dir = self.tmp_dir / 'journal'
 
         self.tmp_subdirs = {
             'tmp_m3u8_dir' : 'm3u8',
-            'tmp_key_dir' : 'key',
-            'tmp_iv_dir' : 'iv',
             'tmp_ts_dir' : 'ts',
+            'tmp_journal_dir' : 'journal',
         }
 
         self.download_subdirs = {
@@ -46,8 +45,67 @@ class Config:
 
         self.max_concurrency = 2
         self.max_ts_concurrency = 5
+        # 批量下载时同时解析视频页面的线程数
+        self.parse_workers = 4
         self.max_retries = 3
         self.retry_wait_time = 5
+        # 重试等待时间的上限(秒), 实际等待时间在上限的一半到上限之间随机
+        self.retry_max_wait = 60
+        # ts重试次数用完后, 重新获取m3u8再下载剩余ts的最大轮数
+        self.max_redownload_rounds = 3
+        # 整个下载过程共用的ts连接数, 为None时取 max_concurrency * max_ts_concurrency
+        self.max_connections = None
+        # 每个视频下载ts的工作协程数, 为None时取连接数上限
+        self.ts_workers = None
+        # 根据延迟, 超时与限流(429/503)自动调整ts连接数(AIMD), 默认关闭; 上限为None时取初始连接数的4倍
+        self.adaptive_concurrency = False
+        self.adaptive_min_connections = 1
+        self.adaptive_max_connections = None
+        # ts按块接收并解密写入, 每块的大小(字节)
+        self.ts_chunk_size = 256 * 1024
+        # 大于该长度的ts在服务器支持Range时利用空闲连接分段并行下载(字节), 为None时不分段
+        self.ts_split_size = 8 * 1024 * 1024
+        # 整个下载过程中内存里ts数据的上限(字节), 为None时不限制
+        self.max_memory_bytes = 128 * 1024 * 1024
+        # 接收ts后校验MPEG-TS包结构, 损坏的ts立即重新下载, 默认关闭
+        self.ts_validation = False
+        self.ts_max_continuity_errors = 3
+        # ts下载时间超过最近ts耗时的该百分位时发起对冲请求, 先完成的一方生效.
+        # 对冲会向服务器重复请求较慢的ts, 默认为None不对冲, 需要时设置为0.95等值开启
+        self.hedge_percentile = None
+        self.hedge_min_samples = 10
+        self.hedge_min_delay = 2.0
+        # 对冲请求使用的代理, 为None时与普通请求相同
+        self.hedge_proxy = None
+        # 在m3u8估计有效期剩余该比例时主动刷新; 有效期未知时每隔m3u8_refresh_poll秒重新检查
+        self.m3u8_refresh_margin = 0.2
+        self.m3u8_refresh_poll = 30
+        # 下载限速(字节/秒), 按视频的权重分配, 为None时不限速; 令牌桶容量为None时取限速的一半
+        self.max_bandwidth = None
+        self.bandwidth_burst = None
+        # 所有视频共用的密钥缓存容量, 同一个密钥地址只下载一次
+        self.key_cache_size = 64
+        # ts解密与写入的工作池类型: 'thread' 或 'process'
+        self.ts_worker_type = 'thread'
+        self.ts_max_workers = os.cpu_count() or 4
+        # 不使用ffmpeg时边下载边按序写入视频文件, 乱序ts的重排缓冲区上限(字节)
+        self.stream_merge = False
+        self.stream_buffer_bytes = 64 * 1024 * 1024
+        # ts完成记录与单文件存储索引写入文件的最短间隔(秒), 中断时最多丢失这段时间内的记录, 对应的ts重新下载
+        self.journal_flush_interval = 1.0
+        # 使用ffmpeg时在下载开始就启动ffmpeg, 按序把ts写入其标准输入
+        self.stream_ffmpeg = False
+        # 所有ts下载完成后等待边下载边封装的ffmpeg结束的秒数, 超时后结束ffmpeg并改用普通合并
+        self.ffmpeg_finish_timeout = 600
+        # ts存储方式: 'files' 每个ts一个文件, 'packed' 每个视频一个文件加偏移索引
+        self.segment_store = 'files'
+        # 多清晰度视频的选择方式: 'max' 最高清晰度; 'resolution' 高度不超过hls_max_height的最高清晰度;
+        # 'throughput' 码率不超过吞吐量的最高清晰度, hls_throughput(字节/秒)为None时使用最近一次下载测得的吞吐量
+        self.hls_variant_policy = 'max'
+        self.hls_max_height = 720
+        self.hls_throughput = None
+        # 解析后的主m3u8按视频缓存的秒数
+        self.hls_master_ttl = 600
         self.headers = {
             'User-Agent' : 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36'
         }
@@ -55,6 +113,12 @@ class Config:
             'http' : 'http://127.0.0.1:10809',
         }
         self.cookie = ''
+        # 同步HTTP请求共用的连接池: 最多保留连接池的host数, 每个host的连接数, 默认超时时间(秒)
+        self.http_pool_connections = 16
+        self.http_pool_maxsize = 16
+        self.http_timeout = 10
+        # 最近一次下载测得的吞吐量(字节/秒), 由下载器更新
+        self.measured_throughput = None
 
     def _create_dir(self) -> None:
         self.download_dir.mkdir(parents=True, exist_ok=True)
@@ -4,8 +4,9 @@ import time
 import json
 import logging
 import requests
-from threading import Thread
+from threading import Event, Thread
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List, Any, Optional, Tuple, Union
 
 from .Config.Config import config
@@ -19,6 +20,7 @@ from .PageParse.utils.PageValidation import validation
 from .PageParse.MissavPageParser.MissavPageParser import MissavPageParser
 from .Error.Exception import ForbiddenError, NotFoundError
 from .Downloader import Downloader
+from .utils.HttpClient import http_client
 from .Bases.CrawlerBases import VideoCrawlerBase
 
 logger = Logger(config.log_dir).get_logger(__name__, logging.INFO)
@@ -171,7 +173,7 @@ class JabVideoCrawler(VideoCrawlerBase):
         search_api = f'https://jable.tv/search/{search_word}'
         for retry_count in range(config.max_retries):
             try:
-                response = requests.get(search_api, headers=config.headers, proxies=config.proxies, timeout=10)
+                response = http_client.get(search_api)
                 if response.status_code == 200:
                     html_text = response.text
                     parser._html_text = html_text
@@ -224,7 +226,7 @@ class JabVideoCrawler(VideoCrawlerBase):
         search_api = self._tag2link(tag_title, tag)
         for retry_count in range(config.max_retries):
             try:
-                response = requests.get(search_api, headers=config.headers, proxies=config.proxies, timeout=10)
+                response = http_client.get(search_api)
                 if response.status_code == 200:
                     html_text = response.text
                     parser._html_text = html_text
@@ -277,7 +279,7 @@ class JabVideoCrawler(VideoCrawlerBase):
     
     def display_tasks(self, downloader : Downloader, wait_time : int = 1) -> None:
         total = ''
-        for name, counter in downloader._counters.items():
+        for name, counter in list(downloader._counters.items()):
             total += f"\r{name} : {counter.current_id} / {counter.total_num}\n"
         print(total, end='')
         time.sleep(wait_time)
@@ -297,14 +299,64 @@ class JabVideoCrawler(VideoCrawlerBase):
             ids : List[str],
             quiet : bool = False,
             ) -> None:
+        '''
+        批量下载. 由最多config.parse_workers个线程并发解析视频页面,
+        每解析完一个视频立即提交给正在运行的下载器, 不等待其余页面解析完成.
+        解析失败的视频记录日志后跳过, 下载器出错时停止解析剩余的页面
+
+        Raises:
+            ValueError: ids为空或所有页面都解析失败
+        '''
         if quiet:
             Logger(config.log_dir).disable_stream_handler('src.Downloader')
-        for id in ids:
-            url = f'https://jable.tv/videos/{id}/'
-            crawler = JabVideoCrawler(url)
-            package = crawler.parse()
-            self.add_task(package)
-        self.run_tasks()
+        if not ids:
+            logger.error('下载列表为空')
+            raise ValueError('下载列表为空')
+        downloader = Downloader([])
+        failed : List[str] = []
+        stop = Event()
+
+        def _resolve(id : str) -> Optional[DownloadPackage]:
+            return JabVideoCrawler(f'https://jable.tv/videos/{id}/').parse()
+
+        def _feed() -> None:
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, config.parse_workers)) as pool:
+                    futures = {pool.submit(_resolve, id) : id for id in ids}
+                    for future in as_completed(futures):
+                        if stop.is_set():
+                            for pending in futures:
+                                pending.cancel()
+                            break
+                        id = futures[future]
+                        try:
+                            package = future.result()
+                        except Exception as e:
+                            logger.error(f"解析{id}失败, 错误信息:{e}")
+                            failed.append(id)
+                            continue
+                        if package is None:
+                            failed.append(id)
+                            continue
+                        self.add_task(package)
+                        downloader.submit(package)
+            finally:
+                downloader.close_submissions()
+
+        feeder = Thread(target=_feed, daemon=True)
+        feeder.start()
+        Thread(target=self.display_tasks, args=(downloader, 5), daemon=True).start()
+        try:
+            downloader.download(streaming=True)
+        except BaseException:
+            stop.set()
+            raise
+        feeder.join()
+        if failed:
+            logger.warning(f"{len(failed)}个视频解析失败, 未下载: {', '.join(failed)}")
+        if len(failed) == len(ids):
+            logger.error('下载列表为空')
+            raise ValueError('下载列表为空')
 
     def _validate_src(self):
         return self.src == 'jable' and self.src in self.url
@@ -3,27 +3,51 @@ import os
 import re
 import json
 import time
+import random
 import shutil
 import asyncio
 import aiohttp
 import subprocess
 import requests
-import m3u8
 import logging
+import threading
 from pathlib import Path
-from functools import lru_cache
 from urllib.parse import urljoin
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Optional, Callable, Any, Union, Dict, overload
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Optional, Any, Union, Dict, Tuple, Iterable, Set, Awaitable, overload
 
 from .Config.Config import config
 from .utils.Logger import Logger
 from .utils.Counter import Counter
-from .utils.Decrypter import Decrypter, is_encrypted
+from .utils.Scheduler import SegmentScheduler
+from .utils.Budget import ByteBudget
+from .utils.Concurrency import AIMDController
+from .utils.Journal import CompletionJournal
+from .utils.Assembler import StreamAssembler
+from .utils.SegmentStore import PackedSegmentStore, write_at, read_checksum
+from .utils.FileCopy import copy_range, preallocate
+from .utils.FFmpegStreamer import FFmpegStreamer
+from .utils.TsValidator import TsValidator
+from .utils.Hedging import HedgeTracker
+from .utils.RateLimiter import BandwidthLimiter
+from .utils.TokenLifetime import TokenLifetime
+from .utils.KeyCache import KeyCache
+from .utils.HttpClient import http_client
+from .utils.Decrypter import Decrypter
+from .utils.DownloadPlan import DownloadPlan, PlannedSegment, ts_name
 from .Manager import DownloadInfoManager
 from .utils.DataUnit import DownloadPackage
 from .utils.EnumType import DecrptyType, DownloadStatus
-from .Error.Exception import M3u8ExpiredException, ForbiddenError
+from .Error.Exception import (
+    M3u8ExpiredException,
+    SuspectedExpiryError,
+    InvalidPlaylistError,
+    ForbiddenError,
+    IncompleteSegmentError,
+    CorruptedSegmentError,
+    SegmentsFailedError,
+    KeyFetchError,
+)
 
 logger = Logger(config.log_dir).get_logger(__name__, logging.INFO)
 
@@ -31,6 +55,174 @@ _DOWNLOAD_INFO_PATH = config.download_dir / 'download_info.json'
 _download_info_manager = DownloadInfoManager(
     _DOWNLOAD_INFO_PATH,
 )
+# 所有下载器与视频共用的密钥缓存
+_key_cache = KeyCache(config.key_cache_size)
+
+def _decrypt(
+        decrypter : Decrypter,
+        content : bytes,
+        key : Optional[bytes] = None,
+        iv : Optional[Union[str, bytes]] = None,
+        ) -> bytes:
+    '''
+    解密ts数据,在工作池中执行,未加密时原样返回
+    '''
+    if key and iv:
+        return decrypter.decrypt(content, key, iv)
+    return content
+
+def _decrypt_into(
+        decrypter : Decrypter,
+        content : Union[bytes, memoryview],
+        output : memoryview,
+        key : bytes,
+        iv : Union[str, bytes],
+        ) -> None:
+    '''
+    解密ts数据并直接写入output(ts缓冲区中对应的位置),不分配新的缓冲区,只能在线程池中执行
+    '''
+    decrypter.decrypt(content, key, iv, output=output)
+
+def _decrypt_and_write_at(
+        decrypter : Decrypter,
+        content : bytes,
+        file_path : Path,
+        offset : int,
+        key : Optional[bytes] = None,
+        iv : Optional[Union[str, bytes]] = None,
+        checksum : int = 0,
+        ) -> int:
+    '''
+    解密ts数据并写入文件的指定位置,在工作池中执行,避免阻塞事件循环
+
+    Returns:
+        int: 累计到本块的crc32校验值
+    '''
+    return write_at(file_path, offset, _decrypt(decrypter, content, key, iv), checksum)
+
+def _finish_part(part_path : Path, file_path : Path, size : int) -> None:
+    '''
+    ts分块写入完成后截断到实际长度并改名,改名前的文件不会被当作已下载的ts
+    '''
+    os.truncate(part_path, size)
+    os.replace(part_path, file_path)
+
+def _content_range_start(response : aiohttp.ClientResponse) -> Optional[int]:
+    '''
+    解析206响应 Content-Range 中的起始位置
+    '''
+    match = re.match(r'bytes (\d+)-', response.headers.get('Content-Range', ''))
+    return int(match.group(1)) if match else None
+
+# 一次ts下载尝试的结果
+_ATTEMPT_DONE = 'done'
+_ATTEMPT_RETRY = 'retry'
+_ATTEMPT_RETRY_NOW = 'retry_now'
+
+class _SegmentJob:
+    '''
+    工作协程队列中的一个ts,重试时带着接收进度重新入队
+    '''
+    __slots__ = ('index', 'segment', 'transfer', 'retries')
+
+    def __init__(self, index : int, segment : PlannedSegment) -> None:
+        self.index = index
+        self.segment = segment
+        self.transfer : Optional[_SegmentTransfer] = None
+        self.retries = 0
+
+class _RangePart:
+    '''
+    ts中的一段 [start, end), position为下一个要接收的位置, iv为解密该位置所需的前一块密文
+    '''
+    __slots__ = ('start', 'end', 'position', 'iv')
+
+    def __init__(self, start : int, end : Optional[int], iv : Optional[Union[str, bytes]]) -> None:
+        self.start = start
+        self.end = end
+        self.position = start
+        self.iv = iv
+
+class _SegmentTransfer:
+    '''
+    一个ts的接收进度,在重试之间保留,重试时通过Range只下载缺少的部分
+    '''
+    def __init__(
+            self,
+            iv : Optional[str],
+            key : str,
+            tag : str = '',
+            proxy : Optional[str] = None,
+            key_bytes : Optional[bytes] = None,
+            ) -> None:
+        self.iv = iv
+        # 解密该ts的密钥, 未加密时为None
+        self.key_bytes = key_bytes
+        self.key = key
+        # 对冲请求使用独立的临时文件与代理
+        self.tag = tag
+        self.proxy = proxy
+        self.started = asyncio.Event()
+        self.start_time : Optional[float] = None
+        self.finished = False
+        # 最近一次失败的原因
+        self.reason : Optional[str] = None
+        self.rival : Optional['_SegmentTransfer'] = None
+        self.prepared = False
+        self.length : Optional[int] = None
+        self.file_path : Optional[Path] = None
+        self.offset = 0
+        self.buffer : Optional[bytearray] = None
+        # 持有的内存预算,ts结束时归还
+        self.held = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.parts = [_RangePart(0, None, self.iv)]
+        self.checksum = 0
+        if self.buffer is not None:
+            self.buffer.clear()
+
+    def split(self, count : int) -> None:
+        '''
+        按16字节对齐把ts分成count段,第一段继续使用当前响应
+        '''
+        size = -(-self.length // count)
+        size += -size % 16
+        bounds = list(range(0, self.length, size)) + [self.length]
+        self.parts = [
+            _RangePart(start, end, self.iv if start == 0 else None)
+            for start, end in zip(bounds, bounds[1:])
+        ]
+
+    def begin(self) -> None:
+        '''
+        每次分配到连接时调用,记录本次开始下载的时间
+        '''
+        self.start_time = time.monotonic()
+        self.started.set()
+
+    def claim(self) -> bool:
+        '''
+        与对冲请求竞争写入结果,只有先完成的一方返回True
+        '''
+        if self.rival is not None and self.rival.finished:
+            return False
+        self.finished = True
+        return True
+
+    @property
+    def received(self) -> int:
+        return sum(part.position - part.start for part in self.parts)
+
+    @property
+    def resume_position(self) -> int:
+        '''
+        可以续传的位置,没有已接收的数据或已经分段时为0
+        '''
+        if len(self.parts) != 1:
+            return 0
+        return self.parts[0].position
 
 class Downloader:
     '''
@@ -44,6 +236,12 @@ class Downloader:
             headers : Dict = None,
             proxies : Dict = None,
             use_ffmpeg : bool = True,
+            worker_type : Optional[str] = None,
+            max_workers : Optional[int] = None,
+            stream_merge : Optional[bool] = None,
+            segment_store : Optional[str] = None,
+            stream_ffmpeg : Optional[bool] = None,
+            max_bandwidth : Optional[float] = None,
             **kwargs : Any
             ) -> None:
         self._packages = packages if isinstance(packages, list) else [packages]
@@ -52,23 +250,119 @@ class Downloader:
         self._proxies = proxies or {}
         self._use_ffmpeg = use_ffmpeg
         self._counters : Dict[str, Counter] = {}
+        self._journals : Dict[str, CompletionJournal] = {}
+        self._stream_merge = config.stream_merge if stream_merge is None else stream_merge
+        self._assemblers : Dict[str, StreamAssembler] = {}
+        self._segment_store = segment_store or config.segment_store
+        self._stores : Dict[str, PackedSegmentStore] = {}
+        self._stream_ffmpeg = config.stream_ffmpeg if stream_ffmpeg is None else stream_ffmpeg
+        self._max_bandwidth = config.max_bandwidth if max_bandwidth is None else max_bandwidth
+        self._limiter : Optional[BandwidthLimiter] = None
+        self._streamers : Dict[str, FFmpegStreamer] = {}
+        self._worker_type = worker_type or config.ts_worker_type
+        self._max_workers = max_workers or config.ts_max_workers
+        self._executor : Optional[Executor] = None
+        self._executor_lock = threading.Lock()
+        self._controller : Optional[AIMDController] = None
+        self._hedger : Optional[HedgeTracker] = None
+        self._dead_letters : Dict[str, Dict[int, str]] = {}
+        self._worker_limit : Optional[int] = None
+        self._lifetimes : Dict[str, TokenLifetime] = {}
+        # 每个视频上次写入完成记录的时间
+        self._flushed_at : Dict[str, float] = {}
+        # 合并器重排缓冲区中的ts计入内存预算的字节数, 参见 _charge_reorder_buffer
+        self._reorder_charges : Dict[str, Dict[int, int]] = {}
+        self._reorder_bytes = 0
+        self._validator = TsValidator(config.ts_max_continuity_errors) if config.ts_validation else None
+        # 流式下载时从其他线程提交的视频, 参见 submit
+        self._submitted : List[DownloadPackage] = []
+        self._submit_closed = False
+        self._submit_lock = threading.Lock()
+        self._submit_loop : Optional[asyncio.AbstractEventLoop] = None
+        self._submit_event : Optional[asyncio.Event] = None
+        # 封面、预取密钥等后台任务, 保留引用直到完成
+        self._background_tasks : Set[asyncio.Task] = set()
         self._kwargs = kwargs
     
+    def _get_executor(self) -> Executor:
+        '''
+        获取解密与写入ts文件的工作池,首次调用时创建
+
+        Raises:
+            ValueError: 不支持的工作池类型
+        '''
+        with self._executor_lock:
+            if self._executor is None:
+                if self._worker_type == 'thread':
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self._max_workers,
+                        thread_name_prefix='ts_worker',
+                    )
+                elif self._worker_type == 'process':
+                    self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+                else:
+                    logger.error(f"不支持的工作池类型: {self._worker_type}, 仅支持thread, process")
+                    raise ValueError(f"不支持的工作池类型: {self._worker_type}")
+            return self._executor
+    
+    def _shutdown_executor(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+    
     def _clear_tmp_ts(self, package : DownloadPackage) -> None:
         logger.info(f"清理临时ts文件:{package.id}")
         tmp_ts_dir = config.tmp_ts_dir / f'{package.id.lower()}'
         if tmp_ts_dir.exists():
             shutil.rmtree(tmp_ts_dir)
+        self._close_segment_state(package)
+        journal_path = config.tmp_journal_dir / f'{package.id.lower()}.journal'
+        if journal_path.exists():
+            os.remove(journal_path)
+        assembler_state_path = config.tmp_journal_dir / f'{package.id.lower()}.assembler'
+        if assembler_state_path.exists():
+            os.remove(assembler_state_path)
+        PackedSegmentStore(self._store_path(package), 0).remove()
+    
+    def _close_segment_state(self, package : DownloadPackage) -> None:
+        # 先写入ts存储的索引再写入完成记录, 记录中的ts在索引中都存在
+        store = self._stores.pop(package.id.lower(), None)
+        if store is not None:
+            store.close()
+        journal = self._journals.pop(package.id.lower(), None)
+        if journal is not None:
+            journal.close()
+        self._flushed_at.pop(package.id.lower(), None)
+        assembler = self._assemblers.pop(package.id.lower(), None)
+        if assembler is not None:
+            assembler.close()
+        streamer = self._streamers.pop(package.id.lower(), None)
+        if streamer is not None:
+            streamer.abort()
+    
+    @staticmethod
+    def _store_path(package : DownloadPackage) -> Path:
+        return config.tmp_ts_dir / f'{package.id.lower()}.pack'
+
+    def _use_packed_store(self, package : DownloadPackage) -> bool:
+        '''
+        视频第一次下载时根据配置选择ts存储方式,之后恢复下载时沿用已有的存储方式
+        '''
+        if PackedSegmentStore(self._store_path(package), 0).index_path.exists():
+            return True
+        if (config.tmp_journal_dir / f'{package.id.lower()}.journal').exists():
+            return False
+        if self._segment_store not in ('files', 'packed'):
+            logger.error(f"不支持的ts存储方式: {self._segment_store}, 仅支持files, packed")
+            raise ValueError(f"不支持的ts存储方式: {self._segment_store}")
+        return self._segment_store == 'packed'
     
     def _clear_tmp_decrpt_info(self, package : DownloadPackage) -> None:
         logger.info(f"清理解密信息:{package.id}")
-        tmp_key_path = config.tmp_key_dir / f'{package.id.lower()}.key'
-        tmp_iv_path = config.tmp_iv_dir / f'{package.id.lower()}.iv'
         tmp_m3u8_path = config.tmp_m3u8_dir / f'{package.id.lower()}.m3u8'
-        remove_list = [tmp_key_path, tmp_iv_path, tmp_m3u8_path]
-        for path in remove_list:
-            if path.exists():
-                os.remove(path)
+        if tmp_m3u8_path.exists():
+            os.remove(tmp_m3u8_path)
     
     def _clear_tmp_merge_info(self, package : DownloadPackage) -> None:
         logger.info(f"清理合并信息:{package.id}")
@@ -82,109 +376,192 @@ class Downloader:
         self._clear_tmp_merge_info(package=package)
         logger.info(f"清理完成,{package.id}")
     
-    @staticmethod
-    def _get_folder_mtime(primary_folder : Path, sub_folder_name : str) -> float:
-        folder_path = primary_folder / sub_folder_name
-        if not folder_path.exists():
-            return 0
-        return folder_path.stat().st_mtime
-
-    @staticmethod
     def _ts_is_corrupted(
+        self,
         file_path : Path,
+        duration : Optional[float] = None,
         ) -> bool:
         if file_path.name.endswith('.jpeg'):
             return False
-        try:
-            with open(file_path, 'rb') as f:
-                data = f.read()
-                return len(data) % 16 != 0
-        except UnicodeDecodeError:
-            return True
+        if self._validator is None:
+            try:
+                return file_path.stat().st_size == 0
+            except OSError:
+                return True
+        problem = self._validator.validate_file(file_path, duration=duration)
+        if problem:
+            logger.warning(f"ts校验失败,文件名:{file_path.name},原因:{problem}")
+        return problem is not None
     
+    @staticmethod
+    def _ts_name(index : int) -> str:
+        return ts_name(index)
+
+    def _load_plan(self, package : DownloadPackage) -> DownloadPlan:
+        '''
+        读取临时目录中的m3u8并返回下载计划, m3u8内容未变化时不会重新解析.
+        m3u8刷新后媒体序号改变时, 按完成记录创建时的媒体序号与ts数量对应, 恢复下载与重新下载时不会清空已下载的ts
+        '''
+        plan = DownloadPlan.parse(self._load_tmp(package=package, tmp_file_type='m3u8')['m3u8'])
+        header = CompletionJournal.read_header(config.tmp_journal_dir / f'{package.id.lower()}.journal')
+        if header is None or header[1] is None:
+            return plan
+        total, media_sequence = header
+        rebased = plan.rebase(media_sequence, total)
+        if rebased is None:
+            return plan
+        if rebased is not plan:
+            logger.info(f"{package.id}的m3u8媒体序号已从{media_sequence}变为{plan.media_sequence}, 按原序号继续下载")
+        return rebased
+
+    def _open_journal(
+            self,
+            package : DownloadPackage,
+            plan : DownloadPlan,
+            ) -> CompletionJournal:
+        '''
+        打开视频的ts完成记录.
+        记录存在且ts总数一致时直接信任记录;ts总数不一致说明视频分割已改变,清空旧的ts文件重新下载;
+        记录不存在时(旧版本遗留的临时目录)扫描一次临时目录生成记录.
+        '''
+        tmp_ts_dir = config.tmp_ts_dir / f'{package.id.lower()}'
+        tmp_ts_dir.mkdir(parents=True, exist_ok=True)
+        journal_path = config.tmp_journal_dir / f'{package.id.lower()}.journal'
+        journal = CompletionJournal(journal_path, plan.total, plan.media_sequence)
+        store = self._stores.get(package.id.lower())
+        if journal.load():
+            return journal
+        if journal_path.exists():
+            # 只有通过校验的m3u8才会写入临时目录, 空的计划不能作为分割已改变的依据
+            if plan.total == 0:
+                raise InvalidPlaylistError("m3u8中没有ts")
+            logger.warning(f"视频分割已改变,清空{package.id}已下载的ts文件")
+            shutil.rmtree(tmp_ts_dir)
+            tmp_ts_dir.mkdir(parents=True, exist_ok=True)
+            if store is not None:
+                store.remove()
+                store.load()
+            journal.reset()
+            return journal
+        journal.reset()
+        if store is not None:
+            for index in store.records:
+                journal.mark(index)
+        for segment in plan.segments:
+            ts_path = tmp_ts_dir / segment.filename
+            legacy_path = tmp_ts_dir / segment.uri
+            if segment.byterange is None and not ts_path.exists() and legacy_path.exists():
+                os.replace(legacy_path, ts_path)
+            if ts_path.exists():
+                if self._ts_is_corrupted(ts_path, segment.duration):
+                    continue
+                journal.mark(segment.index)
+        logger.info(f"已从临时目录恢复{package.id}的下载记录, 已完成{journal.completed}/{journal.total}")
+        return journal
+
     def _get_undownload_ts(
             self,
             package : DownloadPackage,
-            m3u8_obj : m3u8.M3U8,
-            ) -> m3u8.SegmentList:
+            plan : DownloadPlan,
+            ) -> List[Tuple[int, PlannedSegment]]:
         '''
-        处理未下载的ts文件
+        根据完成记录获取未下载的ts
 
         Args:
             package (DownloadPackage): 下载包
-            m3u8_obj (m3u8.M3U8): m3u8对象
-            folder_mtime (float): 文件夹的修改时间
+            plan (DownloadPlan): 下载计划
 
         Returns:
-            m3u8.SegmentList: 未下载的ts文件列表
+            List[Tuple[int, PlannedSegment]]: 未下载的ts序号及ts
         '''
-        _folder_mtime = self._get_folder_mtime(config.tmp_ts_dir, f'{package.id.lower()}')
-        return self._undownload_ts(package, m3u8_obj, _folder_mtime)
+        journal = self._journals.get(package.id.lower())
+        if journal is None or journal.total != plan.total or journal.media_sequence != plan.media_sequence:
+            self._close_segment_state(package)
+            if self._use_packed_store(package):
+                store = PackedSegmentStore(self._store_path(package), plan.total)
+                store.load()
+                self._stores[package.id.lower()] = store
+            journal = self._open_journal(package, plan)
+            self._journals[package.id.lower()] = journal
+            if self._use_stream_merge(package):
+                self._open_assembler(package, journal)
+            elif self._use_ffmpeg and self._stream_ffmpeg:
+                self._start_streamer(package, journal)
+        segments = plan.segments
+        assembler = self._assemblers.get(package.id.lower())
+        return [
+            (index, segments[index]) for index in journal.missing()
+            if assembler is None or not assembler.is_buffered(index)
+        ]
 
-    @staticmethod
-    @lru_cache(maxsize=5)
-    def _undownload_ts(
-        package : DownloadPackage,
-        m3u8_obj : m3u8.M3U8,
-        folder_mtime : float,
-    ) -> m3u8.SegmentList:
-        # 当不改变视频分割时
-        downloaded_ts_index = {}
-        downloaded_ts_index_list = []
-        prefixes = set()
-        undownload_ts = []
-        tmp_ts_dir = config.tmp_ts_dir / f'{package.id.lower()}'
-        if not tmp_ts_dir.exists():
-            logger.error(f"临时ts目录{tmp_ts_dir}不存在!")
-            raise FileNotFoundError(f"临时ts目录{tmp_ts_dir}不存在!")
-        if _DOWNLOAD_INFO_PATH.exists():
-            with open(_DOWNLOAD_INFO_PATH, 'r', encoding='utf-8') as f:
-                data : Dict[str, List[Dict]] = json.load(f)
-            if package.id.lower() in data:
-                package_data_list = data[package.id.lower()]
-                for package_data in package_data_list:
-                    prefix = package_data['hls_url'].split('/')[-1].split('.m3u8')[0]
-                    if prefix == package_data['hls_url'].split('/')[-2]:
-                        prefixes.add(prefix)
-                    else:
-                        prefixes.add(prefix)
-                        logger.warning(f"hls_url中存在多个分段,将使用倒数第一个作为分段前缀")
-                for file in tmp_ts_dir.iterdir():
-                    if Downloader._ts_is_corrupted(file):
-                        logger.warning(f"文件损坏,文件名:{file.name}")
-                        continue
-                    for prefix in prefixes:
-                        if file.name.startswith(prefix):
-                            downloaded_ts_index_list_partial = downloaded_ts_index.get(prefix, [])
-                            downloaded_ts_index_list_partial.append(int(file.name.split('.')[0].split(prefix)[-1]))
-                            downloaded_ts_index[prefix] = downloaded_ts_index_list_partial
-                for value in downloaded_ts_index.values():
-                    downloaded_ts_index_list.extend(value)
-            else:
-                logger.warning(f"下载信息文件中没有{package.id}的信息")
-                raise ValueError(f"下载信息文件中没有{package.id}的信息")
-        else:
-            logger.warning("下载信息文件不存在!,将按相同前缀处理！")
-            prefix = m3u8_obj.segments[0].uri.split('0.ts')[0]
-            logger.warning(f"将使用{prefix}作为分段前缀")
-            for file in tmp_ts_dir.iterdir():
-                if file.is_file() and file.name.endswith('.ts'):
-                    if Downloader._ts_is_corrupted(file):
-                        logger.warning(f"文件损坏,文件名:{file.name}")
-                        continue
-                    ts_index_match = re.search(prefix + r"(\d+).ts", file.name)
-                    index = int(ts_index_match.group(1))
-                    downloaded_ts_index_list.append(index)
-        if len(set(downloaded_ts_index_list)) < len(downloaded_ts_index_list):
-            # TODO: 存在重复的ts文件,需要处理
-            pass
+    def _start_streamer(
+            self,
+            package : DownloadPackage,
+            journal : CompletionJournal,
+            ) -> FFmpegStreamer:
+        '''
+        启动ffmpeg边下载边封装,ts仍然保存在临时目录中,中断后重新封装不需要重新下载
+        '''
+        store = self._stores.get(package.id.lower())
+        if store is not None:
+            read_segment = store.read
         else:
-            downloaded_ts_index_list.sort()
-            for i, segment in enumerate(m3u8_obj.segments):
-                if i in downloaded_ts_index_list:
-                    continue
-                undownload_ts.append(segment)
-        return undownload_ts
+            tmp_ts_dir = config.tmp_ts_dir / f'{package.id.lower()}'
+            read_segment = lambda index: (tmp_ts_dir / self._ts_name(index)).read_bytes()
+        streamer = FFmpegStreamer(
+            output_path=config.video_dir / f'{package.id.lower()}.mp4',
+            total=journal.total,
+            read_segment=read_segment,
+            name=package.id,
+        )
+        streamer.start()
+        for index in range(journal.total):
+            if index in journal:
+                streamer.notify(index)
+        self._streamers[package.id.lower()] = streamer
+        return streamer
+
+    def _mark_done(self, package : DownloadPackage, index : int) -> None:
+        '''
+        记录ts已完成, 完成记录与ts存储的索引每隔config.journal_flush_interval秒才写入一次文件
+        '''
+        key = package.id.lower()
+        self._journals[key].mark(index)
+        now = time.monotonic()
+        if now - self._flushed_at.get(key, 0.0) >= config.journal_flush_interval:
+            self._flushed_at[key] = now
+            store = self._stores.get(key)
+            if store is not None:
+                store.flush()
+            self._journals[key].flush()
+        streamer = self._streamers.get(key)
+        if streamer is not None:
+            streamer.notify(index)
+
+    def _use_stream_merge(self, package : DownloadPackage) -> bool:
+        '''
+        不使用ffmpeg且开启了边下载边合并时使用;上次中断时使用了边下载边合并的,继续使用以免丢失已写入视频文件的ts
+        '''
+        if self._use_ffmpeg:
+            return False
+        return self._stream_merge or (config.tmp_journal_dir / f'{package.id.lower()}.assembler').exists()
+
+    def _open_assembler(
+            self,
+            package : DownloadPackage,
+            journal : CompletionJournal,
+            ) -> StreamAssembler:
+        assembler = StreamAssembler(
+            output_path=config.video_dir / f'{package.id.lower()}.mp4',
+            state_path=config.tmp_journal_dir / f'{package.id.lower()}.assembler',
+            spill_dir=config.tmp_ts_dir / f'{package.id.lower()}',
+            total=journal.total,
+            max_buffer_bytes=config.stream_buffer_bytes,
+        )
+        assembler.open(journal)
+        self._assemblers[package.id.lower()] = assembler
+        logger.info(f"边下载边合并:{package.id}, 已写入{assembler.next_index}/{journal.total}个ts")
+        return assembler
 
     def _pause_exit_handler(self, signum, frame) -> None:
         logger.info("收到暂停信号,暂停下载...")
@@ -194,8 +571,6 @@ class Downloader:
         package : DownloadPackage,
         ) -> Dict:
         tmp_m3u8 = config.tmp_m3u8_dir / f'{package.id.lower()}.m3u8'
-        tmp_key = config.tmp_key_dir / f'{package.id.lower()}.key'
-        tmp_iv = config.tmp_iv_dir / f'{package.id.lower()}.iv'
         tmp_ts_dir = config.tmp_ts_dir / f'{package.id.lower()}'
         tmp_ts_dir.mkdir(parents=True, exist_ok=True)
         if self._use_ffmpeg:
@@ -204,8 +579,6 @@ class Downloader:
             list_file_path = None
         return {
             'tmp_m3u8' : tmp_m3u8,
-            'tmp_key' : tmp_key,
-            'tmp_iv' : tmp_iv,
             'tmp_ts_dir' : tmp_ts_dir,
             'list_file_path' : list_file_path,
         }
@@ -223,19 +596,6 @@ class Downloader:
             session.proxies.update(config.proxies)
         session.headers.update(config.headers)
     
-    def decrypt_ts(
-            self,
-            tmp_ts_dir : Path,
-            key : bytes,
-            iv : str,
-            ts_name : str,
-            ) -> None:
-        ts_path = tmp_ts_dir / ts_name
-        with open(ts_path, 'rb') as f:
-            decrypted_data = self._decrypter.decrypt(f.read(), key, iv)
-        with open(ts_path, 'wb') as f:
-            f.write(decrypted_data)
-    
     @staticmethod
     def _write_tmp_file(
             file_path : Path, 
@@ -258,217 +618,853 @@ class Downloader:
     @staticmethod
     def _load_tmp(
         package : DownloadPackage,
-        tmp_file_type : Union[str, List[str]],
+        tmp_file_type : str = 'm3u8',
     ) -> Union[Dict, None]:
-        if isinstance(tmp_file_type, str):
-            if tmp_file_type == 'm3u8':
-                file_path = config.tmp_m3u8_dir / f'{package.id.lower()}.m3u8'
-            elif tmp_file_type == 'key':
-                file_path = config.tmp_key_dir / f'{package.id.lower()}.key'
-            elif tmp_file_type == 'iv':
-                file_path = config.tmp_iv_dir / f'{package.id.lower()}.iv'
-            else:
-                logger.error("不支持的临时文件类型, 仅支持m3u8, key, iv")
-                return None
-            if file_path.exists():
-                if tmp_file_type == 'm3u8' or tmp_file_type == 'iv':
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        return {tmp_file_type: f.read()}
-                with open(file_path, 'rb') as f:
-                    return {tmp_file_type: f.read()}
+        '''
+        读取临时目录中的m3u8, 密钥按ts从密钥缓存获取, 不再保存到临时目录
+        '''
+        if tmp_file_type != 'm3u8':
+            logger.error("不支持的临时文件类型, 仅支持m3u8")
             return None
-        elif isinstance(tmp_file_type, list):
-            tmp_file_dict = {}
-            for tf in tmp_file_type:
-                if tf == 'm3u8':
-                    file_path = config.tmp_m3u8_dir / f'{package.id.lower()}.m3u8'
-                elif tf == 'key':
-                    file_path = config.tmp_key_dir / f'{package.id.lower()}.key'
-                elif tf == 'iv':
-                    file_path = config.tmp_iv_dir / f'{package.id.lower()}.iv'
-                else:
-                    logger.error("不支持的临时文件类型, 仅支持m3u8, key, iv")
-                    continue
-                if file_path.exists():
-                    if tf == 'm3u8' or tf == 'iv':
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            tmp_file_dict[tf] = f.read()
-                    else:
-                        with open(file_path, 'rb') as f:
-                            tmp_file_dict[tf] = f.read()
-                else:
-                    tmp_file_dict[tf] = None
-            return tmp_file_dict
-    
-    def _validate_load_tmp(
-        self,
-        package : DownloadPackage,
-        tmp_file_types : Union[str, List[str]],
-        callback : Callable,
-        ) -> Any:
-        '''
-        检验临时文件是否存在,根据不同文件的存在与否返回不同的重加载方法
-        '''
-        if isinstance(tmp_file_types, str):
-            tmp_file = self._load_tmp(package, tmp_file_types)
-            if not tmp_file and callback:
-                return callback()
-            return tmp_file
-        elif isinstance(tmp_file_types, list):
-            tmp_files = self._load_tmp(package, tmp_file_types)
-            if 'm3u8' in tmp_file_types and not tmp_files.get('m3u8', None):
-                return callback()
-            if 'key' in tmp_file_types and not tmp_files.get('key', None):
-                return callback()
-            if 'iv' in tmp_file_types and not tmp_files.get('iv', None):
-                if 'm3u8' in tmp_files:
-                    iv = m3u8.loads(tmp_files['m3u8']).keys[0].iv
-                    tmp_files['iv'] = iv
-                else:    
-                    return callback()
-            return tmp_files
+        file_path = config.tmp_m3u8_dir / f'{package.id.lower()}.m3u8'
+        if file_path.exists():
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return {tmp_file_type: f.read()}
+        return None
     
     async def _async_download_ts(
                 self, 
                 package : DownloadPackage,
-                segments : m3u8.SegmentList,
+                segments : List[Tuple[int, PlannedSegment]],
                 base_url : str,
                 tmp_folder_name : str,
-                key_bytes : bytes,
-                iv : str,
+                session : aiohttp.ClientSession,
+                scheduler : SegmentScheduler,
+                media_sequence : int = 0,
                 ) -> None:
+        '''
+        由固定数量的工作协程从队列中取出ts下载,内存占用不随ts数量增长.
+        失败的ts归还连接后按退避时间重新入队,工作协程继续下载其他ts.
+        每个ts使用自己的密钥与iv, 密钥从所有视频共用的缓存中获取.
+        m3u8地址在估计的有效期到达前主动刷新,出现过期错误时也只刷新m3u8,
+        未完成的ts按媒体序号换成新地址继续下载,正在下载的ts不受影响;
+        403,多次刷新仍然过期或m3u8的分段发生变化时一次取消所有工作协程以及等待重新入队的ts
+        '''
         tmp_ts_dir = config.tmp_ts_dir / tmp_folder_name
         tmp_ts_dir.mkdir(parents=True, exist_ok=True)
-        async with aiohttp.ClientSession() as session:
-            logger.info('开始下载ts文件...')
-            self._init_session(session=session, is_async=True)
-            semaphore = asyncio.Semaphore(config.max_ts_concurrency)
-
-            tasks = []
-            logger.info(f"开始下载{len(segments)}个ts文件...")
-            for segment in segments:
-                task = asyncio.create_task(self._download_single_ts(
-                    session=session,
-                    segment=segment,
-                    base_url=base_url,
-                    tmp_ts_dir=tmp_ts_dir,
-                    key_bytes=key_bytes,
-                    iv=iv,
-                    semaphore=semaphore,
-                    _package = package,
-                ))
-                tasks.append(task)
-            done, pending = await asyncio.wait(
-                tasks, 
-                return_when=asyncio.FIRST_EXCEPTION
-                )
-            m3u8_expired = False
-            forbidden_error = False
-            for task in done:
-                if task.exception() and isinstance(task.exception(), M3u8ExpiredException):
-                    m3u8_expired = True
-                    break
-                if task.exception() and isinstance(task.exception(), ForbiddenError):
-                    forbidden_error = True
-                    break
-            if forbidden_error:
-                package.status = DownloadStatus.FAILED
-                raise ForbiddenError("403 forbidden, 请更换IP")
-            if m3u8_expired:
-                for task in pending:
-                    task.cancel()
-                await self._redownload(package=package)
-            else:
-                if pending:
-                    await asyncio.wait(pending)
+        logger.info(f"开始下载{len(segments)}个ts文件...")
+        loop = asyncio.get_running_loop()
+        queue : asyncio.Queue = asyncio.Queue()
+        jobs = [_SegmentJob(index, segment) for index, segment in segments]
+        for job in jobs:
+            queue.put_nowait(job)
+        remaining = len(jobs)
+        finished = asyncio.Event()
+        timers : List[asyncio.TimerHandle] = []
+        lifetime = self._token_lifetime(package)
+        journal = self._journals.get(package.id.lower())
+        total = journal.total if journal is not None else max(job.index for job in jobs) + 1
+        generation = 0
+        expired_streak = 0
+        refreshing : Optional[asyncio.Task] = None
+
+        async def _refresh() -> None:
+            '''
+            重新获取m3u8,把所有ts换成新m3u8中对应的地址
+            '''
+            nonlocal generation, media_sequence
+            await asyncio.to_thread(self._download_m3u8, package=package)
+            plan = await asyncio.to_thread(self._load_plan, package)
+            mapped = plan.locate(media_sequence, total)
+            if mapped is None:
+                raise M3u8ExpiredException("刷新后的m3u8分段已变化")
+            for job in jobs:
+                job.segment = mapped[job.index]
+            media_sequence = plan.media_sequence
+            generation += 1
+            self._on_playlist_fetched(package, plan)
+            logger.info(f"{package.id}的m3u8已刷新,剩余{remaining}个ts使用新地址继续下载")
+
+        def _request_refresh() -> asyncio.Task:
+            nonlocal refreshing
+            if refreshing is None or refreshing.done():
+                refreshing = asyncio.create_task(_refresh())
+            return refreshing
+
+        async def _refresher() -> None:
+            '''
+            在估计的有效期到达前主动刷新m3u8, 刷新失败时按退避时间重试,
+            连续失败config.max_retries次后停止, 等待下载中出现过期错误再处理
+            '''
+            failures = 0
+            while True:
+                delay = lifetime.refresh_delay()
+                await asyncio.sleep(delay if delay is not None else config.m3u8_refresh_poll)
+                if delay is None:
+                    continue
+                logger.info(f"{package.id}的m3u8即将过期,主动刷新")
+                try:
+                    await asyncio.shield(_request_refresh())
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    if failures >= config.max_retries:
+                        logger.warning(f"主动刷新m3u8连续失败{failures}次, 停止主动刷新, 错误信息:{e}")
+                        return
+                    wait_time = self._retry_delay(failures - 1)
+                    logger.warning(f"主动刷新m3u8失败, {wait_time:.1f}秒后重试, 错误信息:{e}")
+                    await asyncio.sleep(wait_time)
+
+        async def _worker() -> None:
+            nonlocal remaining, expired_streak
+            while True:
+                job : _SegmentJob = await queue.get()
+                attempt_generation = generation
+                try:
+                    key_bytes = await self._segment_key(session, base_url, job.segment)
+                    transfer = job.transfer
+                    if transfer is not None and (transfer.key_bytes != key_bytes or transfer.iv != job.segment.iv):
+                        # 刷新后密钥变化, 已接收的部分无法继续使用
+                        logger.warning(f"ts的密钥已变化, 重新下载: {job.segment.uri}")
+                        await self._discard_transfer(transfer, scheduler)
+                        transfer = None
+                    if transfer is None:
+                        job.transfer = _SegmentTransfer(
+                            job.segment.iv,
+                            key=package.id.lower(),
+                            proxy=config.proxies['http'],
+                            key_bytes=key_bytes,
+                        )
+                    outcome = await self._download_single_ts(
+                        session=session,
+                        job=job,
+                        tmp_ts_dir=tmp_ts_dir,
+                        base_url=base_url,
+                        scheduler=scheduler,
+                        _package=package,
+                    )
+                except M3u8ExpiredException as e:
+                    # 在刷新之前发出的请求过期时直接使用新地址重试
+                    if attempt_generation == generation:
+                        if not isinstance(e, SuspectedExpiryError):
+                            lifetime.on_expired()
+                        expired_streak += 1
+                        if expired_streak > config.max_retries:
+                            raise
+                        try:
+                            await asyncio.shield(_request_refresh())
+                        except M3u8ExpiredException:
+                            raise
+                        except Exception as e:
+                            raise M3u8ExpiredException(f"刷新m3u8失败: {e}") from e
+                    queue.put_nowait(job)
+                    continue
+                if outcome == _ATTEMPT_DONE:
+                    expired_streak = 0
+                if outcome != _ATTEMPT_DONE and job.retries < config.max_retries - 1:
+                    job.retries += 1
+                    if outcome == _ATTEMPT_RETRY_NOW:
+                        queue.put_nowait(job)
+                    else:
+                        wait_time = self._retry_delay(job.retries - 1)
+                        logger.info(f"重试第{job.retries}次,{wait_time:.1f}秒后重新排队...")
+                        timers.append(loop.call_later(wait_time, queue.put_nowait, job))
+                    continue
+                if outcome != _ATTEMPT_DONE:
+                    logger.error(f"下载ts文件失败,文件名:{job.segment.uri},重试次数已用完,原因:{job.transfer.reason}")
+                    self._dead_letters.setdefault(package.id.lower(), {})[job.index] = job.transfer.reason
+                if scheduler.memory is not None:
+                    scheduler.memory.release(job.transfer.held)
+                job.transfer = None
+                remaining -= 1
+                if remaining == 0:
+                    finished.set()
+
+        worker_count = min(len(jobs), config.ts_workers or self._worker_limit or self._connection_limit())
+        workers = [asyncio.create_task(_worker()) for _ in range(worker_count)]
+        waiter = asyncio.create_task(finished.wait())
+        refresher = asyncio.create_task(_refresher())
+        try:
+            await asyncio.wait([waiter, *workers], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            refresher.cancel()
+            if refreshing is not None:
+                refreshing.cancel()
+            for timer in timers:
+                timer.cancel()
+            for worker in workers:
+                worker.cancel()
+            results = await asyncio.gather(*workers, return_exceptions=True)
+            for job in jobs:
+                if job.transfer is not None and scheduler.memory is not None:
+                    scheduler.memory.release(job.transfer.held)
+        error = next(
+            (result for result in results
+             if isinstance(result, BaseException) and not isinstance(result, asyncio.CancelledError)),
+            None,
+        )
+        if isinstance(error, ForbiddenError):
+            package.status = DownloadStatus.FAILED
+            raise ForbiddenError("403 forbidden, 请更换IP")
+        if isinstance(error, M3u8ExpiredException):
+            # 由外层重新获取m3u8后再下载剩余的ts
+            logger.warning(f"{package.id}的m3u8已过期,重新获取后继续下载")
+        elif error is not None:
+            raise error
+
+    @staticmethod
+    async def _discard_transfer(transfer : '_SegmentTransfer', scheduler : SegmentScheduler) -> None:
+        '''
+        放弃ts已接收的部分: 归还内存预算, 清空缓冲区并删除未完成的临时文件
+        '''
+        if scheduler.memory is not None:
+            scheduler.memory.release(transfer.held)
+        transfer.held = 0
+        if transfer.buffer is not None:
+            transfer.buffer.clear()
+        if transfer.file_path is not None and transfer.file_path.suffix == '.part':
+            await asyncio.to_thread(transfer.file_path.unlink, missing_ok=True)
 
     async def _download_single_ts(
             self,
             session : aiohttp.ClientSession,
-            segment : m3u8.Segment,
+            job : '_SegmentJob',
             tmp_ts_dir : Path,
             base_url : str,
-            key_bytes : bytes,
-            iv : str,
-            semaphore : asyncio.Semaphore,
+            scheduler : SegmentScheduler,
             *,
             _package : DownloadPackage = None,
+            ) -> str:
+        '''
+        尝试下载一次ts,下载时间超过对冲阈值时发起对冲请求,先完成的一方生效
+
+        Returns:
+            str: 本次尝试的结果, _ATTEMPT_DONE, _ATTEMPT_RETRY 或 _ATTEMPT_RETRY_NOW
+        '''
+        transfer = job.transfer
+        fetch = dict(
+            session=session,
+            index=job.index,
+            segment=job.segment,
+            tmp_ts_dir=tmp_ts_dir,
+            base_url=base_url,
+            key_bytes=transfer.key_bytes,
+            scheduler=scheduler,
+            package=_package,
+        )
+        if self._hedger is None:
+            return await self._fetch_segment(transfer=transfer, **fetch)
+        transfer.started.clear()
+        primary = asyncio.create_task(self._fetch_segment(transfer=transfer, **fetch))
+        tasks = {primary : transfer}
+        hedge = None
+        try:
+            started = asyncio.create_task(transfer.started.wait())
+            await asyncio.wait({primary, started}, return_when=asyncio.FIRST_COMPLETED)
+            started.cancel()
+            delay = self._hedger.threshold()
+            if not primary.done() and delay is not None:
+                elapsed = time.monotonic() - transfer.start_time
+                await asyncio.wait({primary}, timeout=max(0.0, delay - elapsed))
+            if not primary.done() and delay is not None:
+                # 下载时间超过最近ts耗时的分位数,发起对冲请求,先完成的一方生效
+                logger.info(f"ts下载过慢,发起对冲请求: {job.segment.uri}")
+                hedge = _SegmentTransfer(
+                    transfer.iv,
+                    key=_package.id.lower(),
+                    tag='hedge',
+                    proxy=config.hedge_proxy or config.proxies['http'],
+                    key_bytes=transfer.key_bytes,
+                )
+                hedge.rival, transfer.rival = transfer, hedge
+                self._hedger.on_issued()
+                tasks[asyncio.create_task(self._fetch_segment(transfer=hedge, **fetch))] = hedge
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if any(tasks[task].finished for task in done):
+                    break
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            winner = next((item for item in tasks.values() if item.finished), None)
+            if winner is None:
+                for task in tasks:
+                    if not task.cancelled() and task.exception() is not None:
+                        raise task.exception()
+                return primary.result()
+            self._hedger.record(time.monotonic() - transfer.start_time)
+            if winner is hedge:
+                self._hedger.on_won()
+                logger.info(f"对冲请求先完成: {job.segment.uri}")
+            return _ATTEMPT_DONE
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            transfer.rival = None
+            if hedge is not None:
+                if scheduler.memory is not None:
+                    scheduler.memory.release(hedge.held)
+                # 未被采用的一方留下的临时文件, 两方都失败时保留原请求的进度用于续传
+                loser = transfer if hedge.finished else hedge
+                if not loser.finished and loser.file_path is not None and loser.file_path.suffix == '.part':
+                    await asyncio.to_thread(loser.file_path.unlink, missing_ok=True)
+
+    async def _fetch_segment(
+            self,
+            session : aiohttp.ClientSession,
+            index : int,
+            segment : PlannedSegment,
+            tmp_ts_dir : Path,
+            base_url : str,
+            key_bytes : bytes,
+            transfer : '_SegmentTransfer',
+            scheduler : SegmentScheduler,
+            package : DownloadPackage,
+            ) -> str:
+        '''
+        在分配到的连接上下载一次ts. 失败时不在连接上等待,由工作协程决定何时重新入队
+        '''
+        key = package.id.lower()
+        ts_url = urljoin(base_url, segment.uri)
+        async with scheduler.slot(key):
+            transfer.begin()
+            headers = {}
+            if segment.byterange is not None:
+                # ts是文件中的一段, 续传时也只请求该段中缺少的字节
+                length, offset = segment.byterange
+                headers['Range'] = f'bytes={offset + transfer.resume_position}-{offset + length - 1}'
+                logger.info(f"下载ts文件: {segment.uri}, 字节范围:{headers['Range']}")
+            elif transfer.resume_position:
+                # 保留已接收的部分,只请求缺少的字节
+                headers['Range'] = f'bytes={transfer.resume_position}-'
+                logger.info(f"续传ts文件: {segment.uri}, 从{transfer.resume_position}字节开始")
+            else:
+                logger.info(f"下载ts文件: {segment.uri}")
+            start_time = time.monotonic()
+            try:
+                async with session.get(ts_url, headers=headers, proxy=transfer.proxy) as ts_response:
+                    if ts_response.status in (200, 206):
+                        nbytes = await self._receive_segment(
+                            package=package,
+                            index=index,
+                            response=ts_response,
+                            transfer=transfer,
+                            tmp_ts_dir=tmp_ts_dir,
+                            key_bytes=key_bytes,
+                            duration=segment.duration,
+                            session=session,
+                            ts_url=ts_url,
+                            scheduler=scheduler,
+                            byterange=segment.byterange,
+                        )
+                        scheduler.report_success(time.monotonic() - start_time, nbytes)
+                        if transfer.finished:
+                            self._dead_letters.get(key, {}).pop(index, None)
+                            async with asyncio.Lock():
+                                self._counters[key].increment()
+                        return _ATTEMPT_DONE
+                    elif ts_response.status == 403:
+                        logger.error(f"下载ts文件失败,url:{ts_url},状态码:{ts_response.status}")
+                        raise ForbiddenError(f"403 forbidden, url:{ts_url}")
+                    elif ts_response.status == 410:
+                        logger.warning("m3u8文件已过期")
+                        raise M3u8ExpiredException("m3u8文件已过期")
+                    else:
+                        if ts_response.status in (429, 503):
+                            scheduler.report_failure('throttled')
+                        logger.warning(f"下载ts文件失败,url:{ts_url},状态码:{ts_response.status}")
+                    transfer.reason = f"状态码:{ts_response.status}"
+            except CorruptedSegmentError as e:
+                # 内容损坏与网络状况无关,立即重新下载
+                logger.warning(f"ts校验失败,url:{ts_url},原因:{e},重新下载")
+                transfer.reason = f"校验失败:{e}"
+                return _ATTEMPT_RETRY_NOW
+            except (asyncio.TimeoutError, aiohttp.ClientError, IncompleteSegmentError) as e:
+                logger.warning(f"下载ts文件失败,url:{ts_url}, 错误信息:{e}")
+                transfer.reason = f"{type(e).__name__}:{e}"
+                if isinstance(e, asyncio.TimeoutError):
+                    scheduler.report_failure('timeout')
+                # 无法连接时可能是m3u8已过期, 但不能确定, 不用于估计有效期
+                if "Cannot connect to host" in str(e):
+                    raise SuspectedExpiryError("m3u8文件可能已过期")
+        return _ATTEMPT_RETRY
+
+    async def _segment_key(
+            self,
+            session : aiohttp.ClientSession,
+            base_url : str,
+            segment : PlannedSegment,
+            ) -> Optional[bytes]:
+        '''
+        获取解密ts的密钥, 未加密时返回None
+        '''
+        if segment.key_uri is None:
+            return None
+        return await _key_cache.get(
+            urljoin(base_url, segment.key_uri),
+            lambda key_url: self._fetch_key(session, key_url),
+        )
+
+    async def _fetch_key(self, session : aiohttp.ClientSession, key_url : str) -> bytes:
+        '''
+        下载AES-128密钥
+
+        Raises:
+            KeyFetchError: 重试次数用完仍未获取到16字节的密钥
+        '''
+        for retry_count in range(config.max_retries):
+            try:
+                async with session.get(key_url, proxy=config.proxies['http']) as response:
+                    if response.status == 200:
+                        key_bytes = await response.read()
+                        if len(key_bytes) == 16:
+                            logger.info(f"已获取密钥: {key_url}")
+                            return key_bytes
+                        logger.warning(f"密钥长度错误,url:{key_url},长度:{len(key_bytes)}")
+                    elif response.status == 403:
+                        raise ForbiddenError(f"403 forbidden, url:{key_url}")
+                    elif response.status == 410:
+                        raise M3u8ExpiredException("密钥地址已过期")
+                    else:
+                        logger.warning(f"下载密钥失败,url:{key_url},状态码:{response.status}")
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                logger.warning(f"下载密钥失败,url:{key_url}, 错误信息:{e}")
+            if retry_count < config.max_retries - 1:
+                await asyncio.sleep(self._retry_delay(retry_count))
+        raise KeyFetchError(f"下载密钥失败: {key_url}")
+
+    def _token_lifetime(self, package : DownloadPackage) -> TokenLifetime:
+        key = package.id.lower()
+        if key not in self._lifetimes:
+            self._lifetimes[key] = TokenLifetime(config.m3u8_refresh_margin)
+        return self._lifetimes[key]
+
+    def _on_playlist_fetched(self, package : DownloadPackage, plan : DownloadPlan) -> None:
+        '''
+        获取m3u8后记录获取时间,并从m3u8与ts地址中解析过期时间
+        '''
+        urls = [package.hls_url]
+        if plan.segments:
+            urls.append(urljoin(package.base_url, plan.segments[0].uri))
+        lifetime = self._token_lifetime(package)
+        lifetime.on_fetched(urls)
+        if lifetime.lifetime is not None:
+            logger.info(f"{package.id}的m3u8估计有效期: {lifetime.lifetime:.0f}秒")
+
+    @staticmethod
+    def _retry_delay(retry_count : int) -> float:
+        '''
+        指数退避加随机抖动,避免同时失败的ts在同一时刻重试
+        '''
+        wait_time = min(config.retry_wait_time * (2 ** retry_count), config.retry_max_wait)
+        return random.uniform(wait_time / 2, wait_time)
+
+    async def _receive_segment(
+            self,
+            package : DownloadPackage,
+            index : int,
+            response : aiohttp.ClientResponse,
+            transfer : '_SegmentTransfer',
+            tmp_ts_dir : Path,
+            key_bytes : bytes,
+            duration : Optional[float],
+            session : aiohttp.ClientSession,
+            ts_url : str,
+            scheduler : SegmentScheduler,
+            byterange : Optional[Tuple[int, int]] = None,
+            ) -> int:
+        '''
+        分块接收ts并边接收边解密写入,内存中只保留当前块.
+        ts为文件中的一段(byterange)时只接受从该段对应位置开始的206响应.
+        写入每个ts一个文件时先写入 .part 文件,完成后再改名;
+        单文件存储按Content-Length预留位置,长度未知或边下载边合并时整个ts留在内存中,计入内存预算.
+        写入文件且服务器支持Range时,较大的ts利用空闲连接分成多段并行下载.
+        接收完成后校验MPEG-TS包结构,未通过校验的ts不会被记录为已完成.
+
+        Returns:
+            int: 本次接收的字节数
+        '''
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        assembler = self._assemblers.get(package.id.lower())
+        store = self._stores.get(package.id.lower())
+        budget = scheduler.memory
+        range_offset = byterange[1] if byterange is not None else 0
+        if response.status == 206:
+            if _content_range_start(response) != range_offset + transfer.resume_position:
+                transfer.reset()
+                raise IncompleteSegmentError(f"续传位置不匹配: {response.headers.get('Content-Range')}")
+        elif byterange is not None:
+            # 服务器忽略了Range, 返回的是整个文件
+            transfer.reset()
+            raise IncompleteSegmentError(f"服务器不支持字节范围请求, 状态码:{response.status}")
+        else:
+            transfer.reset()
+            # 刷新m3u8后新地址返回的ts长度可能不同, 之前按旧长度预留的位置与内存预算不再可用
+            if transfer.prepared and response.content_length != transfer.length:
+                logger.info(f"ts长度已改变: {transfer.length} -> {response.content_length}, 重新分配")
+                await self._discard_transfer(transfer, scheduler)
+                transfer.buffer = None
+                transfer.file_path = None
+                transfer.prepared = False
+        if not transfer.prepared:
+            length = response.content_length
+            if assembler is not None or (store is not None and not length):
+                transfer.buffer = bytearray()
+                # 整个ts留在内存中时一次预留,避免多个ts各自持有部分预算而互相等待
+                if budget is not None and length:
+                    await budget.acquire(length)
+                    transfer.held = length
+            elif store is not None:
+                transfer.file_path = store.data_path
+                transfer.offset = store.allocate(length)
+            else:
+                tag = f'.{transfer.tag}' if transfer.tag else ''
+                transfer.file_path = tmp_ts_dir / f'{self._ts_name(index)}{tag}.part'
+            transfer.length = length
+            transfer.prepared = True
+        before = transfer.received
+        extra = 0
+        if response.status == 200 and transfer.file_path is not None and transfer.length \
+                and config.ts_split_size and transfer.length > config.ts_split_size \
+                and response.headers.get('Accept-Ranges') == 'bytes':
+            wanted = -(-transfer.length // config.ts_split_size) - 1
+            while extra < wanted and scheduler.try_acquire(package.id.lower()):
+                extra += 1
+        if extra:
+            transfer.split(extra + 1)
+            logger.info(f"ts文件较大,分成{extra + 1}段并行下载,长度:{transfer.length}")
+            tasks = [asyncio.create_task(self._pump(transfer, transfer.parts[0], response, key_bytes, budget))]
+            for part in transfer.parts[1:]:
+                tasks.append(asyncio.create_task(self._fetch_part(
+                    session, ts_url, transfer, part, key_bytes, scheduler, package.id.lower(),
+                )))
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                transfer.reset()
+                raise
+            transfer.checksum = await loop.run_in_executor(
+                executor, read_checksum, transfer.file_path, transfer.offset, transfer.length,
+            )
+        else:
+            await self._pump(transfer, transfer.parts[0], response, key_bytes, budget)
+        written = transfer.received
+        received = written - before
+        if transfer.length and written != transfer.length:
+            raise IncompleteSegmentError(f"ts长度不完整: {written}/{transfer.length}")
+        if self._validator is not None:
+            if transfer.buffer is not None:
+                problem = await loop.run_in_executor(
+                    executor, self._validator.validate, transfer.buffer, duration,
+                )
+            else:
+                problem = await loop.run_in_executor(
+                    executor, self._validator.validate_file, transfer.file_path, transfer.offset, written, duration,
+                )
+            if problem:
+                transfer.reset()
+                raise CorruptedSegmentError(problem)
+        if not transfer.claim():
+            return received
+        if assembler is not None:
+            # 缓冲区交给合并器, 不再复制
+            data, transfer.buffer = transfer.buffer, None
+            buffer = self._charge_reorder_buffer(package, index, len(data), budget)
+            for done_index in await asyncio.to_thread(assembler.add, index, data, buffer):
+                self._release_reorder_buffer(package, done_index, budget)
+                self._mark_done(package, done_index)
+        elif store is not None:
+            if transfer.buffer is not None:
+                transfer.offset = store.allocate(written)
+                transfer.checksum = await loop.run_in_executor(
+                    executor, write_at, store.data_path, transfer.offset, transfer.buffer,
+                )
+            store.commit(index, transfer.offset, written, transfer.checksum)
+            self._mark_done(package, index)
+        else:
+            await asyncio.to_thread(_finish_part, transfer.file_path, tmp_ts_dir / self._ts_name(index), written)
+            self._mark_done(package, index)
+        return received
+
+    def _charge_reorder_buffer(
+            self,
+            package : DownloadPackage,
+            index : int,
+            nbytes : int,
+            budget : Optional[ByteBudget],
+            ) -> bool:
+        '''
+        ts交给合并器前预先计入内存预算, 写入视频文件或落盘后由 _release_reorder_buffer 归还.
+        所有视频的重排缓冲区最多占用一半预算, 超过时乱序的ts直接落盘, 剩余预算留给正在下载的ts, 队首的ts不会因预算不足无法下载
+
+        Returns:
+            bool: 是否允许放入重排缓冲区
+        '''
+        if budget is None:
+            return True
+        # 合并器重新打开后同一个ts可能再次交给合并器, 先归还之前的预算
+        self._release_reorder_buffer(package, index, budget)
+        if self._reorder_bytes + nbytes > budget.capacity // 2:
+            return False
+        budget.force(nbytes)
+        self._reorder_bytes += nbytes
+        self._reorder_charges.setdefault(package.id.lower(), {})[index] = nbytes
+        return True
+
+    def _release_reorder_buffer(
+            self,
+            package : DownloadPackage,
+            index : int,
+            budget : Optional[ByteBudget],
+            ) -> None:
+        nbytes = self._reorder_charges.get(package.id.lower(), {}).pop(index, 0)
+        if nbytes and budget is not None:
+            budget.release(nbytes)
+            self._reorder_bytes -= nbytes
+
+    def _release_reorder_charges(
+            self,
+            package : DownloadPackage,
+            budget : Optional[ByteBudget],
+            ) -> None:
+        '''
+        视频结束时归还仍在重排缓冲区中的ts占用的预算, 这些ts不会再写入, 只能在事件循环中调用
+        '''
+        for index in list(self._reorder_charges.get(package.id.lower(), {})):
+            self._release_reorder_buffer(package, index, budget)
+        self._reorder_charges.pop(package.id.lower(), None)
+
+    async def _pump(
+            self,
+            transfer : '_SegmentTransfer',
+            part : '_RangePart',
+            response : aiohttp.ClientResponse,
+            key_bytes : bytes,
+            budget : Optional[ByteBudget] = None,
+            read_iv : bool = False,
             ) -> None:
-        async with semaphore:
+        '''
+        从响应中读取一段数据并解密写入,进度记录在part中,出错时已写入的部分保留.
+        CBC解密按16字节对齐分块,每块的iv为上一块最后16字节密文,工作池中的解密不需要保存状态.
+        整个ts留在内存中且长度已知时预先分配缓冲区,使用线程池时每块直接解密到缓冲区中对应的位置.
+
+        Args:
+            read_iv (bool): 响应以该段之前的16字节密文开头,读出作为该段的iv
+        '''
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        encrypted = bool(key_bytes and transfer.iv)
+        sequential = len(transfer.parts) == 1
+        # 线程池与事件循环共享内存, 可以传入切片视图并解密到缓冲区中
+        shared = isinstance(executor, ThreadPoolExecutor)
+        if transfer.buffer is not None and transfer.length and len(transfer.buffer) < transfer.length:
+            transfer.buffer.extend(bytes(transfer.length - len(transfer.buffer)))
+        if read_iv:
+            part.iv = await response.content.readexactly(16)
+        carry = b''
+        held = 0
+        try:
+            async for chunk in response.content.iter_chunked(config.ts_chunk_size):
+                if self._limiter is not None:
+                    await self._limiter.consume(transfer.key, len(chunk))
+                if part.end is not None:
+                    chunk = chunk[:part.end - part.position - len(carry)]
+                if budget is not None:
+                    if transfer.buffer is None:
+                        await budget.acquire(len(chunk))
+                        held += len(chunk)
+                    elif not transfer.length:
+                        # 长度未知时无法预留,已经持有预算的ts不再等待
+                        if transfer.held:
+                            budget.force(len(chunk))
+                        else:
+                            await budget.acquire(len(chunk))
+                        transfer.held += len(chunk)
+                data = carry + chunk if carry else chunk
+                if encrypted:
+                    aligned = len(data) - len(data) % 16
+                    # 按16字节对齐切分, 线程池中使用视图避免复制
+                    head = memoryview(data)[:aligned] if shared and aligned != len(data) else data[:aligned]
+                    data, carry = head, data[aligned:]
+                    next_iv = bytes(data[-16:])
+                if data:
+                    buffer = transfer.buffer
+                    if buffer is not None:
+                        start, end = part.position, part.position + len(data)
+                        if not encrypted:
+                            buffer[start:end] = data
+                        elif shared and len(buffer) >= end:
+                            output = memoryview(buffer)[start:end]
+                            await loop.run_in_executor(
+                                executor, _decrypt_into, self._decrypter, data, output, key_bytes, part.iv,
+                            )
+                            # 解密完成后释放视图, 之后才能改变缓冲区大小; 被取消时工作线程可能仍在写入, 由垃圾回收释放
+                            output.release()
+                        else:
+                            buffer[start:end] = await loop.run_in_executor(
+                                executor, _decrypt, self._decrypter, data, key_bytes, part.iv,
+                            )
+                    else:
+                        checksum = await loop.run_in_executor(
+                            executor,
+                            _decrypt_and_write_at,
+                            self._decrypter,
+                            data,
+                            transfer.file_path,
+                            transfer.offset + part.position,
+                            key_bytes,
+                            part.iv,
+                            transfer.checksum if sequential else 0,
+                        )
+                        if sequential:
+                            transfer.checksum = checksum
+                    if encrypted:
+                        part.iv = next_iv
+                    part.position += len(data)
+                if budget is not None and held:
+                    budget.release(held)
+                    held = 0
+                if part.end is not None and part.position >= part.end:
+                    return
+        finally:
+            if budget is not None:
+                budget.release(held)
+        if carry:
+            raise IncompleteSegmentError(f"ts长度不是16的整数倍: {part.position + len(carry)}")
+        if part.end is not None:
+            raise IncompleteSegmentError(f"分段数据不完整: {part.position}/{part.end}")
+
+    async def _fetch_part(
+            self,
+            session : aiohttp.ClientSession,
+            ts_url : str,
+            transfer : '_SegmentTransfer',
+            part : '_RangePart',
+            key_bytes : bytes,
+            scheduler : SegmentScheduler,
+            key : str,
+            ) -> None:
+        '''
+        通过Range请求下载ts的一段,占用调用前已经分配到的连接并在结束时归还.
+        该段的iv为它之前的16字节密文,与该段一起请求.
+        '''
+        try:
             for retry_count in range(config.max_retries):
-                ts_url = urljoin(base_url, segment.uri)
-                logger.info(f"下载ts文件: {segment.uri}")
+                read_iv = bool(key_bytes and transfer.iv) and part.iv is None
+                start = part.position - 16 if read_iv else part.position
                 try:
-                    async with session.get(ts_url, proxy=config.proxies['http']) as ts_response:
-                        if ts_response.status == 200:
-                            content  = await ts_response.content.read()
-                            with open(tmp_ts_dir / segment.uri, "wb") as f:
-                                f.write(content)
-                            if key_bytes and iv:
-                                self.decrypt_ts(
-                                    tmp_ts_dir = tmp_ts_dir,
-                                    key = key_bytes,
-                                    iv = iv,
-                                    ts_name = segment.uri
-                                )
-                            async with asyncio.Lock():
-                                self._counters[_package.id.lower()].increment()
+                    async with session.get(
+                        ts_url,
+                        headers={'Range': f'bytes={start}-{part.end - 1}'},
+                        proxy=transfer.proxy,
+                        ) as response:
+                        if response.status == 206 and _content_range_start(response) == start:
+                            await self._pump(transfer, part, response, key_bytes, scheduler.memory, read_iv)
                             return
-                        elif ts_response.status == 403:
-                            logger.error(f"下载ts文件失败,url:{ts_url},状态码:{ts_response.status}")
+                        if response.status == 403:
                             raise ForbiddenError(f"403 forbidden, url:{ts_url}")
-                        elif ts_response.status == 410:
-                            logger.warning("m3u8文件已过期")
+                        if response.status == 410:
                             raise M3u8ExpiredException("m3u8文件已过期")
-                        else:
-                            logger.warning(f"下载ts文件失败,url:{ts_url},状态码:{ts_response.status}")
-                except (asyncio.TimeoutError, aiohttp.ClientError) as e:
-                    logger.warning(f"下载ts文件失败,url:{ts_url}, 错误信息:{e}")
-                    # 加入M3u8ExpiredException异常处理
-                    if "Cannot connect to host" in str(e):
-                        raise M3u8ExpiredException("m3u8文件已过期")
+                        if response.status == 200:
+                            logger.warning(f"服务器未按Range返回,url:{ts_url}")
+                            break
+                        logger.warning(f"分段下载失败,url:{ts_url},状态码:{response.status}")
+                except (asyncio.TimeoutError, aiohttp.ClientError, IncompleteSegmentError) as e:
+                    logger.warning(f"分段下载失败,url:{ts_url}, 错误信息:{e}")
                 if retry_count < config.max_retries - 1:
-                    wait_time = config.retry_wait_time * (2 ** retry_count)
-                    logger.info(f"重试第{retry_count+1}次,等待{wait_time}秒...")
-                    await asyncio.sleep(wait_time)
-            logger.error(f"下载ts文件失败,url:{ts_url},重试次数已用完")
-    
+                    await asyncio.sleep(self._retry_delay(retry_count))
+            raise IncompleteSegmentError(f"分段下载失败: {part.start}-{part.end}")
+        finally:
+            scheduler.release(key)
+
     def _merge_ts_without_ffmpeg(
             self,
             package : DownloadPackage,
+            plan : Optional[DownloadPlan] = None,
             ) -> None:
-        ts_file_path = config.tmp_ts_dir / package.id.lower()
-        ts_files = []
-        for file in ts_file_path.iterdir():
-            if self._ts_is_corrupted(file):
-                logger.warning(f"文件损坏,文件名:{file.name}")
-                continue
-            ts_files.append(file)
-        ts_files.sort(key=lambda x: int(x.name.split('.')[0]))
-        with open(config.video_dir / f'{package.id.lower()}.mp4', 'wb') as f:
-            for file in ts_files:
-                with open(file, 'rb') as ts_file:
-                    while True:
-                        chunk = ts_file.read(1024 * 1024)
-                        if not chunk:
-                            break
-                        f.write(chunk)
+        '''
+        按下载计划的顺序合并ts, 缺少任何一个ts时不合并
+
+        Raises:
+            SegmentsFailedError: 临时目录中缺少计划中的ts
+        '''
+        store = self._stores.get(package.id.lower())
+        if store is not None:
+            store.copy_into(config.video_dir / f'{package.id.lower()}.mp4')
+            os.rename(config.video_dir / f'{package.id.lower()}.mp4', config.video_dir / f'{package.id.upper()} {package.name} {package.actress}.mp4')
+            logger.info(f"视频合并完成,输出文件:{config.video_dir / f'{package.id.upper()} {package.name} {package.actress}.mp4'}")
+            return
+        if plan is None:
+            plan = self._load_plan(package)
+        ts_files = self._planned_ts_files(package, plan)
+        sizes = [file.stat().st_size for file in ts_files]
+        # 预分配输出文件后由内核直接复制,不经过用户态缓冲
+        output_fd = os.open(
+            config.video_dir / f'{package.id.lower()}.mp4',
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0),
+            0o644,
+        )
+        try:
+            preallocate(output_fd, sum(sizes))
+            offset = 0
+            for file, size in zip(ts_files, sizes):
+                ts_fd = os.open(file, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+                try:
+                    copy_range(ts_fd, output_fd, size, 0, offset)
+                finally:
+                    os.close(ts_fd)
+                offset += size
+        finally:
+            os.close(output_fd)
         os.rename(config.video_dir / f'{package.id.lower()}.mp4', config.video_dir / f'{package.id.upper()} {package.name} {package.actress}.mp4')
         logger.info(f"视频合并完成,输出文件:{config.video_dir / f'{package.id.upper()} {package.name} {package.actress}.mp4'}")
 
+    def _planned_ts_files(
+            self,
+            package : DownloadPackage,
+            plan : DownloadPlan,
+            ) -> List[Path]:
+        '''
+        按下载计划的顺序返回临时目录中的ts文件
+
+        Raises:
+            SegmentsFailedError: 临时目录中缺少计划中的ts
+        '''
+        ts_file_path = config.tmp_ts_dir / package.id.lower()
+        # ts在接收时已经校验过, 校验通过后才会改名为 .ts 文件
+        ts_files = [ts_file_path / segment.filename for segment in plan.segments]
+        missing = [file.name for file in ts_files if not file.exists()]
+        if missing:
+            logger.error(f"{package.id}缺少{len(missing)}个ts文件, 无法合并: {', '.join(missing[:20])}")
+            raise SegmentsFailedError(f"{package.id}缺少{len(missing)}个ts文件")
+        return ts_files
+
     def _merge_ts_with_ffmpeg(
             self,
             package : DownloadPackage, 
             list_file_path : Path, 
-            m3u8_obj : m3u8.M3U8
+            plan : DownloadPlan,
             ) -> None:
+        '''
+        按下载计划的顺序用ffmpeg合并ts, 缺少任何一个ts时不合并
+
+        Raises:
+            SegmentsFailedError: 临时目录中缺少计划中的ts
+        '''
+        store = self._stores.get(package.id.lower())
+        if store is not None:
+            return self._merge_packed_with_ffmpeg(package=package, store=store)
+        ts_files = self._planned_ts_files(package, plan)
         with open(list_file_path, 'w', encoding='utf-8') as f:
-            for segment in m3u8_obj.segments:
-                filename : Path = config.tmp_ts_dir / f'{package.id.lower()}' / f'{segment.uri}'
-                if os.path.exists(filename):
-                    f.write(f"file '{filename.absolute().resolve()}'\n")
-                else:
-                    logger.warning('文件不存在')
+            for filename in ts_files:
+                f.write(f"file '{filename.absolute().resolve()}'\n")
         try:
             video_file_path : Path = config.video_dir / f'{package.id.lower()}.mp4'
             merge_command = [
@@ -484,38 +1480,135 @@ class Downloader:
         except subprocess.CalledProcessError as e:
             logger.error(f"合并视频片段失败:{e.stderr.decode('utf-8')}")
     
+    @staticmethod
+    def _run_ffmpeg_with_pipe(
+            merge_command : List[str],
+            chunks : Iterable[bytes],
+            ) -> None:
+        '''
+        通过标准输入向ffmpeg写入数据,标准错误在后台线程中读取,避免管道写满导致阻塞
+
+        Raises:
+            subprocess.CalledProcessError: ffmpeg返回非0
+        '''
+        process = subprocess.Popen(
+            merge_command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        stderr_chunks : List[bytes] = []
+        stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+        stderr_reader.start()
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+        return_code = process.wait()
+        stderr_reader.join()
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, merge_command, stderr=b''.join(stderr_chunks))
+
+    def _merge_packed_with_ffmpeg(
+            self,
+            package : DownloadPackage,
+            store : PackedSegmentStore,
+            ) -> None:
+        '''
+        单文件存储的ts按顺序通过管道交给ffmpeg封装,无需生成文件列表
+        '''
+        video_file_path : Path = config.video_dir / f'{package.id.lower()}.mp4'
+        merge_command = [
+            'ffmpeg', '-loglevel', 'error',
+            '-f', 'mpegts', '-i', 'pipe:0',
+            '-c', 'copy',
+            '-y',
+            str(video_file_path)
+        ]
+        try:
+            self._run_ffmpeg_with_pipe(merge_command, store.iter_chunks())
+            os.rename(config.video_dir / f'{package.id.lower()}.mp4', config.video_dir / f'{package.id.upper()} {package.name} {package.actress}.mp4')
+            logger.info(f"视频合并完成,输出文件:{config.video_dir / f'{package.id.upper()} {package.name} {package.actress}.mp4'}")
+        except subprocess.CalledProcessError as e:
+            logger.error(f"合并视频片段失败:{e.stderr.decode('utf-8')}")
+
+    def _finish_stream_ffmpeg(
+            self,
+            package : DownloadPackage,
+            ) -> bool:
+        '''
+        等待边下载边封装的ffmpeg结束
+
+        Returns:
+            bool: 是否封装成功,失败时ts仍在临时目录中,可以退回到普通合并
+        '''
+        streamer = self._streamers.pop(package.id.lower())
+        try:
+            streamer.finish(config.ffmpeg_finish_timeout)
+        except subprocess.CalledProcessError as e:
+            logger.error(f"边下载边封装失败,改用普通合并:{e.stderr.decode('utf-8')}")
+            streamer.abort()
+            return False
+        except subprocess.TimeoutExpired:
+            logger.error(f"边下载边封装超时,改用普通合并:{package.id}")
+            streamer.abort()
+            return False
+        os.rename(streamer.output_path, config.video_dir / f'{package.id.upper()} {package.name} {package.actress}.mp4')
+        logger.info(f"视频合并完成,输出文件:{config.video_dir / f'{package.id.upper()} {package.name} {package.actress}.mp4'}")
+        return True
+
+    def _finish_stream_merge(
+            self,
+            package : DownloadPackage,
+            ) -> None:
+        assembler = self._assemblers.pop(package.id.lower())
+        assembler.close()
+        if not assembler.finished:
+            logger.error(f"边下载边合并未完成,已写入{assembler.next_index}个ts")
+            raise ValueError(f"边下载边合并未完成:{package.id}")
+        assembler.remove_state()
+        os.rename(assembler.output_path, config.video_dir / f'{package.id.upper()} {package.name} {package.actress}.mp4')
+        logger.info(f"视频合并完成,输出文件:{config.video_dir / f'{package.id.upper()} {package.name} {package.actress}.mp4'}")
+
     @overload
     def _merge_ts(self, package : DownloadPackage) -> None:...
 
     @overload
-    def _merge_ts(self, package : DownloadPackage, list_file_path : Path, m3u8_obj : m3u8.M3U8) -> None:...
+    def _merge_ts(self, package : DownloadPackage, list_file_path : Path, plan : DownloadPlan) -> None:...
 
     def _merge_ts(
         self,
         package : DownloadPackage,
         list_file_path : Optional[Path] = None,
-        m3u8_obj : Optional[m3u8.M3U8] = None,
+        plan : Optional[DownloadPlan] = None,
         ) -> None:
         logger.info("正在合并TS文件...")
-        if self._use_ffmpeg and list_file_path is not None and m3u8_obj is not None:
+        if self._use_ffmpeg and list_file_path is not None and plan is not None:
             self._merge_ts_with_ffmpeg(
                 package=package,
                 list_file_path=list_file_path,
-                m3u8_obj=m3u8_obj,
+                plan=plan,
             )
         else:
-            self._merge_ts_without_ffmpeg(package=package)
+            self._merge_ts_without_ffmpeg(package=package, plan=plan)
     
     def _download_m3u8(
             self,
             package : DownloadPackage,
     ) -> bool:
         '''
-        下载m3u8文件,并判断视频是否加密,如果加密则下载密钥和iv,否则跳过下载
-        最后保存下载信息
+        下载m3u8文件并判断视频是否加密,最后保存下载信息.
+        密钥不在这里下载, 下载ts时按每个ts的密钥地址从共用的密钥缓存中获取.
+        只有状态码为200, 内容以#EXTM3U开头且包含ts的m3u8才会写入临时目录, 不会用过期页面替换已有的m3u8
 
         Returns:
             bool: 视频是否加密
+
+        Raises:
+            InvalidPlaylistError: m3u8已过期或内容无效
         '''
         dirs = self._init_dir(package)
         if _DOWNLOAD_INFO_PATH.exists():
@@ -530,74 +1623,38 @@ class Downloader:
             old_hls_url = package.hls_url
         for i in range(config.max_retries):
             try:
-                m3u8_str = requests.get(package.hls_url, headers = config.headers, proxies = config.proxies).text
-                m3u8_obj = m3u8.loads(m3u8_str)
-                is_encrypted_ = is_encrypted(m3u8_obj)
-                if is_encrypted_:
-                    logger.info("视频已加密, 开始下载密钥和iv")
-                    if os.path.exists(dirs['tmp_m3u8']):
-                        with open(dirs['tmp_m3u8'], 'r') as f:
-                            m3u8_file_str = f.read()
-                        if (
-                            hash(m3u8_file_str) == hash(m3u8_str)
-                            and hash(package.hls_url) == hash(old_hls_url) 
-                            and os.path.exists(dirs['tmp_key']) 
-                            and os.path.exists(dirs['tmp_iv'])
-                            ):
-                            logger.info("m3u8文件未变化, 跳过下载")
-                            return is_encrypted_
-                        else:
-                            iv = m3u8_obj.keys[0].iv
-                            key_uri = m3u8_obj.keys[0].uri
-                            key_bytes = requests.get(urljoin(package.base_url, key_uri), headers=config.headers, proxies=config.proxies).content
-                            write_dict = {
-                                dirs['tmp_m3u8'] : m3u8_str,
-                                dirs['tmp_key'] : key_bytes,
-                                dirs['tmp_iv'] : iv
-                            }
-                            logger.info("m3u8文件已变化, 重新下载")
-                            self._write_tmp(write_dict)
-                            _download_info_manager._save_download_info(package=package)
-                            return is_encrypted_  
-                    else:
-                        iv = m3u8_obj.keys[0].iv
-                        key_uri = m3u8_obj.keys[0].uri
-                        key_bytes = requests.get(urljoin(package.base_url, key_uri), headers=config.headers, proxies=config.proxies).content
-                        write_dict = {
-                            dirs['tmp_m3u8'] : m3u8_str,
-                            dirs['tmp_key'] : key_bytes,
-                            dirs['tmp_iv'] : iv
-                        }
-                        logger.info("m3u8文件不存在, 下载")
-                        self._write_tmp(write_dict)
-                        _download_info_manager._save_download_info(package=package)
-                        return is_encrypted_
+                response = http_client.get(package.hls_url)
+                if response.status_code in (403, 404, 410):
+                    logger.error(f"获取m3u8失败,url:{package.hls_url},状态码:{response.status_code}")
+                    raise InvalidPlaylistError(f"m3u8已失效, 状态码:{response.status_code}")
+                if response.status_code != 200:
+                    raise requests.exceptions.HTTPError(f"状态码:{response.status_code}")
+                m3u8_str = response.text
+                if not m3u8_str.lstrip('\ufeff \t\r\n').startswith('#EXTM3U'):
+                    logger.error(f"m3u8内容无效: {m3u8_str[:100]!r}")
+                    raise InvalidPlaylistError("m3u8内容无效")
+                plan = DownloadPlan.parse(m3u8_str)
+                if plan.total == 0:
+                    logger.error("m3u8中没有ts")
+                    raise InvalidPlaylistError("m3u8中没有ts")
+                if plan.encrypted:
+                    logger.info(f"视频已加密, 共{len(plan.key_uris)}个密钥, 下载ts时获取")
                 else:
-                    logger.info("视频未加密, 跳过下载密钥,iv")
-                    if os.path.exists(dirs['tmp_m3u8']):
-                        with open(dirs['tmp_m3u8'], 'r') as f:
-                            m3u8_file_str = f.read()
-                        if hash(m3u8_file_str) == hash(m3u8_str) and hash(package.hls_url) == hash(old_hls_url):
-                            logger.info("m3u8文件未变化, 跳过下载")
-                            return is_encrypted_
-                        else:
-                            logger.info("m3u8文件已变化, 重新下载")
-                            write_dict = {
-                                dirs['tmp_m3u8'] : m3u8_str
-                            }
-                            self._write_tmp(write_dict)
-                            _download_info_manager._save_download_info(package=package)
-                            return is_encrypted_
-                    else:
-                        logger.info("m3u8文件不存在, 下载")
-                        write_dict = {
-                            dirs['tmp_m3u8'] : m3u8_str
-                        }
-                        self._write_tmp(write_dict)
-                        _download_info_manager._save_download_info(package=package)
-                        return is_encrypted_
-            except requests.exceptions.RequestException:
-                logger.error("下载m3u8文件失败,正在重试...")
+                    logger.info("视频未加密")
+                if os.path.exists(dirs['tmp_m3u8']):
+                    with open(dirs['tmp_m3u8'], 'r') as f:
+                        m3u8_file_str = f.read()
+                    if hash(m3u8_file_str) == hash(m3u8_str) and hash(package.hls_url) == hash(old_hls_url):
+                        logger.info("m3u8文件未变化, 跳过下载")
+                        return plan.encrypted
+                    logger.info("m3u8文件已变化, 重新下载")
+                else:
+                    logger.info("m3u8文件不存在, 下载")
+                self._write_tmp({dirs['tmp_m3u8'] : m3u8_str})
+                _download_info_manager._save_download_info(package=package)
+                return plan.encrypted
+            except requests.exceptions.RequestException as e:
+                logger.error(f"下载m3u8文件失败,错误信息:{e},正在重试...")
                 wait_time = config.retry_wait_time * (2 ** i)
                 logger.info(f"重试第{i+1}次,等待{wait_time}秒...")
                 time.sleep(wait_time)
@@ -608,84 +1665,350 @@ class Downloader:
             package : DownloadPackage
             ) -> None:
         cover_url = package.cover_url
-        response = requests.get(cover_url, headers=config.headers, proxies=config.proxies, timeout=10)
+        response = http_client.get(cover_url)
         if response.status_code == 200:
             with open(config.cover_dir / f'{package.id.lower()}.jpg', 'wb') as f:
                 f.write(response.content)
         else:
             logger.error(f"下载封面失败,url:{cover_url},状态码:{response.status_code}")
 
-    def single_downloader(
+    async def _async_single_downloader(
             self,
             package : DownloadPackage,
+            session : aiohttp.ClientSession,
+            scheduler : SegmentScheduler,
             ) -> None:
-        self._init_request_headers()
+        '''
+        在当前事件循环中下载单个视频,阻塞的请求与文件操作放入线程中执行
+        '''
         dirs = self._init_dir(package)
         package.status = DownloadStatus.DOWNLOADING
-        is_encrypted_ = self._download_m3u8(
-            package=package,
-            )
+        # 封面与m3u8互不依赖, 封面在后台下载, 合并前才等待
+        cover_task = None
         if os.path.exists(config.cover_dir / f'{package.id.lower()}.jpg'):
             logger.info(f"封面文件已存在, 跳过下载")
         else:
-            self._download_cover(package=package)
-        if is_encrypted_:
-            decypt_info_dict = self._load_tmp(
-                package=package,
-                tmp_file_type=['m3u8', 'key', 'iv']
-            )
-        else:
-            decypt_info_dict = self._load_tmp(
-                package=package,
-                tmp_file_type='m3u8'
+            cover_task = self._spawn(
+                asyncio.to_thread(self._download_cover, package=package),
+                f"下载{package.id}的封面",
             )
-            decypt_info_dict['key'] = None
-            decypt_info_dict['iv'] = None
-        try:
-            undownload_segments = self._get_undownload_ts(
-                package=package,
-                m3u8_obj=m3u8.loads(decypt_info_dict['m3u8']),
+        # 断点续传时临时目录中已有上次的m3u8, 获取新m3u8的同时预取其中的密钥
+        if dirs['tmp_m3u8'].exists():
+            self._prefetch_key(package, session, await asyncio.to_thread(self._load_plan, package))
+        await asyncio.to_thread(
+            self._download_m3u8,
+            package=package,
             )
-        except FileNotFoundError:
-            undownload_segments = m3u8.loads(decypt_info_dict['m3u8']).segments
+        plan = await asyncio.to_thread(self._load_plan, package)
+        self._on_playlist_fetched(package, plan)
+        # 读取完成记录的同时下载密钥, ts工作协程启动后等待同一次下载
+        self._prefetch_key(package, session, plan)
+        undownload_segments = await asyncio.to_thread(
+            self._get_undownload_ts,
+            package=package,
+            plan=plan,
+        )
         self._counters[package.id.lower()].total_num = len(undownload_segments)
         if len(undownload_segments) != 0:
-            asyncio.run(self._async_download_ts(
+            await self._async_download_ts(
                 package=package,
                 segments=undownload_segments, 
                 base_url=package.base_url, 
                 tmp_folder_name=package.id.lower(),
-                key_bytes=decypt_info_dict['key'],
-                iv=decypt_info_dict['iv']
-                ))
-        undownload_segments = self._get_undownload_ts(
-                package = package,
-                m3u8_obj = m3u8.loads(decypt_info_dict['m3u8']),
+                session=session,
+                scheduler=scheduler,
+                media_sequence=plan.media_sequence,
+                )
+        undownload_segments = await asyncio.to_thread(
+            self._get_undownload_ts,
+            package=package,
+            plan=plan,
         )
+        rounds = 0
         while len(undownload_segments) != 0:
-            asyncio.run(self._redownload(package=package))
-            undownload_segments = self._get_undownload_ts(
+            if rounds >= config.max_redownload_rounds:
+                self._report_dead_letters(package, undownload_segments, rounds)
+            rounds += 1
+            logger.info(f"第{rounds}轮重新下载{package.id}剩余的{len(undownload_segments)}个ts")
+            await self._redownload(package=package, session=session, scheduler=scheduler)
+            plan = await asyncio.to_thread(self._load_plan, package)
+            undownload_segments = await asyncio.to_thread(
+                self._get_undownload_ts,
                 package=package,
-                m3u8_obj=m3u8.loads(decypt_info_dict['m3u8']),
+                plan=plan,
             )
         package.status = DownloadStatus.MERGING
         logger.info("所有ts文件已下载完成")
-        self._merge_ts(package=package, list_file_path=dirs['list_file_path'], m3u8_obj=m3u8.loads(decypt_info_dict['m3u8']))
+        if cover_task is not None:
+            await asyncio.wait([cover_task])
+        merged = False
+        if package.id.lower() in self._assemblers:
+            await asyncio.to_thread(self._finish_stream_merge, package=package)
+            merged = True
+        elif package.id.lower() in self._streamers:
+            merged = await asyncio.to_thread(self._finish_stream_ffmpeg, package=package)
+        if not merged:
+            await asyncio.to_thread(
+                self._merge_ts,
+                package=package,
+                list_file_path=dirs['list_file_path'],
+                plan=plan,
+                )
         package.status = DownloadStatus.FINISHED
-        self._clear_all_tmp(package=package)
+        await asyncio.to_thread(self._clear_all_tmp, package=package)
     
-    async def _redownload(
+    def _spawn(self, coro : Awaitable, description : str) -> asyncio.Task:
+        '''
+        创建后台任务, 失败时只记录日志, 不影响视频下载
+        '''
+        task = asyncio.ensure_future(coro)
+        self._background_tasks.add(task)
+
+        def _done(task : asyncio.Task) -> None:
+            self._background_tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                logger.warning(f"{description}失败, 错误信息:{task.exception()}")
+
+        task.add_done_callback(_done)
+        return task
+
+    def _prefetch_key(
             self,
             package : DownloadPackage,
+            session : aiohttp.ClientSession,
+            plan : DownloadPlan,
             ) -> None:
-        self._download_m3u8(package=package)
-        decrpt_info = self._load_tmp(
-            package=package,
-            tmp_file_type=['m3u8', 'key', 'iv']
+        '''
+        在后台下载第一个加密ts的密钥, 密钥已缓存或视频未加密时不做任何事
+        '''
+        segment = next((segment for segment in plan.segments if segment.key_uri is not None), None)
+        if segment is None or _key_cache.get_cached(urljoin(package.base_url, segment.key_uri)) is not None:
+            return
+        self._spawn(
+            self._segment_key(session, package.base_url, segment),
+            f"预取{package.id}的密钥",
         )
-        undownload_segments = self._get_undownload_ts(
+
+    def _report_dead_letters(
+            self,
+            package : DownloadPackage,
+            segments : List[Tuple[int, PlannedSegment]],
+            rounds : int,
+            ) -> None:
+        '''
+        重新下载的轮数用完后报告仍然失败的ts并结束该视频的下载
+
+        Raises:
+            SegmentsFailedError: 仍有ts未下载
+        '''
+        dead_letters = self._dead_letters.get(package.id.lower(), {})
+        details = ', '.join(
+            f"{index}({dead_letters.get(index, '未知原因')})" for index, _ in segments[:20]
+        )
+        if len(segments) > 20:
+            details += f" 等共{len(segments)}个"
+        logger.error(f"{package.id}重新下载{rounds}轮后仍有{len(segments)}个ts失败: {details}")
+        package.status = DownloadStatus.FAILED
+        raise SegmentsFailedError(f"{package.id}有{len(segments)}个ts下载失败")
+
+    def dead_letters(self) -> Dict[str, Dict[int, str]]:
+        '''
+        返回每个视频重试次数用完的ts序号及最后一次失败的原因
+        '''
+        return {key : dict(value) for key, value in self._dead_letters.items() if value}
+
+    @staticmethod
+    def _connection_limit() -> int:
+        if config.max_connections:
+            return config.max_connections
+        return config.max_concurrency * config.max_ts_concurrency
+
+    def _create_session(self, limit : int) -> aiohttp.ClientSession:
+        '''
+        创建所有视频共用的aiohttp会话,连接池在视频之间以及重试之间复用
+        '''
+        connector = aiohttp.TCPConnector(limit=limit)
+        session = aiohttp.ClientSession(connector=connector)
+        self._init_session(session=session, is_async=True)
+        return session
+    
+    def submit(self, package : DownloadPackage) -> None:
+        '''
+        流式下载时从任意线程提交视频, 提交后立即加入正在进行的下载
+        '''
+        with self._submit_lock:
+            self._submitted.append(package)
+        self._notify_submissions()
+
+    def close_submissions(self) -> None:
+        '''
+        所有视频已经提交, 流式下载在已提交的视频下载完成后结束
+        '''
+        with self._submit_lock:
+            self._submit_closed = True
+        self._notify_submissions()
+
+    def _notify_submissions(self) -> None:
+        loop, event = self._submit_loop, self._submit_event
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass
+
+    async def _async_download_packages(
+            self,
+            packages : List[DownloadPackage],
+            connection_limit : Optional[int] = None,
+            streaming : bool = False,
+            ) -> None:
+        '''
+        在同一个事件循环和会话中下载多个视频,同时下载的视频数由config.max_concurrency限制,
+        所有视频的ts下载共用一个调度器,连接总数由connection_limit限制.
+        streaming为True时还会等待通过 submit 提交的视频, 直到调用 close_submissions
+        '''
+        self._init_request_headers()
+        package_semaphore = asyncio.Semaphore(config.max_concurrency)
+        connection_limit = connection_limit or self._connection_limit()
+        scheduler = SegmentScheduler(connection_limit)
+        if config.max_memory_bytes:
+            scheduler.memory = ByteBudget(config.max_memory_bytes)
+        max_connections = connection_limit
+        if config.adaptive_concurrency:
+            max_connections = config.adaptive_max_connections or connection_limit * 4
+            self._controller = AIMDController(
+                scheduler,
+                min_limit=config.adaptive_min_connections,
+                max_limit=max_connections,
+            )
+        self._worker_limit = max_connections
+
+        limiter = self._limiter = BandwidthLimiter(self._max_bandwidth, config.bandwidth_burst)
+        self._hedger = None
+        if config.hedge_percentile:
+            self._hedger = HedgeTracker(
+                config.hedge_percentile,
+                min_samples=config.hedge_min_samples,
+                min_delay=config.hedge_min_delay,
+            )
+
+        async def _run(package : DownloadPackage) -> None:
+            async with package_semaphore:
+                scheduler.register(package.id.lower(), weight=package.weight)
+                limiter.register(package.id.lower(), weight=package.weight)
+                try:
+                    await self._async_single_downloader(
+                        package=package,
+                        session=session,
+                        scheduler=scheduler,
+                    )
+                finally:
+                    scheduler.unregister(package.id.lower())
+                    limiter.unregister(package.id.lower())
+                    self._close_segment_state(package)
+                    self._release_reorder_charges(package, scheduler.memory)
+
+        started : List[DownloadPackage] = []
+        tasks : List[asyncio.Task] = []
+
+        def _start(package : DownloadPackage) -> None:
+            if package.id.lower() not in self._counters:
+                self._counters[package.id.lower()] = Counter(name=package.id.lower())
+            started.append(package)
+            tasks.append(asyncio.create_task(_run(package)))
+
+        async with self._create_session(max_connections) as session:
+            for package in packages:
+                _start(package)
+            if streaming:
+                self._submit_event = asyncio.Event()
+                self._submit_loop = asyncio.get_running_loop()
+                try:
+                    while True:
+                        with self._submit_lock:
+                            submitted, self._submitted = self._submitted, []
+                            closed = self._submit_closed
+                        for package in submitted:
+                            logger.info(f"加入下载: {package.id}")
+                            _start(package)
+                        if closed:
+                            break
+                        await self._submit_event.wait()
+                        self._submit_event.clear()
+                finally:
+                    self._submit_loop = None
+                    self._submit_closed = False
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            # 失败视频遗留的后台任务在会话关闭前取消
+            for task in list(self._background_tasks):
+                task.cancel()
+        if self._hedger is not None and self._hedger.issued:
+            logger.info(f"对冲请求: 发起{self._hedger.issued}次, 先完成{self._hedger.won}次")
+        http_client.log_stats()
+        throughput = self._controller.stats()['last_throughput'] if self._controller is not None else None
+        if throughput:
+            # 供按吞吐量选择清晰度时使用
+            config.measured_throughput = throughput
+        first_exception = None
+        for package, result in zip(started, results):
+            if isinstance(result, BaseException):
+                logger.error(f"下载{package.name}失败, 错误信息:{result}")
+                first_exception = first_exception or result
+        if first_exception:
+            raise first_exception
+
+    def concurrency_stats(self) -> Optional[Dict]:
+        '''
+        返回最近一次下载中自适应并发控制器的状态以及调整记录,未开启时返回None
+        '''
+        if self._controller is None:
+            return None
+        return self._controller.stats()
+
+    def set_bandwidth_limit(self, max_bandwidth : Optional[float]) -> None:
+        '''
+        修改下载限速(字节/秒),为None时不限速,可以在下载过程中从其他线程调用
+        '''
+        self._max_bandwidth = max_bandwidth
+        if self._limiter is not None:
+            self._limiter.set_rate(max_bandwidth)
+        logger.info(f"下载限速修改为: {max_bandwidth or '不限速'}")
+
+    def hedge_stats(self) -> Optional[Dict]:
+        '''
+        返回最近一次下载中对冲请求的发起次数,先完成次数以及当前阈值,未开启时返回None
+        '''
+        if self._hedger is None:
+            return None
+        return self._hedger.stats()
+
+    def single_downloader(
+            self,
+            package : DownloadPackage,
+            connection_limit : Optional[int] = None,
+            ) -> None:
+        '''
+        在新的事件循环中下载单个视频, 结束后关闭工作池. 下载状态保存在下载器上, 同一个下载器不能在多个线程中同时调用
+        '''
+        try:
+            asyncio.run(self._async_download_packages([package], connection_limit=connection_limit))
+        finally:
+            # 事件循环已经结束, 可以直接等待工作池结束
+            self._shutdown_executor()
+    
+    async def _redownload(
+            self,
+            package : DownloadPackage,
+            session : aiohttp.ClientSession,
+            scheduler : SegmentScheduler,
+            ) -> None:
+        await asyncio.to_thread(self._download_m3u8, package=package)
+        plan = await asyncio.to_thread(self._load_plan, package)
+        self._on_playlist_fetched(package, plan)
+        undownload_segments = await asyncio.to_thread(
+            self._get_undownload_ts,
             package=package,
-            m3u8_obj=m3u8.loads(decrpt_info['m3u8']),
+            plan=plan,
         )
         if len(undownload_segments) == 0:
             logger.info("所有ts文件已下载完成")
@@ -696,32 +2019,29 @@ class Downloader:
             segments=undownload_segments,
             base_url=package.base_url,
             tmp_folder_name=package.id.lower(),
-            key_bytes=decrpt_info['key'],
-            iv=decrpt_info['iv']
+            session=session,
+            scheduler=scheduler,
+            media_sequence=plan.media_sequence,
             )
                 
     def thread_downloader(self) -> None:
         '''
-        多线程下载多个视频
+        保留的旧接口, 与 download 相同.
+        限速器, 对冲与并发控制器绑定在同一个事件循环上, 不能在多个线程各自的事件循环中共用,
+        所以所有视频都在一个事件循环中下载, 同时下载的视频数仍由config.max_concurrency限制
         '''
-        with ThreadPoolExecutor(max_workers=config.max_concurrency) as executor:
-            future_to_task = {}
-            for package in self._packages:
-                future = executor.submit(self.single_downloader, package)
-                future_to_task[future] = package
-            for future in as_completed(future_to_task):
-                package : DownloadPackage = future_to_task[future]
-                try:
-                    future.result()
-                except Exception as e:
-                    logger.error(f"下载{package.name}失败, 错误信息:{e}")
-                    raise e
-
-    def download(self) -> None:
-        # 注册计数器
-        for package in self._packages:
-            self._counters[package.id.lower()] = Counter(name=package.id.lower())
-        if len(self._packages) == 1:
-            return self.single_downloader(package=self._packages[0])
-        else:
-            return self.thread_downloader()
\ No newline at end of file
+        self.download()
+
+    async def download_async(self, streaming : bool = False) -> None:
+        '''
+        在调用方的事件循环中下载所有视频,所有视频共用一个会话和连接池.
+        streaming为True时在下载过程中继续接收通过 submit 提交的视频, 直到调用 close_submissions
+        '''
+        try:
+            await self._async_download_packages(self._packages, streaming=streaming)
+        finally:
+            # 等待工作池结束会阻塞, 放到线程中执行
+            await asyncio.get_running_loop().run_in_executor(None, self._shutdown_executor)
+
+    def download(self, streaming : bool = False) -> None:
+        asyncio.run(self.download_async(streaming=streaming))
\ No newline at end of file
@@ -1,8 +1,26 @@
 class M3u8ExpiredException(Exception):
     pass
 
+class SuspectedExpiryError(M3u8ExpiredException):
+    pass
+
+class InvalidPlaylistError(M3u8ExpiredException):
+    pass
+
 class ForbiddenError(Exception):
     pass
 
 class NotFoundError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class IncompleteSegmentError(Exception):
+    pass
+
+class CorruptedSegmentError(Exception):
+    pass
+
+class SegmentsFailedError(Exception):
+    pass
+
+class KeyFetchError(Exception):
+    pass
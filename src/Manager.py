@@ -2,6 +2,7 @@ import os
 import sys
 
 import json
+import threading
 from pathlib import Path
 from typing import List, Dict, Optional
 
@@ -18,6 +19,16 @@ class DownloadInfoManager:
             download_info_file : Path,
             ) -> None:
         self.download_info_file = download_info_file
+        self._lock = threading.Lock()
+    
+    def _dump(self, data : Dict) -> None:
+        '''
+        先写入临时文件再替换,避免其他线程读取到写了一半的文件
+        '''
+        tmp_file = self.download_info_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_file, self.download_info_file)
     
     def _load_download_info(self) -> List[InfoPackage]:
         '''
@@ -67,18 +78,17 @@ class DownloadInfoManager:
             'time_length' : package.time_length,
         }
         dump_data = {package.id.lower() : [package_data]}
-        if self.download_info_file.exists():
-            with open(self.download_info_file, 'r', encoding='utf-8') as f:
-                origin_data : Dict[str, List[Dict]] = json.load(f)
-            if package.id.lower() in origin_data:
-                origin_data[package.id.lower()].append(package_data)
+        with self._lock:
+            if self.download_info_file.exists():
+                with open(self.download_info_file, 'r', encoding='utf-8') as f:
+                    origin_data : Dict[str, List[Dict]] = json.load(f)
+                if package.id.lower() in origin_data:
+                    origin_data[package.id.lower()].append(package_data)
+                else:
+                    origin_data.update(dump_data)
+                self._dump(origin_data)
             else:
-                origin_data.update(dump_data)
-            with open(self.download_info_file, 'w', encoding='utf-8') as f:
-                json.dump(origin_data, f, indent=4, ensure_ascii=False)
-        else:
-            with open(self.download_info_file, 'w', encoding='utf-8') as f:
-                json.dump(dump_data, f, indent=4, ensure_ascii=False)
+                self._dump(dump_data)
 
     @property
     def download_info_file(self) -> Path:
@@ -2,6 +2,7 @@ import os
 
 import re
 import json
+import threading
 from collections import namedtuple
 from typing import List
 
@@ -14,6 +15,9 @@ logger = Logger(config.log_dir).get_logger(__name__)
 
 ActessInfo = namedtuple('ActressInfo', ['actress_id', 'actress_name'], defaults=["", ""])
 
+# 并发解析页面时保护 actress_id.json 的读取-合并-写入
+_dump_lock = threading.Lock()
+
 class JabActressId:
 
     def __init__(
@@ -58,19 +62,20 @@ class JabActressId:
 
     def _dump(self) -> None:
         self._parse()
-        if os.path.exists(self._file_path):
-            _old_actress_info = self.load()
-            id_list = [i.actress_id for i in self.actress_info]
-            for _actress_info in _old_actress_info:
-                if _actress_info.actress_id in id_list:
-                    continue
-                else:
-                    self.actress_info.append(_actress_info)
+        with _dump_lock:
+            if os.path.exists(self._file_path):
+                _old_actress_info = self.load()
+                id_list = [i.actress_id for i in self.actress_info]
+                for _actress_info in _old_actress_info:
+                    if _actress_info.actress_id in id_list:
+                        continue
+                    else:
+                        self.actress_info.append(_actress_info)
+                with open(self._file_path, 'w', encoding = 'utf-8') as f:
+                    json.dump(self.actress_info, f, ensure_ascii=False, indent=4)
+                return
             with open(self._file_path, 'w', encoding = 'utf-8') as f:
                 json.dump(self.actress_info, f, ensure_ascii=False, indent=4)
-            return
-        with open(self._file_path, 'w', encoding = 'utf-8') as f:
-            json.dump(self.actress_info, f, ensure_ascii=False, indent=4)
     
     def load(self) -> List[ActessInfo]:
         _load_list = []
@@ -1,24 +1,40 @@
-import requests
-from typing import Tuple, List, Union, Dict
+import time
+import threading
+from typing import Tuple, List, Union, Dict, Optional
 
 from ...Bases.PageParserBase import PageParserBase
 from ...Config.Config import config
 from ...utils.Logger import Logger
 from ...utils.EnumType import Page
-from ..utils.MissavPageParseUtils import missav_parttern, _get_page_type
+from ...utils.HttpClient import http_client
+from ..utils.MissavPageParseUtils import missav_parttern, _get_page_type, Variant, select_variant
 
 logger = Logger(config.log_dir).get_logger(__name__)
 
+# 解析后的主m3u8, 按uuid缓存: uuid -> (获取时间, 清晰度列表), 超过config.hls_master_ttl的缓存在写入时清除
+_master_playlists : Dict[str, Tuple[float, List[Variant]]] = {}
+_master_lock = threading.Lock()
+
 class MissavPageParser(PageParserBase):
 
-    def __init__(self, html_text : str) -> None:
+    def __init__(
+            self,
+            html_text : str,
+            variant_policy : Optional[str] = None,
+            max_height : Optional[int] = None,
+            throughput : Optional[float] = None,
+            ) -> None:
         self._html_text = html_text
+        self._variant_policy = variant_policy or config.hls_variant_policy
+        self._max_height = max_height or config.hls_max_height
+        self._throughput = throughput
+        self._uuid : Optional[str] = None
     
-    def _get_uuid(self) -> str:
-        if uuid_match := missav_parttern['uuid'].search(self._html_text):
-            return uuid_match.group(1)
-        else:
-            return " "
+    def _get_uuid(self) -> Optional[str]:
+        if self._uuid is None:
+            if uuid_match := missav_parttern['uuid'].search(self._html_text):
+                self._uuid = uuid_match.group(1)
+        return self._uuid
 
     def _fetch_playlist(self) -> str:
         uuid = self._get_uuid()
@@ -28,18 +44,22 @@ class MissavPageParser(PageParserBase):
         playlist_url = f'https://surrit.com/{uuid}/playlist.m3u8'
         return playlist_url
     
-    def _parse_video_info(self, playlist_info : str) -> Union[List[Tuple[str, str, str]], None]:
+    def _parse_video_info(self, playlist_info : str) -> Union[List[Variant], None]:
+        '''
+        解析主m3u8中的所有清晰度, 按码率从高到低排列
+        '''
         if not playlist_info:
             logger.error('无法获取播放列表信息')
             return None
+        uuid = self._get_uuid()
         resolution_info = []
         for match_ in missav_parttern['playlist'].finditer(playlist_info):
-            bandwith = match_.group(1)
+            bandwith = int(match_.group(1))
             resolution = match_.group(2)
             m3u8_url_end = match_.group(3)
-            m3u8_url_end = f'https://surrit.com/{self._get_uuid()}/{m3u8_url_end}'
-            resolution_info.append((bandwith, resolution, m3u8_url_end))
-        resolution_info.sort(key=lambda x: int(x[0]), reverse=True)
+            m3u8_url_end = f'https://surrit.com/{uuid}/{m3u8_url_end}'
+            resolution_info.append(Variant(bandwith, resolution, m3u8_url_end))
+        resolution_info.sort(key=lambda x: x.bandwidth, reverse=True)
         return resolution_info
     
     def _parse_id_name_actress(self) -> Tuple[str, str, str]:
@@ -76,20 +96,47 @@ class MissavPageParser(PageParserBase):
     def _parse_has_chinese(self) -> bool:
         return False
     
-    def _parse_hls_url(self) -> str:
+    def _get_variants(self) -> Optional[List[Variant]]:
+        '''
+        获取主m3u8中的所有清晰度, 同一个视频在config.hls_master_ttl秒内只请求一次
+        '''
         playlist_url = self._fetch_playlist()
+        uuid = self._get_uuid()
+        with _master_lock:
+            cached = _master_playlists.get(uuid)
+            if cached is not None and time.monotonic() - cached[0] >= config.hls_master_ttl:
+                del _master_playlists[uuid]
+                cached = None
+        if cached is not None:
+            return cached[1]
         id, _, __ = self._parse_id_name_actress()
         headers = {
             'User-Agent' : 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36',
             'Origin' : 'https://missav.live',
             'Referer' : f"https://missav.live/{id.strip().lower()}"
         }
-        response = requests.get(playlist_url, headers=headers)
+        response = http_client.get(playlist_url, headers=headers)
         if response.status_code != 200:
             logger.error(f'无法获取播放列表信息，状态码：{response.status_code}')
-        else:
-            playlist_info = response.text
-            return self._parse_video_info(playlist_info)[0][-1]
+            return None
+        variants = self._parse_video_info(response.text)
+        if variants:
+            now = time.monotonic()
+            with _master_lock:
+                expired = [key for key, (fetched_at, _) in _master_playlists.items() if now - fetched_at >= config.hls_master_ttl]
+                for key in expired:
+                    del _master_playlists[key]
+                _master_playlists[uuid] = (now, variants)
+        return variants
+
+    def _parse_hls_url(self) -> Optional[str]:
+        variants = self._get_variants()
+        if not variants:
+            return None
+        throughput = self._throughput or config.hls_throughput or config.measured_throughput
+        variant = select_variant(variants, self._variant_policy, self._max_height, throughput)
+        logger.info(f'选择清晰度: {variant.resolution}, 码率: {variant.bandwidth}, 策略: {self._variant_policy}')
+        return variant.url
     
     def _get_page_type(self) -> Page | None:
         return _get_page_type(self._html_text)
\ No newline at end of file
@@ -1,5 +1,5 @@
 import re
-from typing import Dict, Tuple
+from typing import Dict, List, NamedTuple, Optional
 
 from ...utils.EnumType import Page
 
@@ -12,5 +12,50 @@ missav_parttern : Dict[str, re.Pattern] = {
     'hash_tags' : re.compile(r'<meta name="keywords" content="(.*?)"\s*'),
 }
 
+# 按吞吐量选择时只使用吞吐量的该比例, 给码率波动留出余量
+_THROUGHPUT_HEADROOM = 0.8
+
+class Variant(NamedTuple):
+    '''
+    主m3u8中的一个清晰度, bandwidth单位为比特/秒
+    '''
+    bandwidth : int
+    resolution : str
+    url : str
+
+    @property
+    def height(self) -> int:
+        return int(self.resolution.split('x')[-1])
+
+def select_variant(
+        variants : List[Variant],
+        policy : str = 'max',
+        max_height : Optional[int] = None,
+        throughput : Optional[float] = None,
+        ) -> Variant:
+    '''
+    按策略选择清晰度, 没有满足条件的清晰度时选择最低的一个
+
+    Args:
+        variants (List[Variant]): 主m3u8中的所有清晰度
+        policy (str): 'max', 'resolution' 或 'throughput'
+        max_height (Optional[int]): 'resolution' 策略的高度上限
+        throughput (Optional[float]): 'throughput' 策略使用的吞吐量(字节/秒), 为None时选择最高清晰度
+    '''
+    if not variants:
+        raise ValueError('主m3u8中没有可用的清晰度')
+    ordered = sorted(variants, key=lambda variant: variant.bandwidth, reverse=True)
+    if policy == 'max':
+        return ordered[0]
+    if policy == 'resolution':
+        fits = lambda variant: max_height is None or variant.height <= max_height
+    elif policy == 'throughput':
+        if throughput is None:
+            return ordered[0]
+        fits = lambda variant: variant.bandwidth <= throughput * 8 * _THROUGHPUT_HEADROOM
+    else:
+        raise ValueError(f"不支持的清晰度选择策略: {policy}, 仅支持max, resolution, throughput")
+    return next((variant for variant in ordered if fits(variant)), ordered[-1])
+
 def _get_page_type(html_text : str) -> Page | None:
-    return Page.SINGLE_VIDEO
\ No newline at end of file
+    return Page.SINGLE_VIDEO
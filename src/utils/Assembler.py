@@ -0,0 +1,164 @@
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Set
+
+from .Journal import CompletionJournal
+from .FileCopy import copy_range
+
+class StreamAssembler:
+    '''
+    边下载边合并的ts组装器.
+    连续的ts直接写入输出文件,乱序到达的ts先放入有上限的重排缓冲区,缓冲区满时落盘到临时目录,等到连续时再写入.
+    只有写入输出文件或落盘的ts才算完成,重排缓冲区中的ts在中断后需要重新下载.
+    '''
+    def __init__(
+            self,
+            output_path : Path,
+            state_path : Path,
+            spill_dir : Path,
+            total : int,
+            max_buffer_bytes : int = 64 * 1024 * 1024,
+            ) -> None:
+        self._output_path = output_path
+        self._state_path = state_path
+        self._spill_dir = spill_dir
+        self._total = total
+        self._max_buffer_bytes = max_buffer_bytes
+        self._buffer : Dict[int, bytes] = {}
+        self._buffer_bytes = 0
+        self._spilled : Set[int] = set()
+        self._next_index = 0
+        self._offset = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def output_path(self) -> Path:
+        return self._output_path
+
+    @property
+    def next_index(self) -> int:
+        return self._next_index
+
+    @property
+    def buffered_bytes(self) -> int:
+        return self._buffer_bytes
+
+    @property
+    def finished(self) -> bool:
+        return self._next_index >= self._total
+
+    def is_buffered(self, index : int) -> bool:
+        return index in self._buffer
+
+    def open(self, journal : CompletionJournal) -> None:
+        '''
+        打开输出文件,存在中断记录时截断到上次写入的位置并恢复落盘的ts,同时修正完成记录
+        '''
+        with self._lock:
+            self._next_index, self._offset = self._load_state()
+            if self._next_index == 0:
+                self._offset = 0
+            self._file = open(self._output_path, 'r+b' if self._output_path.exists() else 'wb')
+            self._file.truncate(self._offset)
+            self._file.seek(self._offset)
+            durable = set(range(self._next_index))
+            for index in range(self._next_index, self._total):
+                if index in journal and (self._spill_dir / f'{index}.ts').exists():
+                    self._spilled.add(index)
+                    durable.add(index)
+            if journal.completed != len(durable):
+                # 完成记录中有不在输出文件中也没有落盘的ts,重建记录
+                journal.reset()
+                for index in sorted(durable):
+                    journal.mark(index)
+            self._flush_contiguous()
+
+    def add(self, index : int, data : bytes, buffer : bool = True) -> List[int]:
+        '''
+        添加一个解密后的ts
+
+        Args:
+            buffer (bool): 为False时乱序的ts不放入重排缓冲区, 直接落盘, 用于调用方的内存预算不足时
+
+        Returns:
+            List[int]: 本次已写入输出文件或落盘的ts序号,可以记为完成
+        '''
+        with self._lock:
+            if index < self._next_index or index in self._spilled:
+                return [index]
+            if index in self._buffer:
+                return []
+            if index == self._next_index:
+                self._write(data)
+                self._next_index += 1
+                return [index] + self._flush_contiguous()
+            if buffer and self._buffer_bytes + len(data) <= self._max_buffer_bytes:
+                self._buffer[index] = data
+                self._buffer_bytes += len(data)
+                return []
+            self._spill_dir.mkdir(parents=True, exist_ok=True)
+            with open(self._spill_dir / f'{index}.ts', 'wb') as f:
+                f.write(data)
+            self._spilled.add(index)
+            return [index]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove_state(self) -> None:
+        if self._state_path.exists():
+            os.remove(self._state_path)
+
+    def _flush_contiguous(self) -> List[int]:
+        flushed = []
+        while self._next_index < self._total:
+            index = self._next_index
+            if index in self._buffer:
+                data = self._buffer.pop(index)
+                self._buffer_bytes -= len(data)
+                self._write(data)
+                # 缓冲区中的ts此时才落盘
+                flushed.append(index)
+            elif index in self._spilled:
+                spill_path = self._spill_dir / f'{index}.ts'
+                self._file.flush()
+                size = spill_path.stat().st_size
+                spill_fd = os.open(spill_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+                try:
+                    copy_range(spill_fd, self._file.fileno(), size, 0, self._offset)
+                finally:
+                    os.close(spill_fd)
+                self._offset += size
+                self._file.seek(self._offset)
+                self._spilled.discard(index)
+                os.remove(spill_path)
+            else:
+                break
+            self._next_index += 1
+        self._file.flush()
+        self._save_state()
+        return flushed
+
+    def _write(self, data : bytes) -> None:
+        self._file.write(data)
+        self._offset += len(data)
+
+    def _load_state(self) -> tuple:
+        if not self._state_path.exists():
+            return 0, 0
+        with open(self._state_path, 'r', encoding='utf-8') as f:
+            fields = f.read().split()
+        if len(fields) != 3 or not all(field.isdigit() for field in fields) or int(fields[2]) != self._total:
+            return 0, 0
+        return int(fields[0]), int(fields[1])
+
+    def _save_state(self) -> None:
+        tmp_path = self._state_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f'{self._next_index} {self._offset} {self._total}')
+        os.replace(tmp_path, self._state_path)
@@ -0,0 +1,73 @@
+import asyncio
+from collections import deque
+from typing import Deque, Tuple
+
+class ByteBudget:
+    '''
+    全局内存预算,限制整个下载过程中在内存里的ts字节数.
+    预算用完时申请方按先后顺序等待;单次申请超过总预算时,在预算完全空闲时放行,避免死锁.
+    '''
+    def __init__(self, capacity : int) -> None:
+        if capacity < 1:
+            raise ValueError(f"内存预算必须大于0: {capacity}")
+        self._capacity = capacity
+        self._in_use = 0
+        self._peak = 0
+        self._waiters : Deque[Tuple[int, asyncio.Future]] = deque()
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    @property
+    def peak(self) -> int:
+        return self._peak
+
+    async def acquire(self, nbytes : int) -> None:
+        if nbytes <= 0:
+            return
+        if not self._waiters and self._fits(nbytes):
+            self._take(nbytes)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((nbytes, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(nbytes)
+            else:
+                self._waiters.remove((nbytes, waiter))
+                self._wake()
+            raise
+
+    def force(self, nbytes : int) -> None:
+        '''
+        不等待直接记入预算,用于已经持有预算且无法预知长度的数据
+        '''
+        self._take(nbytes)
+
+    def release(self, nbytes : int) -> None:
+        if nbytes <= 0:
+            return
+        self._in_use -= nbytes
+        self._wake()
+
+    def _fits(self, nbytes : int) -> bool:
+        return self._in_use + nbytes <= self._capacity or self._in_use == 0
+
+    def _take(self, nbytes : int) -> None:
+        self._in_use += nbytes
+        self._peak = max(self._peak, self._in_use)
+
+    def _wake(self) -> None:
+        while self._waiters and self._fits(self._waiters[0][0]):
+            nbytes, waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self._take(nbytes)
+            waiter.set_result(None)
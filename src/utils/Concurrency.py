@@ -0,0 +1,145 @@
+import time
+import logging
+from collections import deque, namedtuple
+from typing import Deque, Dict, List, Optional, Any
+
+from ..Config.Config import config
+from .Logger import Logger
+from .Scheduler import SegmentScheduler
+
+logger = Logger(config.log_dir).get_logger(__name__, logging.INFO)
+
+Decision = namedtuple('Decision', ['time', 'action', 'old_limit', 'new_limit', 'reason', 'throughput', 'p90_latency'])
+
+class AIMDController:
+    '''
+    基于AIMD(加性增,乘性减)的ts并发数控制器.
+    吞吐量持续上升且延迟稳定时每个窗口将连接数加一,出现超时,403或尾延迟明显上升时将连接数乘以decrease_factor.
+    '''
+    def __init__(
+            self,
+            scheduler : SegmentScheduler,
+            *,
+            min_limit : int = 1,
+            max_limit : Optional[int] = None,
+            window : float = 2.0,
+            min_samples : int = 4,
+            decrease_factor : float = 0.5,
+            latency_tolerance : float = 2.0,
+            throughput_gain : float = 0.05,
+            history_size : int = 100,
+            ) -> None:
+        self._scheduler = scheduler
+        self._min_limit = max(1, min_limit)
+        self._max_limit = max(max_limit or scheduler.limit, self._min_limit)
+        self._window = window
+        self._min_samples = min_samples
+        self._decrease_factor = decrease_factor
+        self._latency_tolerance = latency_tolerance
+        self._throughput_gain = throughput_gain
+
+        self._window_start = time.monotonic()
+        self._latencies : List[float] = []
+        self._bytes = 0
+        self._last_throughput : Optional[float] = None
+        self._base_latency : Optional[float] = None
+        self._last_decrease = 0.0
+        self._failures : Dict[str, int] = {}
+        self.decisions : Deque[Decision] = deque(maxlen=history_size)
+        scheduler.controller = self
+
+    @property
+    def limit(self) -> int:
+        return self._scheduler.limit
+
+    def on_success(self, latency : float, nbytes : int) -> None:
+        self._latencies.append(latency)
+        self._bytes += nbytes
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self._window or len(self._latencies) < self._min_samples:
+            return
+        throughput = self._bytes / max(elapsed, 1e-6)
+        p90 = self._percentile(self._latencies, 0.9)
+        self._reset_window(now)
+        if self._base_latency is None or p90 < self._base_latency:
+            self._base_latency = p90
+        if p90 > self._base_latency * self._latency_tolerance:
+            self._decrease('latency', throughput, p90)
+        elif not self._scheduler.saturated:
+            self._record('hold', self.limit, self.limit, 'idle', throughput, p90)
+        elif self._last_throughput is None or throughput > self._last_throughput * (1 + self._throughput_gain):
+            self._increase('throughput', throughput, p90)
+        else:
+            self._record('hold', self.limit, self.limit, 'plateau', throughput, p90)
+        self._last_throughput = throughput
+
+    def on_failure(self, reason : str) -> None:
+        '''
+        reason: timeout, throttled 等,同一个窗口内只减少一次,避免同一次拥塞连续减半
+        '''
+        self._failures[reason] = self._failures.get(reason, 0) + 1
+        now = time.monotonic()
+        if now - self._last_decrease < self._window:
+            return
+        self._decrease(reason, None, None)
+        self._reset_window(now)
+        self._last_throughput = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'limit' : self.limit,
+            'min_limit' : self._min_limit,
+            'max_limit' : self._max_limit,
+            'in_flight' : self._scheduler.in_flight,
+            'base_latency' : self._base_latency,
+            'last_throughput' : self._last_throughput,
+            'failures' : dict(self._failures),
+            'decisions' : [decision._asdict() for decision in self.decisions],
+        }
+
+    def _increase(self, reason : str, throughput : Optional[float], p90 : Optional[float]) -> None:
+        old_limit = self.limit
+        new_limit = min(old_limit + 1, self._max_limit)
+        if new_limit == old_limit:
+            self._record('hold', old_limit, new_limit, 'max_limit', throughput, p90)
+            return
+        self._scheduler.limit = new_limit
+        self._record('increase', old_limit, new_limit, reason, throughput, p90)
+
+    def _decrease(self, reason : str, throughput : Optional[float], p90 : Optional[float]) -> None:
+        old_limit = self.limit
+        new_limit = max(int(old_limit * self._decrease_factor), self._min_limit)
+        if new_limit != old_limit:
+            self._scheduler.limit = new_limit
+        self._last_decrease = time.monotonic()
+        self._record('decrease', old_limit, new_limit, reason, throughput, p90)
+
+    def _record(
+            self,
+            action : str,
+            old_limit : int,
+            new_limit : int,
+            reason : str,
+            throughput : Optional[float],
+            p90 : Optional[float],
+            ) -> None:
+        decision = Decision(time.time(), action, old_limit, new_limit, reason, throughput, p90)
+        self.decisions.append(decision)
+        if action == 'hold':
+            logger.debug(f"并发数保持{new_limit}, 原因:{reason}")
+            return
+        throughput_str = f"{throughput / 1024:.1f}KB/s" if throughput is not None else '-'
+        p90_str = f"{p90:.3f}s" if p90 is not None else '-'
+        logger.info(f"并发数调整 {old_limit} -> {new_limit}, 原因:{reason}, 吞吐量:{throughput_str}, p90延迟:{p90_str}")
+
+    def _reset_window(self, now : float) -> None:
+        self._window_start = now
+        self._latencies = []
+        self._bytes = 0
+
+    @staticmethod
+    def _percentile(values : List[float], q : float) -> float:
+        ordered = sorted(values)
+        index = min(int(len(ordered) * q), len(ordered) - 1)
+        return ordered[index]
@@ -16,6 +16,7 @@ class DownloadPackage:
     has_chinese : bool = False
     release_date : str = None
     time_length : str = None
+    weight : float = 1.0
 
     def __hash__(self):
         string = f"{self.id}{self.name}{self.actress}{self.hls_url}{self.cover_url}{self.src}"
@@ -1,8 +1,21 @@
-import m3u8
+from functools import lru_cache
 from Crypto.Cipher import AES
-from typing import Any, Optional
+from typing import Any, Optional, Union
 
 from .EnumType import DecrptyType
+from .M3u8Parser import MediaPlaylist, parse_media_playlist
+
+@lru_cache(maxsize=1024)
+def _parse_iv(iv : str) -> bytes:
+    if iv[:2].lower() == '0x':
+        iv = iv[2:]
+    return bytes.fromhex(iv.zfill(32))
+
+def sequence_iv(media_sequence : int) -> str:
+    '''
+    EXT-X-KEY 没有IV属性时, 以ts的媒体序号作为iv(128位大端)
+    '''
+    return f'0x{media_sequence:032x}'
 
 class Decrypter:
 
@@ -12,34 +25,42 @@ class Decrypter:
             **kwargs : Any
             ) -> None:
         self._decrypty_type = decrpty_type
-    
+
     def decrypt(
             self,
-            file_obj : Optional[bytes] = None,
+            file_obj : Optional[Union[bytes, bytearray, memoryview]] = None,
             key : Optional[bytes] = None,
-            iv : Optional[str] = None,
+            iv : Optional[Union[str, bytes]] = None,
+            output : Optional[Union[bytearray, memoryview]] = None,
             **kwargs : Any
-            ) -> bytes:
-        if iv.startswith('0x'):
-            iv = bytes.fromhex(iv[2:])
-        else:
-            iv = bytes.fromhex(iv)
+            ) -> Union[bytes, bytearray, memoryview]:
+        '''
+        解密数据, output不为None时把明文写入output并返回output, output可以就是file_obj(原地解密)
+        '''
+        # 分块解密时iv为上一块最后16字节密文
+        if isinstance(iv, str):
+            iv = _parse_iv(iv)
         if self._decrypty_type == DecrptyType.AES:
             cipher = AES.new(key, AES.MODE_CBC, iv)
+            if output is not None:
+                cipher.decrypt(file_obj, output=output)
+                return output
             decrypted_data = cipher.decrypt(file_obj)
             return decrypted_data
         else:
             raise ValueError("不支持的解密类型")
 
 def is_encrypted(
-        m3u8_obj : m3u8.M3U8,
+        m3u8_obj : Union[str, MediaPlaylist, Any],
         ) -> bool:
     '''
-    判断m3u8对象是否需要解密
+    判断m3u8是否需要解密, 可以传入m3u8内容, 解析后的MediaPlaylist或m3u8.M3U8对象
     '''
+    if isinstance(m3u8_obj, str):
+        m3u8_obj = parse_media_playlist(m3u8_obj)
     if m3u8_obj.keys:
         if len(m3u8_obj.keys) == 1 and not m3u8_obj.keys[0]:
             return False
         return True
     else:
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,149 @@
+import hashlib
+import threading
+import dataclasses
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from .M3u8Parser import MediaPlaylist, iter_segments, parse_byterange
+from .Decrypter import sequence_iv
+
+def ts_name(index : int) -> str:
+    '''
+    第index个ts在临时目录中的文件名
+    '''
+    return f'{index}.ts'
+
+@dataclass(frozen=True)
+class PlannedSegment:
+    __slots__ = ('index', 'uri', 'duration', 'media_sequence', 'key_uri', 'iv', 'byterange', 'filename')
+    index : int
+    uri : str
+    duration : Optional[float]
+    media_sequence : int
+    # 未加密的ts两者都为None, 加密的ts总是有iv
+    key_uri : Optional[str]
+    iv : Optional[str]
+    # EXT-X-BYTERANGE指定的长度与起始位置, 为None时下载整个文件
+    byterange : Optional[Tuple[int, int]]
+    filename : str
+
+@dataclass(frozen=True)
+class DownloadPlan:
+    '''
+    解析后的m3u8下载计划,创建后不可修改.
+    包含每个ts的地址,时长,密钥地址与iv,字节范围以及临时文件名, m3u8中有多个EXT-X-KEY时每个ts使用各自的密钥,下载,重试,校验与合并都使用同一个计划,
+    同一内容的m3u8只解析一次,参见 DownloadPlan.parse
+    '''
+    digest : str
+    media_sequence : int
+    segments : Tuple[PlannedSegment, ...]
+
+    @property
+    def total(self) -> int:
+        return len(self.segments)
+
+    @property
+    def encrypted(self) -> bool:
+        return any(segment.key_uri for segment in self.segments)
+
+    @property
+    def key_uris(self) -> Tuple[str, ...]:
+        '''
+        按出现顺序排列的不同密钥地址
+        '''
+        return tuple(dict.fromkeys(segment.key_uri for segment in self.segments if segment.key_uri))
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    @classmethod
+    def parse(cls, playlist : str) -> 'DownloadPlan':
+        '''
+        解析m3u8内容, 按内容的哈希缓存解析结果, 内容不变时直接返回缓存的计划
+        '''
+        digest = hashlib.sha1(playlist.encode('utf-8')).hexdigest()
+        with _cache_lock:
+            plan = _cache.get(digest)
+            if plan is not None:
+                _cache.move_to_end(digest)
+                return plan
+        plan = cls._build(digest, playlist)
+        with _cache_lock:
+            _cache[digest] = plan
+            while len(_cache) > _CACHE_SIZE:
+                _cache.popitem(last=False)
+        return plan
+
+    @classmethod
+    def _build(cls, digest : str, text : str) -> 'DownloadPlan':
+        # 逐个转换解析出的ts, 不保留中间的ts对象
+        playlist = MediaPlaylist()
+        segments = []
+        # 每个文件中上一个ts的结束位置, 没有@o的EXT-X-BYTERANGE从这里开始
+        range_ends : Dict[str, int] = {}
+        for index, segment in enumerate(iter_segments(text.splitlines(), playlist)):
+            byterange = None
+            if segment.byterange is not None:
+                byterange = parse_byterange(segment.byterange, range_ends.get(segment.uri, 0))
+                range_ends[segment.uri] = byterange[1] + byterange[0]
+            key = segment.key
+            encrypted = key is not None and key.uri is not None
+            iv = None
+            if encrypted:
+                iv = key.iv or sequence_iv(segment.media_sequence)
+            segments.append(PlannedSegment(
+                index=index,
+                uri=segment.uri,
+                duration=segment.duration,
+                media_sequence=segment.media_sequence,
+                key_uri=key.uri if encrypted else None,
+                iv=iv,
+                byterange=byterange,
+                filename=ts_name(index),
+            ))
+        return cls(
+            digest=digest,
+            media_sequence=playlist.media_sequence,
+            segments=tuple(segments),
+        )
+
+    def locate(self, media_sequence : int, total : int) -> Optional[Tuple[PlannedSegment, ...]]:
+        '''
+        把另一个计划中第i个ts对应到本计划中的ts, 用于刷新m3u8后替换地址.
+        ts数量与媒体序号都不变时按位置对应, 否则按媒体序号(media_sequence + 位置)对应
+
+        Args:
+            media_sequence (int): 原计划的媒体序号
+            total (int): 原计划的ts数量
+
+        Returns:
+            Optional[Tuple[PlannedSegment, ...]]: 按原位置排列的ts, 无法对应时返回None
+        '''
+        if self.total == total and self.media_sequence == media_sequence:
+            return self.segments
+        offset = media_sequence - self.media_sequence
+        if offset < 0 or offset + total > self.total:
+            return None
+        return tuple(
+            dataclasses.replace(segment, index=index, filename=ts_name(index))
+            for index, segment in enumerate(self.segments[offset:offset + total])
+        )
+
+    def rebase(self, media_sequence : int, total : int) -> Optional['DownloadPlan']:
+        '''
+        按原计划的媒体序号与ts数量返回对应的计划, 刷新m3u8后恢复下载时已有的完成记录仍然有效
+
+        Returns:
+            Optional[DownloadPlan]: 无法对应时返回None
+        '''
+        segments = self.locate(media_sequence, total)
+        if segments is None:
+            return None
+        if segments is self.segments:
+            return self
+        return dataclasses.replace(self, media_sequence=media_sequence, segments=segments)
+
+_CACHE_SIZE = 16
+_cache : 'OrderedDict[str, DownloadPlan]' = OrderedDict()
+_cache_lock = threading.Lock()
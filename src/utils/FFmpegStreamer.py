@@ -0,0 +1,177 @@
+import time
+import logging
+import threading
+import subprocess
+from pathlib import Path
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+from ..Config.Config import config
+from .Logger import Logger
+
+logger = Logger(config.log_dir).get_logger(__name__, logging.INFO)
+
+class FFmpegStreamer:
+    '''
+    边下载边封装.
+    下载开始时启动ffmpeg并从标准输入读取ts,后台线程把已完成且连续的ts按顺序写入ffmpeg,
+    最后一个ts到达时封装也基本完成.ffmpeg的进度与错误输出实时写入日志.
+    '''
+    # 结束ffmpeg后等待后台线程退出的秒数
+    _STOP_TIMEOUT = 5.0
+
+    def __init__(
+            self,
+            output_path : Path,
+            total : int,
+            read_segment : Callable[[int], bytes],
+            *,
+            name : str = '',
+            progress_interval : float = 5.0,
+            executable : str = 'ffmpeg',
+            ) -> None:
+        self._output_path = output_path
+        self._total = total
+        self._read_segment = read_segment
+        self._name = name or output_path.stem
+        self._progress_interval = progress_interval
+        self._executable = executable
+        self._completed : Set[int] = set()
+        self._next_index = 0
+        self._condition = threading.Condition()
+        self._process : Optional[subprocess.Popen] = None
+        self._threads : List[threading.Thread] = []
+        self._stderr_lines : Deque[str] = deque(maxlen=100)
+        self._feed_error : Optional[BaseException] = None
+        self._aborted = False
+        self.progress : Dict[str, str] = {}
+
+    @property
+    def output_path(self) -> Path:
+        return self._output_path
+
+    @property
+    def next_index(self) -> int:
+        return self._next_index
+
+    def start(self) -> None:
+        command = [
+            self._executable, '-hide_banner', '-loglevel', 'warning',
+            '-progress', 'pipe:1', '-nostats',
+            '-f', 'mpegts', '-i', 'pipe:0',
+            '-c', 'copy',
+            '-y',
+            str(self._output_path),
+        ]
+        self._process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        for target in (self._feed, self._read_progress, self._read_stderr):
+            thread = threading.Thread(target=target, name=f'ffmpeg_{target.__name__}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"ffmpeg已启动,边下载边封装:{self._name}")
+
+    def notify(self, index : int) -> None:
+        '''
+        通知某个ts已经完成并可以读取
+        '''
+        with self._condition:
+            if index >= self._next_index:
+                self._completed.add(index)
+                self._condition.notify()
+
+    def finish(self, timeout : Optional[float] = None) -> None:
+        '''
+        等待所有ts写入ffmpeg并等待ffmpeg退出, 超过timeout秒仍未结束时强制结束ffmpeg
+
+        Raises:
+            subprocess.CalledProcessError: ffmpeg返回非0或写入失败
+            subprocess.TimeoutExpired: ffmpeg超时未结束, 已被强制结束
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            for thread in self._threads:
+                thread.join(_remaining(deadline))
+                if thread.is_alive():
+                    raise subprocess.TimeoutExpired(self._process.args, timeout)
+            return_code = self._process.wait(_remaining(deadline))
+        except subprocess.TimeoutExpired:
+            logger.error(f"ffmpeg超过{timeout}秒未结束,强制结束:{self._name}")
+            self._stop()
+            raise
+        stderr = '\n'.join(self._stderr_lines)
+        if self._feed_error is not None or return_code != 0:
+            raise subprocess.CalledProcessError(return_code, self._process.args, stderr=stderr.encode('utf-8'))
+        logger.info(f"ffmpeg封装完成:{self._name}")
+
+    def abort(self) -> None:
+        self._stop()
+        if self._output_path.exists():
+            self._output_path.unlink()
+
+    def _stop(self) -> None:
+        '''
+        停止写入并结束ffmpeg, 后台线程在超时内未退出时不再等待(均为守护线程)
+        '''
+        with self._condition:
+            self._aborted = True
+            self._condition.notify_all()
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        for thread in self._threads:
+            thread.join(self._STOP_TIMEOUT)
+
+    def _feed(self) -> None:
+        try:
+            while True:
+                with self._condition:
+                    while not self._aborted and self._next_index < self._total and self._next_index not in self._completed:
+                        self._condition.wait()
+                    if self._aborted or self._next_index >= self._total:
+                        break
+                    index = self._next_index
+                    self._completed.discard(index)
+                self._process.stdin.write(self._read_segment(index))
+                with self._condition:
+                    self._next_index += 1
+        except (BrokenPipeError, OSError) as e:
+            self._feed_error = e
+            logger.error(f"写入ffmpeg失败:{self._name}, {e}")
+        finally:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+
+    def _read_progress(self) -> None:
+        last_log = 0.0
+        for raw_line in self._process.stdout:
+            key, _, value = raw_line.decode('utf-8', 'replace').strip().partition('=')
+            if not key:
+                continue
+            self.progress[key] = value
+            if key == 'progress':
+                now = time.monotonic()
+                if value == 'end' or now - last_log >= self._progress_interval:
+                    last_log = now
+                    logger.info(
+                        f"ffmpeg进度:{self._name}, 已写入{self._next_index}/{self._total}个ts, "
+                        f"时间:{self.progress.get('out_time', '-')}, 速度:{self.progress.get('speed', '-')}"
+                    )
+
+    def _read_stderr(self) -> None:
+        for raw_line in self._process.stderr:
+            line = raw_line.decode('utf-8', 'replace').rstrip()
+            if line:
+                self._stderr_lines.append(line)
+                logger.warning(f"ffmpeg:{self._name}, {line}")
+
+def _remaining(deadline : Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
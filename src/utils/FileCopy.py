@@ -0,0 +1,81 @@
+import os
+import sys
+import errno
+
+_CHUNK_SIZE = 1024 * 1024
+# copy_file_range/sendfile 不支持当前文件系统或跨文件系统时的错误码,遇到时退回到下一种方式
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.EPERM,
+    errno.EBADF,
+}
+
+def preallocate(fd : int, size : int) -> None:
+    '''
+    为输出文件预分配空间,减少碎片并提前发现磁盘空间不足,不支持时忽略
+    '''
+    if size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise
+        return
+
+def copy_range(
+        src_fd : int,
+        dst_fd : int,
+        count : int,
+        src_offset : int = 0,
+        dst_offset : int = 0,
+        ) -> None:
+    '''
+    将src_fd中从src_offset开始的count字节复制到dst_fd的dst_offset处.
+    依次尝试 os.copy_file_range, os.sendfile(仅Linux), 最后退回到用户态分块复制.
+    '''
+    if count <= 0:
+        return
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while count > 0:
+                copied = os.copy_file_range(src_fd, dst_fd, count, src_offset, dst_offset)
+                if copied == 0:
+                    break
+                count -= copied
+                src_offset += copied
+                dst_offset += copied
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+        if count == 0:
+            return
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        try:
+            os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+            while count > 0:
+                copied = os.sendfile(dst_fd, src_fd, src_offset, count)
+                if copied == 0:
+                    break
+                count -= copied
+                src_offset += copied
+                dst_offset += copied
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+        if count == 0:
+            return
+    os.lseek(src_fd, src_offset, os.SEEK_SET)
+    os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+    while count > 0:
+        chunk = os.read(src_fd, min(_CHUNK_SIZE, count))
+        if not chunk:
+            raise EOFError(f"源文件长度不足,剩余{count}字节未复制")
+        view = memoryview(chunk)
+        while view:
+            written = os.write(dst_fd, view)
+            view = view[written:]
+        count -= len(chunk)
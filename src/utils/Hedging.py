@@ -0,0 +1,60 @@
+from collections import deque
+from typing import Deque, Dict, Optional
+
+class HedgeTracker:
+    '''
+    对冲请求的触发策略与统计.
+    记录最近成功下载的ts耗时,某个ts的下载时间超过其percentile分位数时应当发起对冲请求;
+    同时统计发起的对冲次数以及对冲请求先完成的次数,用于调整阈值.
+    '''
+    def __init__(
+            self,
+            percentile : float = 0.95,
+            *,
+            history_size : int = 200,
+            min_samples : int = 10,
+            min_delay : float = 1.0,
+            ) -> None:
+        if not 0 < percentile < 1:
+            raise ValueError(f"百分位必须在0和1之间: {percentile}")
+        self._percentile = percentile
+        self._min_samples = min_samples
+        self._min_delay = min_delay
+        self._durations : Deque[float] = deque(maxlen=history_size)
+        self._issued = 0
+        self._won = 0
+
+    @property
+    def issued(self) -> int:
+        return self._issued
+
+    @property
+    def won(self) -> int:
+        return self._won
+
+    def record(self, elapsed : float) -> None:
+        self._durations.append(elapsed)
+
+    def threshold(self) -> Optional[float]:
+        '''
+        返回发起对冲请求前需要等待的秒数,样本不足时返回None
+        '''
+        if len(self._durations) < self._min_samples:
+            return None
+        ordered = sorted(self._durations)
+        index = min(int(len(ordered) * self._percentile), len(ordered) - 1)
+        return max(ordered[index], self._min_delay)
+
+    def on_issued(self) -> None:
+        self._issued += 1
+
+    def on_won(self) -> None:
+        self._won += 1
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        return {
+            'issued' : self._issued,
+            'won' : self._won,
+            'threshold' : self.threshold(),
+            'samples' : len(self._durations),
+        }
@@ -0,0 +1,100 @@
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..Config.Config import config
+from .Logger import Logger
+
+logger = Logger(config.log_dir).get_logger(__name__, logging.INFO)
+
+class HttpClient:
+    '''
+    爬虫, 页面解析与下载器共用的同步HTTP客户端.
+    所有请求共用一个requests.Session, 每个host一个keep-alive连接池(经代理时每个代理一组连接池),
+    请求头, 代理和超时在请求时从config读取, 服务器设置的cookie保存在会话中供后续请求使用.
+    连接池可以在多个线程中同时使用.
+    '''
+    def __init__(
+            self,
+            pool_connections : int = 16,
+            pool_maxsize : int = 16,
+            timeout : float = 10,
+            ) -> None:
+        '''
+        Args:
+            pool_connections (int): 最多保留连接池的host数
+            pool_maxsize (int): 每个host最多保留的空闲连接数
+            timeout (float): 默认超时时间(秒)
+        '''
+        self._timeout = timeout
+        self._adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self._session = requests.Session()
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+        self._requests : Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def request(
+            self,
+            method : str,
+            url : str,
+            headers : Optional[Dict[str, str]] = None,
+            timeout : Optional[float] = None,
+            **kwargs,
+            ) -> requests.Response:
+        '''
+        发送请求, headers会覆盖config.headers中的同名请求头, 未指定proxies时使用config.proxies
+        '''
+        merged_headers = dict(config.headers)
+        if headers:
+            merged_headers.update(headers)
+        kwargs.setdefault('proxies', config.proxies)
+        with self._lock:
+            self._requests[urlsplit(url).netloc] += 1
+        return self._session.request(
+            method,
+            url,
+            headers=merged_headers,
+            timeout=self._timeout if timeout is None else timeout,
+            **kwargs,
+        )
+
+    def get(self, url : str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        '''
+        返回每个host的请求数, 新建连接数与空闲连接数, 请求数大于新建连接数说明连接被复用.
+        已被淘汰的连接池只保留请求数
+        '''
+        with self._lock:
+            stats = {host : {'requests' : count, 'connections' : 0, 'idle' : 0} for host, count in self._requests.items()}
+        managers = [self._adapter.poolmanager, *self._adapter.proxy_manager.values()]
+        for manager in managers:
+            for pool_key in manager.pools.keys():
+                pool = manager.pools.get(pool_key)
+                if pool is None:
+                    continue
+                host = pool.host if pool.port in (None, 80, 443) else f'{pool.host}:{pool.port}'
+                entry = stats.setdefault(host, {'requests' : 0, 'connections' : 0, 'idle' : 0})
+                entry['connections'] += pool.num_connections
+                # 连接池队列中未建立的连接用None占位
+                idle = list(pool.pool.queue) if pool.pool is not None else []
+                entry['idle'] += sum(1 for connection in idle if connection is not None)
+        return stats
+
+    def log_stats(self) -> None:
+        for host, entry in self.stats().items():
+            logger.info(
+                f"连接池 {host}: 请求{entry['requests']}次, 新建连接{entry['connections']}个, 空闲连接{entry['idle']}个"
+            )
+
+    def close(self) -> None:
+        self._session.close()
+
+http_client = HttpClient(config.http_pool_connections, config.http_pool_maxsize, config.http_timeout)
@@ -0,0 +1,142 @@
+import os
+from pathlib import Path
+from typing import List, Optional, TextIO, Tuple
+
+class CompletionJournal:
+    '''
+    ts下载完成记录.
+    第一行为ts总数与第一个ts的媒体序号,之后每下载完成一个ts追加一行序号,恢复下载时直接读取记录,无需扫描临时目录.
+    m3u8刷新后媒体序号可能改变, 记录中的序号始终对应创建记录时的ts位置, 参见 DownloadPlan.rebase.
+    mark 只在内存中记录, 调用 flush 或 close 时才写入文件, 由调用方决定写入的频率;
+    未写入的记录在中断后丢失, 对应的ts会被重新下载
+    '''
+    def __init__(self, path : Path, total : int, media_sequence : int = 0) -> None:
+        self._path = path
+        self._total = total
+        self._media_sequence = media_sequence
+        self._done = bytearray(total)
+        self._count = 0
+        self._pending : List[int] = []
+        self._file : Optional[TextIO] = None
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    @property
+    def media_sequence(self) -> int:
+        return self._media_sequence
+
+    @property
+    def completed(self) -> int:
+        return self._count
+
+    def __contains__(self, index : int) -> bool:
+        return 0 <= index < self._total and self._done[index] == 1
+
+    @staticmethod
+    def read_header(path : Path) -> Optional[Tuple[int, Optional[int]]]:
+        '''
+        读取记录的ts总数与媒体序号, 旧版本的记录没有媒体序号
+
+        Returns:
+            Optional[Tuple[int, Optional[int]]]: 记录不存在或第一行无效时返回None
+        '''
+        try:
+            with open(path, 'rb') as f:
+                line = f.readline()
+        except FileNotFoundError:
+            return None
+        if not line.endswith(b'\n'):
+            return None
+        fields = line.split()
+        if not 1 <= len(fields) <= 2 or not all(field.isdigit() for field in fields):
+            return None
+        return int(fields[0]), int(fields[1]) if len(fields) == 2 else None
+
+    def load(self) -> bool:
+        '''
+        读取已有的记录
+
+        Returns:
+            bool: 记录存在且ts总数与媒体序号一致时返回True,否则返回False且不加载任何记录
+        '''
+        header = self.read_header(self._path)
+        if header is None:
+            return False
+        total, media_sequence = header
+        if total != self._total or media_sequence not in (None, self._media_sequence):
+            return False
+        with open(self._path, 'rb') as f:
+            data = f.read()
+        # 写入中断时最后一行可能不完整(例如"123"只写入了"12"), 只接受以换行结尾的行
+        end = data.rfind(b'\n') + 1
+        lines = data[:end].split(b'\n')
+        for line in lines[1:]:
+            line = line.strip()
+            if line.isdigit() and int(line) < self._total:
+                self._set(int(line))
+        if end < len(data):
+            # 截掉不完整的行, 否则之后追加的序号会接在它后面
+            with open(self._path, 'r+b') as f:
+                f.truncate(end)
+        return True
+
+    def reset(self) -> None:
+        self.close()
+        self._done = bytearray(self._total)
+        self._count = 0
+        self._pending = []
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._path, 'w', encoding='utf-8') as f:
+            f.write(self._header())
+
+    def mark(self, index : int) -> None:
+        if index in self:
+            return
+        self._set(index)
+        self._pending.append(index)
+
+    def flush(self) -> None:
+        '''
+        把 mark 之后的记录一次写入文件
+        '''
+        if not self._pending:
+            return
+        if self._file is None:
+            if not self._path.exists():
+                with open(self._path, 'w', encoding='utf-8') as f:
+                    f.write(self._header())
+            self._file = open(self._path, 'a', encoding='utf-8')
+        self._file.write(''.join(f'{index}\n' for index in self._pending))
+        self._file.flush()
+        self._pending = []
+
+    def missing(self) -> List[int]:
+        if self._count == self._total:
+            return []
+        return [index for index, done in enumerate(self._done) if not done]
+
+    def close(self) -> None:
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        self._pending = []
+        self.close()
+        if self._path.exists():
+            os.remove(self._path)
+
+    def _header(self) -> str:
+        return f'{self._total} {self._media_sequence}\n'
+
+    def _set(self, index : int) -> None:
+        if not self._done[index]:
+            self._done[index] = 1
+            self._count += 1
@@ -0,0 +1,61 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+class KeyCache:
+    '''
+    解密密钥缓存,所有视频共用.
+    同一个密钥地址只下载一次,同时请求同一地址的协程等待同一次下载;超过容量时淘汰最久未使用的密钥.
+    可以在多个线程的事件循环中使用,不同事件循环各自下载.
+    '''
+    def __init__(self, capacity : int = 64) -> None:
+        if capacity < 1:
+            raise ValueError(f"容量必须大于0: {capacity}")
+        self._capacity = capacity
+        self._keys : 'OrderedDict[str, bytes]' = OrderedDict()
+        self._pending : Dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def get_cached(self, uri : str) -> Optional[bytes]:
+        with self._lock:
+            key = self._keys.get(uri)
+            if key is not None:
+                self._keys.move_to_end(uri)
+            return key
+
+    def put(self, uri : str, key : bytes) -> None:
+        with self._lock:
+            self._keys[uri] = key
+            self._keys.move_to_end(uri)
+            while len(self._keys) > self._capacity:
+                self._keys.popitem(last=False)
+
+    async def get(self, uri : str, fetch : Callable[[str], Awaitable[bytes]]) -> bytes:
+        '''
+        返回密钥,未缓存时调用fetch下载,下载失败时异常传给所有等待的协程且不缓存
+        '''
+        key = self.get_cached(uri)
+        if key is not None:
+            return key
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._pending.get(uri)
+            if task is None or task.get_loop() is not loop:
+                task = loop.create_task(self._fetch(uri, fetch))
+                self._pending[uri] = task
+        # 某个等待的协程被取消时不影响其他协程
+        return await asyncio.shield(task)
+
+    async def _fetch(self, uri : str, fetch : Callable[[str], Awaitable[bytes]]) -> bytes:
+        try:
+            key = await fetch(uri)
+            self.put(uri, key)
+            return key
+        finally:
+            with self._lock:
+                if self._pending.get(uri) is asyncio.current_task():
+                    del self._pending[uri]
@@ -0,0 +1,177 @@
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 属性列表中带引号的值可能包含逗号
+_ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+class SegmentKey:
+    '''
+    EXT-X-KEY 标签, 相同的标签在所有ts之间共用一个对象
+    '''
+    __slots__ = ('method', 'uri', 'iv', 'keyformat')
+
+    def __init__(
+            self,
+            method : str,
+            uri : Optional[str] = None,
+            iv : Optional[str] = None,
+            keyformat : Optional[str] = None,
+            ) -> None:
+        self.method = method
+        self.uri = uri
+        self.iv = iv
+        self.keyformat = keyformat
+
+    def __eq__(self, other : object) -> bool:
+        if not isinstance(other, SegmentKey):
+            return NotImplemented
+        return (self.method, self.uri, self.iv, self.keyformat) == (other.method, other.uri, other.iv, other.keyformat)
+
+    def __hash__(self) -> int:
+        return hash((self.method, self.uri, self.iv, self.keyformat))
+
+    def __repr__(self) -> str:
+        return f"SegmentKey(method={self.method!r}, uri={self.uri!r}, iv={self.iv!r})"
+
+class MediaSegment:
+    '''
+    媒体m3u8中的一个ts, 只保存下载需要的字段.
+    byterange保留EXT-X-BYTERANGE的原始值, 省略起始位置时需要同一文件中上一个ts的结束位置,
+    由 DownloadPlan 用 parse_byterange 换算成长度与起始位置
+    '''
+    __slots__ = ('uri', 'duration', 'title', 'key', 'byterange', 'media_sequence', 'discontinuity')
+
+    def __init__(
+            self,
+            uri : str,
+            duration : Optional[float],
+            media_sequence : int,
+            key : Optional[SegmentKey] = None,
+            byterange : Optional[str] = None,
+            title : str = '',
+            discontinuity : bool = False,
+            ) -> None:
+        self.uri = uri
+        self.duration = duration
+        self.media_sequence = media_sequence
+        self.key = key
+        self.byterange = byterange
+        self.title = title
+        self.discontinuity = discontinuity
+
+    def __repr__(self) -> str:
+        return f"MediaSegment(uri={self.uri!r}, duration={self.duration!r}, media_sequence={self.media_sequence})"
+
+class MediaPlaylist:
+    '''
+    媒体m3u8的头部信息与ts列表.
+    keys 与 m3u8.M3U8.keys 含义相同: 按出现顺序排列的不同密钥, 存在未加密的ts时包含None
+    '''
+    __slots__ = ('media_sequence', 'target_duration', 'version', 'is_endlist', 'segments', 'keys')
+
+    def __init__(self) -> None:
+        self.media_sequence = 0
+        self.target_duration : Optional[float] = None
+        self.version : Optional[int] = None
+        self.is_endlist = False
+        self.segments : Tuple[MediaSegment, ...] = ()
+        self.keys : List[Optional[SegmentKey]] = []
+
+def _parse_attributes(value : str) -> Dict[str, str]:
+    return {
+        name : raw[1:-1] if raw.startswith('"') else raw
+        for name, raw in _ATTRIBUTE_PATTERN.findall(value)
+    }
+
+def _parse_key(value : str) -> Optional[SegmentKey]:
+    attributes = _parse_attributes(value)
+    method = attributes.get('METHOD', 'NONE')
+    if method.upper() == 'NONE':
+        return None
+    return SegmentKey(method, attributes.get('URI'), attributes.get('IV'), attributes.get('KEYFORMAT'))
+
+def parse_byterange(value : str, default_offset : int = 0) -> Tuple[int, int]:
+    '''
+    解析EXT-X-BYTERANGE的值 n[@o]
+
+    Args:
+        value (str): 标签的值
+        default_offset (int): 没有@o时的起始位置, 即同一文件中上一个ts的结束位置
+
+    Returns:
+        Tuple[int, int]: 长度与起始位置
+    '''
+    length, _, offset = value.partition('@')
+    return int(length), int(offset) if offset else default_offset
+
+def iter_segments(
+        lines : Iterable[str],
+        playlist : Optional[MediaPlaylist] = None,
+        ) -> Iterator[MediaSegment]:
+    '''
+    逐行解析媒体m3u8, 每遇到一个ts地址生成一个ts, 可以直接传入打开的文件
+
+    Args:
+        lines (Iterable[str]): m3u8的各行
+        playlist (Optional[MediaPlaylist]): 不为None时把头部信息与出现的密钥写入其中
+
+    Raises:
+        ValueError: 传入的是主m3u8
+    '''
+    media_sequence = 0
+    key : Optional[SegmentKey] = None
+    # 已出现过的密钥, 相同的密钥共用一个对象
+    shared : Dict[SegmentKey, SegmentKey] = {}
+    keys : Dict[Optional[SegmentKey], None] = {}
+    duration : Optional[float] = None
+    title = ''
+    byterange : Optional[str] = None
+    discontinuity = False
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] != '#':
+            if key not in keys:
+                keys[key] = None
+                if playlist is not None:
+                    playlist.keys.append(key)
+            yield MediaSegment(line, duration, media_sequence, key, byterange, title, discontinuity)
+            media_sequence += 1
+            duration, title, byterange, discontinuity = None, '', None, False
+            continue
+        tag, _, value = line.partition(':')
+        if tag == '#EXTINF':
+            length, _, title = value.partition(',')
+            duration = float(length)
+        elif tag == '#EXT-X-KEY':
+            key = _parse_key(value)
+            if key is not None:
+                key = shared.setdefault(key, key)
+        elif tag == '#EXT-X-BYTERANGE':
+            byterange = value
+        elif tag == '#EXT-X-DISCONTINUITY':
+            discontinuity = True
+        elif tag == '#EXT-X-MEDIA-SEQUENCE':
+            media_sequence = int(value)
+            if playlist is not None:
+                playlist.media_sequence = media_sequence
+        elif tag == '#EXT-X-TARGETDURATION':
+            if playlist is not None:
+                playlist.target_duration = float(value)
+        elif tag == '#EXT-X-VERSION':
+            if playlist is not None:
+                playlist.version = int(value)
+        elif tag == '#EXT-X-ENDLIST':
+            if playlist is not None:
+                playlist.is_endlist = True
+        elif tag == '#EXT-X-STREAM-INF':
+            raise ValueError("不支持解析主m3u8, 请先选择一个媒体m3u8")
+
+def parse_media_playlist(text : str) -> MediaPlaylist:
+    '''
+    解析完整的媒体m3u8
+    '''
+    playlist = MediaPlaylist()
+    playlist.segments = tuple(iter_segments(text.splitlines(), playlist))
+    return playlist
@@ -0,0 +1,146 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+class BandwidthLimiter:
+    '''
+    令牌桶带宽限制器,整个下载过程共用一个桶.
+    令牌按 rate 字节/秒 补充,桶容量为 burst;令牌不足时各视频按权重公平地分配后续令牌.
+    rate 为None时不限速,可以在下载过程中从任意线程调用 set_rate 修改.
+    '''
+    def __init__(self, rate : Optional[float] = None, burst : Optional[int] = None) -> None:
+        self._rate = None
+        self._burst = burst
+        self._capacity = 0.0
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._weights : Dict[str, float] = {}
+        # 各视频按权重折算后已消耗的字节数,用于公平分配
+        self._served : Dict[str, float] = {}
+        self._waiters : Dict[str, Deque[Tuple[int, asyncio.Future]]] = {}
+        self._loop : Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup : Optional[asyncio.Event] = None
+        self._pump_task : Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+        self.set_rate(rate)
+
+    @property
+    def rate(self) -> Optional[float]:
+        return self._rate
+
+    def set_rate(self, rate : Optional[float]) -> None:
+        '''
+        修改限速,为None或0时取消限速,正在等待的请求按新的速率继续
+        '''
+        if rate is not None and rate < 0:
+            raise ValueError(f"限速不能小于0: {rate}")
+        with self._lock:
+            self._refill()
+            self._rate = rate or None
+            if self._rate is not None:
+                self._capacity = float(self._burst or max(self._rate / 2, 1))
+                self._tokens = min(self._tokens, self._capacity)
+        if self._loop is not None and not self._loop.is_closed():
+            try:
+                self._loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                pass
+
+    def register(self, key : str, weight : float = 1.0) -> None:
+        if weight <= 0:
+            raise ValueError(f"权重必须大于0: {weight}")
+        self._weights[key] = weight
+        self._waiters.setdefault(key, deque())
+        # 新加入的视频从当前最小的消耗量开始,不能补回之前未使用的带宽
+        active = [self._served[other] for other in self._served if other != key]
+        self._served[key] = max(self._served.get(key, 0.0), min(active, default=0.0))
+
+    def unregister(self, key : str) -> None:
+        for _, waiter in self._waiters.pop(key, ()):
+            if not waiter.done():
+                waiter.cancel()
+        self._weights.pop(key, None)
+        self._served.pop(key, None)
+
+    async def consume(self, key : str, nbytes : int) -> None:
+        '''
+        消耗nbytes个令牌,令牌不足时等待
+        '''
+        if self._rate is None or nbytes <= 0:
+            return
+        if key not in self._weights:
+            self.register(key)
+        self._served[key] += nbytes / self._weights[key]
+        with self._lock:
+            self._refill()
+            if not self._has_waiters() and self._tokens >= min(nbytes, self._capacity):
+                self._tokens -= nbytes
+                return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[key].append((nbytes, waiter))
+        self._ensure_pump()
+        await waiter
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self._rate is not None:
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def _has_waiters(self) -> bool:
+        return any(waiters for waiters in self._waiters.values())
+
+    def _pick(self) -> Optional[str]:
+        '''
+        在有等待请求的视频中选出按权重折算后消耗最少的一个
+        '''
+        chosen = None
+        for key, waiters in self._waiters.items():
+            while waiters and waiters[0][1].done():
+                waiters.popleft()
+            if waiters and (chosen is None or self._served[key] < self._served[chosen]):
+                chosen = key
+        return chosen
+
+    def _wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _ensure_pump(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._pump_task = None
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = loop.create_task(self._pump())
+
+    async def _pump(self) -> None:
+        '''
+        按补充速度依次放行等待的请求,限速取消时全部放行
+        '''
+        while True:
+            key = self._pick()
+            if key is None:
+                return
+            nbytes, waiter = self._waiters[key][0]
+            with self._lock:
+                self._refill()
+                rate = self._rate
+                if rate is not None:
+                    needed = min(nbytes, self._capacity) - self._tokens
+                    if needed <= 0:
+                        # 令牌可以为负,大块数据的欠账由之后的请求等待补足
+                        self._tokens -= nbytes
+            if rate is None or needed <= 0:
+                self._waiters[key].popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=needed / rate)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,154 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional, AsyncIterator, Any
+
+class SegmentScheduler:
+    '''
+    全局ts下载调度器,整个下载过程共用一个连接预算.
+    空闲的连接按权重公平地分配给仍有ts等待下载的视频,某个视频下载完成后其连接会立即被其他视频使用.
+    '''
+    def __init__(self, limit : int) -> None:
+        if limit < 1:
+            raise ValueError(f"连接数必须大于0: {limit}")
+        self._limit = limit
+        self._in_flight = 0
+        self._weights : Dict[str, float] = {}
+        self._running : Dict[str, int] = {}
+        self._waiters : Dict[str, Deque[asyncio.Future]] = {}
+        # 并发控制器,由控制器自身注册,参见 utils.Concurrency.AIMDController
+        self.controller : Optional[Any] = None
+        # 全局内存预算,用尽时接收ts的协程会等待,参见 utils.Budget.ByteBudget
+        self.memory : Optional[Any] = None
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @limit.setter
+    def limit(self, value : int) -> None:
+        if value < 1:
+            raise ValueError(f"连接数必须大于0: {value}")
+        self._limit = value
+        self._dispatch()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def saturated(self) -> bool:
+        '''
+        连接是否已经用满,用满时才有必要增加连接数
+        '''
+        return self._in_flight >= self._limit or self._has_waiters()
+
+    def register(self, key : str, weight : float = 1.0) -> None:
+        if weight <= 0:
+            raise ValueError(f"权重必须大于0: {weight}")
+        self._weights[key] = weight
+        self._running.setdefault(key, 0)
+        self._waiters.setdefault(key, deque())
+
+    def unregister(self, key : str) -> None:
+        for waiter in self._waiters.pop(key, ()):
+            if not waiter.done():
+                waiter.cancel()
+        self._weights.pop(key, None)
+        if not self._running.get(key):
+            self._running.pop(key, None)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        '''
+        返回每个视频当前占用的连接数,等待数以及权重
+        '''
+        return {
+            key : {
+                'running' : self._running.get(key, 0),
+                'waiting' : sum(1 for waiter in self._waiters.get(key, ()) if not waiter.done()),
+                'weight' : weight,
+            }
+            for key, weight in self._weights.items()
+        }
+
+    async def acquire(self, key : str) -> None:
+        if key not in self._weights:
+            self.register(key)
+        if self._in_flight < self._limit and not self._has_waiters():
+            self._grant(key)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[key].append(waiter)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # 已经分配到连接但任务被取消,需要归还
+            if waiter.done() and not waiter.cancelled():
+                self.release(key)
+            raise
+
+    def try_acquire(self, key : str) -> bool:
+        '''
+        只在有空闲连接且没有等待任务时立即占用一个连接,不等待
+        '''
+        if key not in self._weights:
+            self.register(key)
+        if self._in_flight < self._limit and not self._has_waiters():
+            self._grant(key)
+            return True
+        return False
+
+    def release(self, key : str) -> None:
+        self._in_flight -= 1
+        self._running[key] = self._running.get(key, 1) - 1
+        if key not in self._weights and self._running[key] <= 0:
+            self._running.pop(key, None)
+        self._dispatch()
+
+    def report_success(self, latency : float, nbytes : int) -> None:
+        if self.controller is not None:
+            self.controller.on_success(latency, nbytes)
+
+    def report_failure(self, reason : str) -> None:
+        if self.controller is not None:
+            self.controller.on_failure(reason)
+
+    @asynccontextmanager
+    async def slot(self, key : str) -> AsyncIterator[None]:
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def _grant(self, key : str) -> None:
+        self._in_flight += 1
+        self._running[key] = self._running.get(key, 0) + 1
+
+    def _has_waiters(self) -> bool:
+        return self._pick() is not None
+
+    def _pick(self) -> Optional[str]:
+        '''
+        在有等待任务的视频中选出 占用连接数/权重 最小的一个
+        '''
+        chosen, chosen_share = None, None
+        for key, waiters in self._waiters.items():
+            while waiters and waiters[0].done():
+                waiters.popleft()
+            if not waiters:
+                continue
+            share = self._running.get(key, 0) / self._weights.get(key, 1.0)
+            if chosen_share is None or share < chosen_share:
+                chosen, chosen_share = key, share
+        return chosen
+
+    def _dispatch(self) -> None:
+        while self._in_flight < self._limit:
+            key = self._pick()
+            if key is None:
+                return
+            waiter = self._waiters[key].popleft()
+            self._grant(key)
+            waiter.set_result(None)
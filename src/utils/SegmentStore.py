@@ -0,0 +1,202 @@
+import os
+import zlib
+import threading
+from pathlib import Path
+from collections import namedtuple
+
+from .FileCopy import copy_range, preallocate
+from typing import Dict, Iterator, List, Optional, TextIO
+
+SegmentRecord = namedtuple('SegmentRecord', ['offset', 'length', 'checksum'])
+
+def write_at(file_path : Path, offset : int, data : bytes, checksum : int = 0) -> int:
+    '''
+    在文件指定位置写入数据,可以在工作线程或进程中并发调用
+
+    Args:
+        checksum (int): 分块写入时前面各块的crc32
+
+    Returns:
+        int: 累计到本块的crc32校验值
+    '''
+    if hasattr(os, 'pwrite'):
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
+        finally:
+            os.close(fd)
+    else:
+        with open(file_path, 'r+b' if os.path.exists(file_path) else 'wb') as f:
+            f.seek(offset)
+            f.write(data)
+    return zlib.crc32(data, checksum)
+
+def read_checksum(file_path : Path, offset : int, length : int, chunk_size : int = 1024 * 1024) -> int:
+    '''
+    计算文件中一段数据的crc32,用于分段并行写入后补算校验值
+    '''
+    checksum = 0
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            checksum = zlib.crc32(chunk, checksum)
+            length -= len(chunk)
+    return checksum
+
+class PackedSegmentStore:
+    '''
+    单文件ts存储.
+    一个视频的所有ts写入同一个稀疏文件,索引文件每行记录 序号 偏移 长度 crc32,
+    合并时按序号顺序读取,清理时只需删除两个文件.
+    '''
+    def __init__(
+            self,
+            data_path : Path,
+            total : int,
+            ) -> None:
+        self._data_path = data_path
+        self._index_path = data_path.with_name(data_path.name + '.index')
+        self._total = total
+        self._records : Dict[int, SegmentRecord] = {}
+        self._tail = 0
+        self._reserved = 0
+        self._index_file : Optional[TextIO] = None
+        # 已提交但还未写入索引文件的行
+        self._pending : List[str] = []
+        self._lock = threading.Lock()
+
+    @property
+    def data_path(self) -> Path:
+        return self._data_path
+
+    @property
+    def index_path(self) -> Path:
+        return self._index_path
+
+    @property
+    def records(self) -> Dict[int, SegmentRecord]:
+        return self._records
+
+    def __contains__(self, index : int) -> bool:
+        return index in self._records
+
+    def load(self) -> None:
+        with self._lock:
+            self._records = {}
+            self._pending = []
+            self._tail = 0
+            if not self._index_path.exists():
+                return
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    fields = line.split()
+                    # 写入中断时最后一行可能不完整
+                    if len(fields) != 4 or not all(field.isdigit() for field in fields):
+                        continue
+                    index, offset, length, checksum = map(int, fields)
+                    if index < self._total:
+                        self._records[index] = SegmentRecord(offset, length, checksum)
+                        self._tail = max(self._tail, offset + length)
+
+    def allocate(self, length : int) -> int:
+        '''
+        为一个ts分配写入位置,首次分配时按ts总数预留稀疏空间
+
+        Returns:
+            int: 写入偏移
+        '''
+        with self._lock:
+            offset = self._tail
+            self._tail += length
+            if self._reserved == 0:
+                self._reserve(int(length * self._total * 1.1))
+            return offset
+
+    def commit(self, index : int, offset : int, length : int, checksum : int) -> None:
+        with self._lock:
+            self._records[index] = SegmentRecord(offset, length, checksum)
+            self._pending.append(f'{index} {offset} {length} {checksum}\n')
+
+    def flush(self) -> None:
+        '''
+        把 commit 之后的索引一次写入文件, 完成记录写入前调用, 保证记录中的ts在索引中都存在
+        '''
+        with self._lock:
+            if not self._pending:
+                return
+            if self._index_file is None:
+                self._index_file = open(self._index_path, 'a', encoding='utf-8')
+            self._index_file.write(''.join(self._pending))
+            self._index_file.flush()
+            self._pending = []
+
+    def read(self, index : int) -> bytes:
+        record = self._records[index]
+        with open(self._data_path, 'rb') as f:
+            f.seek(record.offset)
+            return f.read(record.length)
+
+    def iter_chunks(self, chunk_size : int = 1024 * 1024) -> Iterator[bytes]:
+        '''
+        按ts序号顺序读取所有数据
+        '''
+        with open(self._data_path, 'rb') as f:
+            for index in range(self._total):
+                record = self._records[index]
+                f.seek(record.offset)
+                remaining = record.length
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining))
+                    if not chunk:
+                        raise ValueError(f"ts存储文件不完整,序号:{index}")
+                    remaining -= len(chunk)
+                    yield chunk
+
+    def copy_into(self, output_path : Path) -> None:
+        '''
+        按ts序号顺序复制到输出文件,输出文件预分配空间,复制由内核完成
+        '''
+        records = [self._records[index] for index in range(self._total)]
+        src_fd = os.open(self._data_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            dst_fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+            try:
+                preallocate(dst_fd, sum(record.length for record in records))
+                offset = 0
+                for record in records:
+                    copy_range(src_fd, dst_fd, record.length, record.offset, offset)
+                    offset += record.length
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            if self._index_file is not None:
+                self._index_file.close()
+                self._index_file = None
+
+    def remove(self) -> None:
+        with self._lock:
+            self._pending = []
+        self.close()
+        for path in (self._data_path, self._index_path):
+            if path.exists():
+                os.remove(path)
+
+    def _reserve(self, size : int) -> None:
+        # 预留的空间是稀疏的,不占用实际磁盘
+        self._data_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._data_path, 'ab') as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self._reserved = size
@@ -0,0 +1,90 @@
+import time
+from urllib.parse import urlsplit, parse_qsl
+from typing import Iterable, Optional
+
+# 签名地址中常见的过期时间参数, 值为unix时间戳
+_EXPIRY_PARAMS = {'expires', 'expire', 'expiry', 'exp', 'e', 'validto', 'deadline'}
+_MAX_LIFETIME = 30 * 24 * 3600
+
+def parse_expiry(url : str) -> Optional[float]:
+    '''
+    从签名地址的查询参数中解析过期时间
+
+    Returns:
+        Optional[float]: 过期时间的unix时间戳, 无法解析时返回None
+    '''
+    now = time.time()
+    for name, value in parse_qsl(urlsplit(url).query):
+        if name.lower() not in _EXPIRY_PARAMS or not value.isdigit():
+            continue
+        expires = int(value)
+        # 毫秒时间戳
+        if expires > 1e12:
+            expires /= 1000
+        if now < expires < now + _MAX_LIFETIME:
+            return float(expires)
+    return None
+
+class TokenLifetime:
+    '''
+    估计签名m3u8地址的有效期, 用于在过期前主动刷新m3u8.
+    有效期取地址中的过期参数与实际观察到的过期时间中较短的一个, 在剩余margin比例时刷新.
+    观察到的有效期不低于min_lifetime; 刷新前没有再过期时按growth倍放宽, 避免一次过早的过期错误让之后一直频繁刷新.
+    '''
+    def __init__(
+            self,
+            margin : float = 0.2,
+            min_delay : float = 1.0,
+            min_lifetime : float = 30.0,
+            growth : float = 1.5,
+            ) -> None:
+        self._margin = margin
+        self._min_delay = min_delay
+        self._min_lifetime = min_lifetime
+        self._growth = growth
+        self._fetched_at : Optional[float] = None
+        self._lifetime : Optional[float] = None
+        self._learned : Optional[float] = None
+        self._expired = False
+
+    @property
+    def lifetime(self) -> Optional[float]:
+        return self._lifetime
+
+    def on_fetched(self, urls : Iterable[str]) -> None:
+        '''
+        m3u8获取成功时调用, urls为m3u8地址以及其中的ts地址
+        '''
+        now = time.time()
+        if self._learned is not None and self._fetched_at is not None and not self._expired:
+            # 上一次获取的m3u8直到刷新都没有过期
+            self._learned *= self._growth
+        self._expired = False
+        self._fetched_at = time.monotonic()
+        expiries = [expires for expires in map(parse_expiry, urls) if expires is not None]
+        lifetimes = [min(expiries) - now] if expiries else []
+        if self._learned is not None:
+            lifetimes.append(self._learned)
+        self._lifetime = min(lifetimes) if lifetimes else None
+
+    def on_expired(self) -> None:
+        '''
+        服务器明确返回过期(403/410)时调用, 从获取m3u8到过期的时间作为有效期的上限
+        '''
+        if self._fetched_at is None:
+            return
+        self._expired = True
+        elapsed = max(time.monotonic() - self._fetched_at, self._min_lifetime)
+        if self._learned is None or elapsed < self._learned:
+            self._learned = elapsed
+        if self._lifetime is None or elapsed < self._lifetime:
+            self._lifetime = elapsed
+
+    def refresh_delay(self) -> Optional[float]:
+        '''
+        距离下一次主动刷新的秒数, 有效期未知时返回None
+        '''
+        if self._lifetime is None or self._fetched_at is None:
+            return None
+        refresh_at = self._fetched_at + self._lifetime * (1 - self._margin)
+        return max(refresh_at - time.monotonic(), self._min_delay)
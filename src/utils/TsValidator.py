@@ -0,0 +1,189 @@
+import os
+import mmap
+from functools import lru_cache
+from itertools import compress
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+TS_PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+NULL_PID = 0x1FFF
+# PCR 为27MHz时钟, 基数部分33位
+PCR_CLOCK = 27_000_000
+PCR_WRAP = (1 << 33) * 300
+
+class TsValidator:
+    '''
+    MPEG-TS 完整性校验.
+    检查每个188字节包的同步字节0x47、各PID的连续计数器,以及PCR跨度是否与EXTINF时长大致相符.
+    同步字节与包头字段通过memoryview按188字节步长取出后整体比较,不逐包遍历.
+    解密后的数据可能带有PKCS7填充,末尾不足一个包且符合填充格式的字节不视为损坏.
+    '''
+    def __init__(
+            self,
+            max_continuity_errors : int = 3,
+            duration_tolerance : float = 0.5,
+            ) -> None:
+        self._max_continuity_errors = max_continuity_errors
+        self._duration_tolerance = duration_tolerance
+
+    def validate(
+            self,
+            data : Union[bytes, bytearray, memoryview],
+            duration : Optional[float] = None,
+            ) -> Optional[str]:
+        '''
+        校验一个ts的内容
+
+        Returns:
+            Optional[str]: 损坏原因, 通过校验时返回None
+        '''
+        view = memoryview(data)
+        size = len(view)
+        if size < TS_PACKET_SIZE:
+            return f"长度不足一个ts包: {size}字节"
+        remainder = size % TS_PACKET_SIZE
+        if remainder:
+            padding = view[size - remainder:].tobytes()
+            if remainder > 16 or padding != bytes([remainder]) * remainder:
+                return f"末尾有不完整的ts包: {remainder}字节"
+            view = view[:size - remainder]
+        count = len(view) // TS_PACKET_SIZE
+        sync = view[0::TS_PACKET_SIZE].tobytes()
+        if sync != bytes([SYNC_BYTE]) * count:
+            position = next(i for i, byte in enumerate(sync) if byte != SYNC_BYTE)
+            return f"第{position}个ts包同步字节错误"
+        return self._check_packets(view, count, duration)
+
+    def validate_file(
+            self,
+            file_path : Path,
+            offset : int = 0,
+            length : Optional[int] = None,
+            duration : Optional[float] = None,
+            ) -> Optional[str]:
+        '''
+        通过内存映射校验文件中的一个ts, 只映射该ts所在的范围, 可以在工作线程或进程中调用
+
+        Args:
+            offset (int): ts在文件中的起始位置, 用于单文件存储
+            length (Optional[int]): ts的长度, 为None时到文件末尾
+        '''
+        try:
+            fd = os.open(file_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        except OSError as e:
+            return f"无法打开文件: {e}"
+        try:
+            file_size = os.fstat(fd).st_size
+            if length is None:
+                length = file_size - offset
+            if length <= 0 or offset + length > file_size:
+                return f"文件长度不足: {file_size}字节"
+            # 映射的起始位置必须按ALLOCATIONGRANULARITY对齐
+            start = offset - offset % mmap.ALLOCATIONGRANULARITY
+            with mmap.mmap(fd, offset - start + length, offset=start, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    return self.validate(view[offset - start:], duration)
+                finally:
+                    view.release()
+        finally:
+            os.close(fd)
+
+    def _check_packets(
+            self,
+            view : memoryview,
+            count : int,
+            duration : Optional[float],
+            ) -> Optional[str]:
+        '''
+        检查传输错误标志、连续计数器与PCR跨度.
+        包头字段按步长一次取出, 各条件通过查表(bytes.translate)转换为0/1的掩码,
+        掩码之间的与/异或按大整数计算, 只有PCR包在Python中逐个处理
+        '''
+        header1 = view[1::TS_PACKET_SIZE].tobytes()
+        header2 = view[2::TS_PACKET_SIZE].tobytes()
+        header3 = view[3::TS_PACKET_SIZE].tobytes()
+        af_length = view[4::TS_PACKET_SIZE].tobytes()
+        af_flags = view[5::TS_PACKET_SIZE].tobytes()
+        position = header1.translate(_TRANSPORT_ERROR).find(1)
+        if position >= 0:
+            return f"第{position}个ts包带有传输错误标志"
+        pid_high = header1.translate(_PID_HIGH)
+        has_af = _and(header3.translate(_HAS_AF), af_length.translate(_NONZERO))
+        discontinuity = _and(has_af, af_flags.translate(_DISCONTINUITY))
+        payload = header3.translate(_HAS_PAYLOAD)
+        counters = header3.translate(_COUNTER)
+        continuity_errors = 0
+        for high, low in set(zip(pid_high, header2)):
+            if (high << 8) | low == NULL_PID:
+                continue
+            selected = _and(_and(pid_high.translate(_equals(high)), header2.translate(_equals(low))), payload)
+            sequence = bytes(compress(counters, selected))
+            if len(sequence) < 2:
+                continue
+            previous, current = sequence[:-1], sequence[1:]
+            # 计数器应为上一个加一; 重复包的计数器不变, 带不连续标志的包重新开始计数, 都不算作错误
+            errors = _and(
+                _and(_not_equal(previous.translate(_NEXT_COUNTER), current), _not_equal(previous, current)),
+                _not(bytes(compress(discontinuity, selected))[1:]),
+            )
+            continuity_errors += errors.count(1)
+        if continuity_errors > self._max_continuity_errors:
+            return f"连续计数器错误过多: {continuity_errors}"
+        if duration and duration >= 1:
+            pcr_mask = _and(_and(has_af, af_flags.translate(_PCR_FLAG)), af_length.translate(_AT_LEAST_7))
+            pcr_packets = [
+                i for i in compress(range(count), pcr_mask)
+                if (pid_high[i] << 8) | header2[i] != NULL_PID
+            ]
+            if pcr_packets:
+                pcr_pid = (pid_high[pcr_packets[0]], header2[pcr_packets[0]])
+                pcr_packets = [i for i in pcr_packets if (pid_high[i], header2[i]) == pcr_pid]
+            if len(pcr_packets) >= 2:
+                first = self._read_pcr(view, pcr_packets[0] * TS_PACKET_SIZE + 6)
+                last = self._read_pcr(view, pcr_packets[-1] * TS_PACKET_SIZE + 6)
+                span = ((last - first) % PCR_WRAP) / PCR_CLOCK
+                if abs(span - duration) > duration * self._duration_tolerance:
+                    return f"PCR跨度与时长不符: {span:.2f}秒/{duration:.2f}秒"
+        return None
+
+    @staticmethod
+    def _read_pcr(view : memoryview, position : int) -> int:
+        b = view[position:position + 6].tobytes()
+        base = (b[0] << 25) | (b[1] << 17) | (b[2] << 9) | (b[3] << 1) | (b[4] >> 7)
+        extension = ((b[4] & 0x01) << 8) | b[5]
+        return base * 300 + extension
+
+def _table(function : Callable[[int], int]) -> bytes:
+    return bytes(function(byte) for byte in range(256))
+
+_TRANSPORT_ERROR = _table(lambda byte: 1 if byte & 0x80 else 0)
+_PID_HIGH = _table(lambda byte: byte & 0x1F)
+_HAS_AF = _table(lambda byte: 1 if byte & 0x20 else 0)
+_HAS_PAYLOAD = _table(lambda byte: 1 if byte & 0x10 else 0)
+_COUNTER = _table(lambda byte: byte & 0x0F)
+_NEXT_COUNTER = _table(lambda byte: (byte + 1) & 0x0F)
+_NONZERO = _table(lambda byte: 1 if byte else 0)
+_DISCONTINUITY = _table(lambda byte: 1 if byte & 0x80 else 0)
+_PCR_FLAG = _table(lambda byte: 1 if byte & 0x10 else 0)
+_AT_LEAST_7 = _table(lambda byte: 1 if byte >= 7 else 0)
+
+@lru_cache(maxsize=None)
+def _equals(value : int) -> bytes:
+    return _table(lambda byte: 1 if byte == value else 0)
+
+def _and(left : bytes, right : bytes) -> bytes:
+    '''
+    两个0/1掩码逐字节相与
+    '''
+    return (int.from_bytes(left, 'big') & int.from_bytes(right, 'big')).to_bytes(len(left), 'big')
+
+def _not(mask : bytes) -> bytes:
+    return (int.from_bytes(mask, 'big') ^ int.from_bytes(b'\x01' * len(mask), 'big')).to_bytes(len(mask), 'big')
+
+def _not_equal(left : bytes, right : bytes) -> bytes:
+    '''
+    逐字节比较, 不相等的位置为1
+    '''
+    return (int.from_bytes(left, 'big') ^ int.from_bytes(right, 'big')).to_bytes(len(left), 'big').translate(_NONZERO)
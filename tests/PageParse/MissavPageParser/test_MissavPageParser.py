@@ -0,0 +1,74 @@
+from pathlib import Path
+
+import pytest
+
+from src.PageParse.MissavPageParser import MissavPageParser as parser_module
+from src.PageParse.MissavPageParser.MissavPageParser import MissavPageParser
+from src.PageParse.utils.MissavPageParseUtils import Variant, select_variant
+
+_HTML = (Path(__file__).resolve().parents[3] / 'test_files' / 'missav' / 'missav_video_page_jufe_590.html').read_text(encoding='utf-8')
+
+_MASTER = '\n'.join([
+    '#EXTM3U',
+    '#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360', '360p/video.m3u8',
+    '#EXT-X-STREAM-INF:BANDWIDTH=6000000,RESOLUTION=1920x1080', '1080p/video.m3u8',
+    '#EXT-X-STREAM-INF:BANDWIDTH=2800000,RESOLUTION=1280x720', '720p/video.m3u8',
+    '',
+])
+
+_VARIANTS = [
+    Variant(800000, '640x360', '360p'),
+    Variant(6000000, '1920x1080', '1080p'),
+    Variant(2800000, '1280x720', '720p'),
+]
+
+class _Response:
+    status_code = 200
+    text = _MASTER
+
+def test_select_variant_policies():
+    assert select_variant(_VARIANTS).url == '1080p'
+    assert select_variant(_VARIANTS, 'resolution', max_height=720).url == '720p'
+    assert select_variant(_VARIANTS, 'resolution', max_height=240).url == '360p'
+    assert select_variant(_VARIANTS, 'throughput', throughput=500_000).url == '720p'
+    assert select_variant(_VARIANTS, 'throughput').url == '1080p'
+    with pytest.raises(ValueError):
+        select_variant(_VARIANTS, 'smallest')
+
+def test_master_playlist_is_cached_per_uuid(monkeypatch):
+    requests_made = []
+
+    def fake_get(url, **kwargs):
+        requests_made.append(url)
+        return _Response()
+
+    monkeypatch.setattr(parser_module.http_client, 'get', fake_get)
+    monkeypatch.setattr(parser_module, '_master_playlists', {})
+    parser = MissavPageParser(_HTML, variant_policy='resolution', max_height=720)
+    assert parser._parse_hls_url() == 'https://surrit.com/f90b6493-7eaa-4a5b-833e-7b0b0b05f7f0/720p/video.m3u8'
+    assert MissavPageParser(_HTML)._parse_hls_url().endswith('/1080p/video.m3u8')
+    assert requests_made == ['https://surrit.com/f90b6493-7eaa-4a5b-833e-7b0b0b05f7f0/playlist.m3u8']
+
+def test_expired_master_playlists_are_evicted(monkeypatch):
+    requests_made = []
+
+    def fake_get(url, **kwargs):
+        requests_made.append(url)
+        return _Response()
+
+    now = [1000.0]
+    monkeypatch.setattr(parser_module.http_client, 'get', fake_get)
+    monkeypatch.setattr(parser_module.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(parser_module.config, 'hls_master_ttl', 600)
+    cache = {'old-uuid' : (0.0, _VARIANTS), 'fresh-uuid' : (900.0, _VARIANTS)}
+    monkeypatch.setattr(parser_module, '_master_playlists', cache)
+    MissavPageParser(_HTML)._parse_hls_url()
+    assert set(cache) == {'fresh-uuid', 'f90b6493-7eaa-4a5b-833e-7b0b0b05f7f0'}
+    now[0] = 1700.0
+    MissavPageParser(_HTML)._parse_hls_url()
+    assert len(requests_made) == 2
+    assert set(cache) == {'f90b6493-7eaa-4a5b-833e-7b0b0b05f7f0'}
+
+def test_missing_uuid_raises():
+    with pytest.raises(ValueError):
+        MissavPageParser('<html></html>')._fetch_playlist()
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from src.Config.Config import config
+from src.Crawler import JabVideoCrawler
+from src.Downloader import Downloader
+from src.utils.DataUnit import DownloadPackage
+
+def _package(id):
+    return DownloadPackage(
+        id=id, name=id, actress='a', hash_tag=('x',),
+        hls_url=f'http://cdn.test/{id}/index.m3u8', cover_url='http://cdn.test/c.jpg',
+    )
+
+@pytest.fixture
+def downloaded(monkeypatch):
+    '''
+    用只记录视频序号的协程代替单个视频的下载
+    '''
+    ids = []
+
+    async def fake_single_downloader(self, package, session, scheduler):
+        ids.append(package.id)
+
+    monkeypatch.setattr(Downloader, '_async_single_downloader', fake_single_downloader)
+    return ids
+
+def _id_of(crawler):
+    return crawler.url.rstrip('/').rsplit('/', 1)[-1]
+
+def test_submit_before_download_starts(downloaded):
+    downloader = Downloader([])
+    downloader.submit(_package('A-1'))
+    downloader.close_submissions()
+    downloader.download(streaming=True)
+    assert downloaded == ['A-1']
+
+def test_close_before_any_submit_returns(downloaded):
+    downloader = Downloader([])
+    downloader.close_submissions()
+    start = time.monotonic()
+    downloader.download(streaming=True)
+    assert time.monotonic() - start < 5
+    assert downloaded == []
+
+def test_submit_from_thread_during_download(downloaded):
+    downloader = Downloader([])
+
+    def _feed():
+        for id in ('A-1', 'A-2', 'A-3'):
+            time.sleep(0.05)
+            downloader.submit(_package(id))
+        downloader.close_submissions()
+
+    feeder = threading.Thread(target=_feed)
+    feeder.start()
+    downloader.download(streaming=True)
+    feeder.join()
+    assert sorted(downloaded) == ['A-1', 'A-2', 'A-3']
+
+def test_muti_download_skips_failed_pages(downloaded, monkeypatch):
+    def fake_parse(self):
+        if _id_of(self) == 'bad-1':
+            raise RuntimeError('页面错误')
+        return _package(_id_of(self))
+
+    monkeypatch.setattr(JabVideoCrawler, 'parse', fake_parse)
+    JabVideoCrawler().muti_download(['ok-1', 'bad-1', 'ok-2'])
+    assert sorted(downloaded) == ['ok-1', 'ok-2']
+
+def test_muti_download_all_pages_failed(downloaded, monkeypatch):
+    def fake_parse(self):
+        raise RuntimeError('页面错误')
+
+    monkeypatch.setattr(JabVideoCrawler, 'parse', fake_parse)
+    with pytest.raises(ValueError):
+        JabVideoCrawler().muti_download(['bad-1', 'bad-2'])
+    assert downloaded == []
+
+def test_muti_download_empty_ids():
+    with pytest.raises(ValueError):
+        JabVideoCrawler().muti_download([])
+
+def test_feeder_stops_when_download_fails(monkeypatch):
+    monkeypatch.setattr(config, 'parse_workers', 1)
+    parsed = []
+
+    def fake_parse(self):
+        parsed.append(_id_of(self))
+        if len(parsed) > 1:
+            time.sleep(0.1)
+        return _package(_id_of(self))
+
+    def failing_download(self, streaming=False):
+        # 例如会话创建失败或被中断, 下载器在所有视频提交前退出
+        time.sleep(0.05)
+        raise RuntimeError('下载失败')
+
+    monkeypatch.setattr(JabVideoCrawler, 'parse', fake_parse)
+    monkeypatch.setattr(Downloader, 'download', failing_download)
+    ids = [f'v-{i}' for i in range(8)]
+    with pytest.raises(RuntimeError):
+        JabVideoCrawler().muti_download(ids)
+    time.sleep(0.5)
+    # 下载器出错后未开始解析的页面被取消
+    assert len(parsed) < len(ids)
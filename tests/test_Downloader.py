@@ -0,0 +1,541 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from src.Config.Config import config
+import src.Downloader as downloader_module
+from src.Downloader import Downloader
+from src.Error.Exception import InvalidPlaylistError, SegmentsFailedError
+from src.utils.Budget import ByteBudget
+from src.utils.Counter import Counter
+from src.utils.DataUnit import DownloadPackage
+from src.utils.DownloadPlan import DownloadPlan
+from src.utils.Journal import CompletionJournal
+from src.utils.Scheduler import SegmentScheduler
+from src.utils.SegmentStore import PackedSegmentStore
+
+BASE_URL = 'http://cdn.test/v/'
+_FIXTURE_DIR = Path(__file__).resolve().parents[1] / 'test_files' / 'm3u8'
+
+def _playlist(count, query='', media_sequence=0):
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4', f'#EXT-X-MEDIA-SEQUENCE:{media_sequence}']
+    for i in range(count):
+        lines += ['#EXTINF:4.0,', f'seg{media_sequence + i}.ts{query}']
+    return '\n'.join(lines + ['#EXT-X-ENDLIST', ''])
+
+class _Content:
+    def __init__(self, body):
+        self._body = body
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self._body), size):
+            yield self._body[start:start + size]
+
+class _Response:
+    def __init__(self, status, body=b'', content_length=None, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self.content_length = len(body) if content_length is None else content_length
+        self.content = _Content(body)
+
+class _Request:
+    def __init__(self, session, url, headers):
+        self._session = session
+        self._url = url
+        self._headers = headers or {}
+
+    async def __aenter__(self):
+        self._session.requests.append(self._url)
+        self._session.active += 1
+        self._session.peak = max(self._session.peak, self._session.active)
+        return await self._session.handler(self._url, self._headers)
+
+    async def __aexit__(self, *args):
+        self._session.active -= 1
+        return False
+
+class FakeSession:
+    '''
+    只实现下载ts用到的 session.get, handler根据地址与请求头返回 _Response
+    '''
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+        self.active = 0
+        self.peak = 0
+
+    def get(self, url, headers=None, proxy=None):
+        return _Request(self, url, headers)
+
+async def _ok(url, headers):
+    await asyncio.sleep(0.01)
+    return _Response(200, url.encode())
+
+@pytest.fixture
+def tmp_dirs(tmp_path, monkeypatch):
+    for name in ('tmp_dir', 'tmp_m3u8_dir', 'tmp_ts_dir', 'tmp_journal_dir', 'video_dir', 'cover_dir'):
+        path = tmp_path / name
+        path.mkdir()
+        monkeypatch.setattr(config, name, path)
+    monkeypatch.setattr(config, 'retry_wait_time', 0.01)
+    monkeypatch.setattr(config, 'ts_workers', None)
+    return tmp_path
+
+def _package(id='ABC-1'):
+    return DownloadPackage(
+        id=id, name='n', actress='a', hash_tag=('x',),
+        hls_url=f'{BASE_URL}index.m3u8', cover_url='http://cdn.test/c.jpg',
+    )
+
+def _prepare(downloader, package, count, plan=None):
+    key = package.id.lower()
+    plan = plan or DownloadPlan.parse(_playlist(count))
+    downloader._counters[key] = Counter(name=key, total_num=plan.total)
+    journal = CompletionJournal(config.tmp_journal_dir / f'{key}.journal', plan.total)
+    journal.reset()
+    downloader._journals[key] = journal
+    return list(enumerate(plan.segments))
+
+def _download_ts(downloader, package, segments, session, limit=10, memory=None):
+    async def main():
+        scheduler = SegmentScheduler(limit)
+        scheduler.memory = memory
+        scheduler.register(package.id.lower())
+        await downloader._async_download_ts(
+            package=package,
+            segments=segments,
+            base_url=BASE_URL,
+            tmp_folder_name=package.id.lower(),
+            session=session,
+            scheduler=scheduler,
+        )
+    asyncio.run(main())
+
+def test_worker_count_follows_worker_limit(tmp_dirs):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    segments = _prepare(downloader, package, 12)
+    downloader._worker_limit = 3
+    session = FakeSession(_ok)
+    _download_ts(downloader, package, segments, session, limit=10)
+    assert session.peak == 3
+    assert downloader._journals['abc-1'].missing() == []
+    assert (config.tmp_ts_dir / 'abc-1' / '5.ts').read_bytes() == f'{BASE_URL}seg5.ts'.encode()
+
+def test_connections_follow_scheduler_limit(tmp_dirs):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    segments = _prepare(downloader, package, 12)
+    # 开启AIMD时工作协程数为连接数上限, 实际并发由调度器当前的连接数决定
+    downloader._worker_limit = 8
+    session = FakeSession(_ok)
+    _download_ts(downloader, package, segments, session, limit=2)
+    assert session.peak == 2
+    assert downloader._journals['abc-1'].missing() == []
+
+def test_expired_segment_is_requeued_with_refreshed_url(tmp_dirs, monkeypatch):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    segments = _prepare(downloader, package, 6)
+    refreshed = []
+    monkeypatch.setattr(downloader, '_download_m3u8', lambda package: refreshed.append(package.id))
+    monkeypatch.setattr(downloader, '_load_plan', lambda package: DownloadPlan.parse(_playlist(6, '?v=2')))
+
+    async def handler(url, headers):
+        await asyncio.sleep(0.01)
+        if url == f'{BASE_URL}seg2.ts':
+            return _Response(410)
+        return _Response(200, b'x' * 10)
+
+    session = FakeSession(handler)
+    _download_ts(downloader, package, segments, session)
+    assert refreshed == ['ABC-1']
+    assert f'{BASE_URL}seg2.ts?v=2' in session.requests
+    assert downloader._journals['abc-1'].missing() == []
+
+def test_exhausted_retries_end_in_dead_letters(tmp_dirs, monkeypatch):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    segments = _prepare(downloader, package, 4)
+    monkeypatch.setattr(config, 'max_retries', 3)
+    delays = []
+    retry_delay = Downloader._retry_delay
+
+    def recording_delay(retry_count):
+        wait_time = retry_delay(retry_count)
+        delays.append((retry_count, wait_time))
+        return wait_time
+
+    monkeypatch.setattr(Downloader, '_retry_delay', staticmethod(recording_delay))
+
+    async def handler(url, headers):
+        await asyncio.sleep(0.01)
+        if url == f'{BASE_URL}seg1.ts':
+            return _Response(500)
+        return _Response(200, b'x' * 10)
+
+    session = FakeSession(handler)
+    _download_ts(downloader, package, segments, session)
+    assert session.requests.count(f'{BASE_URL}seg1.ts') == 3
+    # 每次重试的等待时间在退避时间的一半到退避时间之间
+    assert [retry_count for retry_count, _ in delays] == [0, 1]
+    for retry_count, wait_time in delays:
+        backoff = config.retry_wait_time * 2 ** retry_count
+        assert backoff / 2 <= wait_time <= backoff
+    assert downloader.dead_letters() == {'abc-1': {1: '状态码:500'}}
+    assert downloader._journals['abc-1'].missing() == [1]
+    with pytest.raises(SegmentsFailedError):
+        downloader._report_dead_letters(package, [segments[1]], rounds=1)
+
+def _prefetch_downloader(monkeypatch, events, key_uri, fetch_key):
+    '''
+    封面下载较慢, m3u8立即写入临时目录, ts下载只记录完成, 用于检查各步骤的先后顺序
+    '''
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    downloader._counters['abc-1'] = Counter(name='abc-1', total_num=0)
+
+    def download_cover(package):
+        events.append('cover_start')
+        time.sleep(0.2)
+        events.append('cover_done')
+
+    def download_m3u8(package):
+        playlist = _playlist(3).replace(
+            '#EXT-X-MEDIA-SEQUENCE:0', f'#EXT-X-MEDIA-SEQUENCE:0\n#EXT-X-KEY:METHOD=AES-128,URI="{key_uri}"'
+        )
+        (config.tmp_m3u8_dir / 'abc-1.m3u8').write_text(playlist, encoding='utf-8')
+
+    async def download_ts(package, segments, **kwargs):
+        events.append('segments')
+        for index, _ in segments:
+            downloader._mark_done(package, index)
+
+    def merge_ts(package, list_file_path, plan):
+        events.append('merge')
+
+    monkeypatch.setattr(downloader, '_download_cover', download_cover)
+    monkeypatch.setattr(downloader, '_download_m3u8', download_m3u8)
+    monkeypatch.setattr(downloader, '_fetch_key', fetch_key)
+    monkeypatch.setattr(downloader, '_async_download_ts', download_ts)
+    monkeypatch.setattr(downloader, '_merge_ts', merge_ts)
+    return downloader, package
+
+def _run_single(downloader, package):
+    async def main():
+        scheduler = SegmentScheduler(4)
+        scheduler.register('abc-1')
+        await downloader._async_single_downloader(package=package, session=None, scheduler=scheduler)
+    asyncio.run(main())
+
+def test_cover_key_and_segments_overlap(tmp_dirs, monkeypatch):
+    events = []
+
+    async def fetch_key(session, key_url):
+        events.append('key')
+        return b'k' * 16
+
+    downloader, package = _prefetch_downloader(monkeypatch, events, 'overlap.key', fetch_key)
+    _run_single(downloader, package)
+    # 密钥与ts在封面下载完成前开始, 合并等待封面
+    assert events.index('key') < events.index('cover_done')
+    assert events.index('segments') < events.index('cover_done')
+    assert events.index('merge') > events.index('cover_done')
+
+def test_failed_prefetch_is_reported(tmp_dirs, monkeypatch):
+    events = []
+    warnings = []
+
+    async def fetch_key(session, key_url):
+        raise ValueError('密钥服务器错误')
+
+    monkeypatch.setattr(downloader_module.logger, 'warning', lambda message, *args, **kwargs: warnings.append(message))
+    downloader, package = _prefetch_downloader(monkeypatch, events, 'failed.key', fetch_key)
+    _run_single(downloader, package)
+    assert events[-1] == 'merge'
+    assert any('预取ABC-1的密钥失败' in message and '密钥服务器错误' in message for message in warnings)
+
+def test_changed_length_reallocates_packed_slot(tmp_dirs):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    segments = _prepare(downloader, package, 3)
+    store = PackedSegmentStore(config.tmp_ts_dir / 'abc-1.pack', 3)
+    downloader._stores['abc-1'] = store
+    attempts = []
+
+    async def handler(url, headers):
+        await asyncio.sleep(0.01)
+        if url == f'{BASE_URL}seg1.ts':
+            attempts.append(url)
+            # 第一次连接中断, 重试时(例如刷新m3u8后)返回更长的ts
+            if len(attempts) == 1:
+                return _Response(200, b'a' * 5, content_length=10)
+            return _Response(200, b'b' * 20)
+        return _Response(200, b'x' * 10)
+
+    session = FakeSession(handler)
+    _download_ts(downloader, package, segments, session)
+    assert len(attempts) == 2
+    assert downloader._journals['abc-1'].missing() == []
+    assert store.read(1) == b'b' * 20
+    assert store.read(0) == store.read(2) == b'x' * 10
+    records = sorted(store.records.values(), key=lambda record: record.offset)
+    for first, second in zip(records, records[1:]):
+        assert first.offset + first.length <= second.offset
+
+def test_merge_without_ffmpeg_follows_plan(tmp_dirs):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    plan = DownloadPlan.parse(_playlist(3))
+    ts_dir = config.tmp_ts_dir / 'abc-1'
+    ts_dir.mkdir()
+    for segment in plan.segments:
+        if segment.index != 1:
+            (ts_dir / segment.filename).write_bytes(f'{segment.index}'.encode() * 4)
+    # 缺少的ts不能被跳过
+    with pytest.raises(SegmentsFailedError):
+        downloader._merge_ts(package, plan=plan)
+    assert list(config.video_dir.iterdir()) == []
+    (ts_dir / plan.segments[1].filename).write_bytes(b'1111')
+    downloader._merge_ts(package, plan=plan)
+    assert (config.video_dir / 'ABC-1 n a.mp4').read_bytes() == b'000011112222'
+
+class _PlaylistResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+@pytest.mark.parametrize('response', [
+    _PlaylistResponse(410, '<html>expired</html>'),
+    _PlaylistResponse(200, '<html>expired</html>'),
+    _PlaylistResponse(200, '#EXTM3U\n#EXT-X-ENDLIST\n'),
+])
+def test_invalid_playlist_keeps_downloaded_segments(tmp_dirs, monkeypatch, response):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    m3u8_path = config.tmp_m3u8_dir / 'abc-1.m3u8'
+    m3u8_path.write_text(_playlist(3), encoding='utf-8')
+    journal = CompletionJournal(config.tmp_journal_dir / 'abc-1.journal', 3)
+    journal.reset()
+    journal.mark(0)
+    journal.close()
+    ts_dir = config.tmp_ts_dir / 'abc-1'
+    ts_dir.mkdir()
+    (ts_dir / '0.ts').write_bytes(b'x' * 10)
+    monkeypatch.setattr(downloader_module.http_client, 'get', lambda url, **kwargs: response)
+    with pytest.raises(InvalidPlaylistError):
+        _run_single(downloader, package)
+    # 无效的m3u8不会替换已有的m3u8, 已下载的ts保留
+    assert m3u8_path.read_text(encoding='utf-8') == _playlist(3)
+    assert (ts_dir / '0.ts').exists()
+    assert list(config.video_dir.iterdir()) == []
+
+def test_resume_after_refresh_keeps_journal(tmp_dirs):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    journal = CompletionJournal(config.tmp_journal_dir / 'abc-1.journal', 6, media_sequence=2)
+    journal.reset()
+    journal.mark(0)
+    journal.mark(1)
+    journal.close()
+    ts_dir = config.tmp_ts_dir / 'abc-1'
+    ts_dir.mkdir()
+    for index in (0, 1):
+        (ts_dir / f'{index}.ts').write_bytes(b'x' * 10)
+    # 刷新后的m3u8从更早的媒体序号开始, ts数量也不同
+    (config.tmp_m3u8_dir / 'abc-1.m3u8').write_text(_playlist(8, '?v=2'), encoding='utf-8')
+    plan = downloader._load_plan(package)
+    segments = downloader._get_undownload_ts(package, plan)
+    assert [index for index, _ in segments] == [2, 3, 4, 5]
+    assert segments[0][1].uri == 'seg4.ts?v=2'
+    assert (ts_dir / '0.ts').exists() and (ts_dir / '1.ts').exists()
+    downloader._close_segment_state(package)
+
+def test_failed_proactive_refresh_backs_off_and_stops(tmp_dirs, monkeypatch):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    segments = _prepare(downloader, package, 2)
+    monkeypatch.setattr(config, 'max_retries', 3)
+    lifetime = downloader._token_lifetime(package)
+    monkeypatch.setattr(lifetime, 'refresh_delay', lambda: 0.0)
+    refreshed = []
+
+    def download_m3u8(package):
+        refreshed.append(package.id)
+        raise InvalidPlaylistError("m3u8内容无效")
+
+    monkeypatch.setattr(downloader, '_download_m3u8', download_m3u8)
+
+    async def handler(url, headers):
+        await asyncio.sleep(0.3)
+        return _Response(200, b'x' * 10)
+
+    _download_ts(downloader, package, segments, FakeSession(handler))
+    assert refreshed == ['ABC-1'] * 3
+    assert downloader._journals['abc-1'].missing() == []
+
+def _range_handler(body):
+    '''
+    按Range请求头返回文件中的一段
+    '''
+    async def handler(url, headers):
+        await asyncio.sleep(0.01)
+        start, end = map(int, re.match(r'bytes=(\d+)-(\d+)', headers['Range']).groups())
+        return _Response(206, body[start:end + 1], headers={'Content-Range' : f'bytes {start}-{end}/{len(body)}'})
+    return handler
+
+def test_byterange_segments_request_their_range(tmp_dirs):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    plan = DownloadPlan.parse((_FIXTURE_DIR / 'byterange.m3u8').read_text(encoding='utf-8'))
+    assert plan.segments[0].byterange == (75232, 0)
+    assert plan.segments[2].byterange == (75232, 150464)
+    assert plan.segments[-1].byterange == (75232, 1429408)
+    segments = _prepare(downloader, package, 0, plan=plan)
+    body = os.urandom(1504640)
+    session = FakeSession(_range_handler(body))
+    _download_ts(downloader, package, segments, session)
+    assert downloader._journals['abc-1'].missing() == []
+    for segment in plan.segments:
+        length, offset = segment.byterange
+        assert (config.tmp_ts_dir / 'abc-1' / segment.filename).read_bytes() == body[offset:offset + length]
+
+def test_byterange_ignored_by_server_is_not_accepted(tmp_dirs, monkeypatch):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    monkeypatch.setattr(config, 'max_retries', 1)
+    plan = DownloadPlan.parse((_FIXTURE_DIR / 'byterange.m3u8').read_text(encoding='utf-8'))
+    segments = _prepare(downloader, package, 0, plan=plan)[:2]
+
+    async def handler(url, headers):
+        return _Response(200, b'x' * 100)
+
+    _download_ts(downloader, package, segments, FakeSession(handler))
+    assert sorted(downloader.dead_letters()['abc-1']) == [0, 1]
+    assert not (config.tmp_ts_dir / 'abc-1' / '0.ts').exists()
+
+def test_byterange_playlist_merges_to_the_original_file(tmp_dirs):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    text = (_FIXTURE_DIR / 'byterange.m3u8').read_text(encoding='utf-8')
+    (config.tmp_m3u8_dir / 'abc-1.m3u8').write_text(text, encoding='utf-8')
+    plan = downloader._load_plan(package)
+    segments = _prepare(downloader, package, 0, plan=plan)
+    body = os.urandom(1504640)
+    _download_ts(downloader, package, segments, FakeSession(_range_handler(body)))
+    downloader._merge_ts(package, plan=plan)
+    assert (config.video_dir / 'ABC-1 n a.mp4').read_bytes() == body
+
+def test_mark_done_batches_flushes_store_first(tmp_dirs, monkeypatch):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    _prepare(downloader, package, 4)
+    store = PackedSegmentStore(config.tmp_ts_dir / 'abc-1.pack', 4)
+    downloader._stores['abc-1'] = store
+    journal = downloader._journals['abc-1']
+    flushes = []
+    monkeypatch.setattr(config, 'journal_flush_interval', 60)
+    monkeypatch.setattr(store, 'flush', lambda: flushes.append('store'))
+    monkeypatch.setattr(journal, 'flush', lambda: flushes.append('journal'))
+    for index in range(4):
+        downloader._mark_done(package, index)
+    # 间隔内只写入一次, 索引先于完成记录写入
+    assert flushes == ['store', 'journal']
+
+def test_plan_and_journal_io_run_off_loop(tmp_dirs, monkeypatch):
+    events = []
+    threads = []
+
+    async def fetch_key(session, key_url):
+        return b'k' * 16
+
+    downloader, package = _prefetch_downloader(monkeypatch, events, 'offloop.key', fetch_key)
+    for name in ('_load_plan', '_get_undownload_ts'):
+        method = getattr(downloader, name)
+
+        def wrapper(*args, _method=method, _name=name, **kwargs):
+            threads.append((_name, threading.current_thread() is threading.main_thread()))
+            return _method(*args, **kwargs)
+
+        monkeypatch.setattr(downloader, name, wrapper)
+    _run_single(downloader, package)
+    assert threads and not any(on_loop for _, on_loop in threads)
+
+@pytest.mark.parametrize('fails', [False, True])
+def test_single_downloader_shuts_executor_down(tmp_dirs, monkeypatch, fails):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False)
+    executors = []
+
+    async def fake_single_downloader(package, session, scheduler):
+        executors.append(downloader._get_executor())
+        if fails:
+            raise RuntimeError('下载失败')
+
+    monkeypatch.setattr(downloader, '_async_single_downloader', fake_single_downloader)
+    if fails:
+        with pytest.raises(RuntimeError):
+            downloader.single_downloader(package)
+    else:
+        downloader.single_downloader(package)
+    assert downloader._executor is None
+    assert executors[0]._shutdown
+
+def test_merge_with_ffmpeg_follows_plan(tmp_dirs, monkeypatch):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=True)
+    plan = DownloadPlan.parse(_playlist(3))
+    ts_dir = config.tmp_ts_dir / 'abc-1'
+    ts_dir.mkdir()
+    list_file_path = config.tmp_dir / 'abc-1.txt'
+    commands = []
+
+    def fake_run(command, **kwargs):
+        commands.append(command)
+        Path(command[-1]).write_bytes(b'video')
+
+    monkeypatch.setattr(downloader_module.subprocess, 'run', fake_run)
+    for segment in plan.segments:
+        if segment.index != 1:
+            (ts_dir / segment.filename).write_bytes(b'x')
+    # 缺少的ts不能被跳过, 否则ffmpeg会输出不完整的视频
+    with pytest.raises(SegmentsFailedError):
+        downloader._merge_ts(package, list_file_path=list_file_path, plan=plan)
+    assert commands == [] and not list_file_path.exists()
+    (ts_dir / '1.ts').write_bytes(b'x')
+    downloader._merge_ts(package, list_file_path=list_file_path, plan=plan)
+    assert [line.split('/')[-1] for line in list_file_path.read_text(encoding='utf-8').splitlines()] == ["0.ts'", "1.ts'", "2.ts'"]
+    assert (config.video_dir / 'ABC-1 n a.mp4').read_bytes() == b'video'
+
+def test_reorder_buffer_is_charged_to_memory_budget(tmp_dirs):
+    package = _package()
+    downloader = Downloader(package, use_ffmpeg=False, stream_merge=True)
+    (config.tmp_m3u8_dir / 'abc-1.m3u8').write_text(_playlist(6), encoding='utf-8')
+    plan = downloader._load_plan(package)
+    downloader._counters['abc-1'] = Counter(name='abc-1', total_num=6)
+    segments = downloader._get_undownload_ts(package, plan)
+    budget = ByteBudget(4000)
+    stalled = []
+
+    async def handler(url, headers):
+        if url.endswith('seg0.ts'):
+            # 队首的ts最后完成, 其余的ts在重排缓冲区中等待
+            await asyncio.sleep(0.3)
+            stalled.append((budget.in_use, downloader._assemblers['abc-1'].buffered_bytes))
+        else:
+            await asyncio.sleep(0.01)
+        return _Response(200, url[-7:-3].encode() * 250)
+
+    _download_ts(downloader, package, segments, FakeSession(handler), memory=budget)
+    # 缓冲区最多占用一半预算, 其余乱序的ts落盘
+    assert stalled == [(2000, 2000)]
+    assert budget.in_use == 0
+    assert downloader._journals['abc-1'].missing() == []
+    downloader._close_segment_state(package)
+    expected = b''.join(f'seg{i}'.encode() * 250 for i in range(6))
+    assert (config.video_dir / 'abc-1.mp4').read_bytes() == expected
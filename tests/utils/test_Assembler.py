@@ -0,0 +1,58 @@
+from src.utils.Journal import CompletionJournal
+from src.utils.Assembler import StreamAssembler
+
+def _assembler(tmp_path, total, max_buffer_bytes):
+    return StreamAssembler(
+        output_path=tmp_path / 'out.mp4',
+        state_path=tmp_path / 'out.assembler',
+        spill_dir=tmp_path / 'spill',
+        total=total,
+        max_buffer_bytes=max_buffer_bytes,
+    )
+
+def test_out_of_order_with_spill(tmp_path):
+    journal = CompletionJournal(tmp_path / 'out.journal', 4)
+    assembler = _assembler(tmp_path, 4, max_buffer_bytes=2)
+    assembler.open(journal)
+    assert assembler.add(2, b'cc') == []
+    assert assembler.add(3, b'dd') == [3]
+    assert (tmp_path / 'spill' / '3.ts').exists()
+    assert assembler.add(1, b'bb') == [1]
+    assert assembler.add(0, b'aa') == [0, 2]
+    assert assembler.finished
+    assembler.close()
+    assert (tmp_path / 'out.mp4').read_bytes() == b'aabbccdd'
+    assert not (tmp_path / 'spill' / '3.ts').exists()
+
+def test_resume_truncates_and_restores_spilled(tmp_path):
+    journal = CompletionJournal(tmp_path / 'out.journal', 4)
+    assembler = _assembler(tmp_path, 4, max_buffer_bytes=0)
+    assembler.open(journal)
+    for index in assembler.add(0, b'aa') + assembler.add(3, b'dd'):
+        journal.mark(index)
+    assembler.close()
+    with open(tmp_path / 'out.mp4', 'ab') as f:
+        f.write(b'garbage')
+    journal.close()
+
+    journal = CompletionJournal(tmp_path / 'out.journal', 4)
+    assert journal.load()
+    assembler = _assembler(tmp_path, 4, max_buffer_bytes=0)
+    assembler.open(journal)
+    assert journal.missing() == [1, 2]
+    assembler.add(1, b'bb')
+    assembler.add(2, b'cc')
+    assembler.close()
+    assert (tmp_path / 'out.mp4').read_bytes() == b'aabbccdd'
+
+def test_unbuffered_out_of_order_segment_is_spilled(tmp_path):
+    journal = CompletionJournal(tmp_path / 'out.journal', 3)
+    assembler = _assembler(tmp_path, 3, max_buffer_bytes=100)
+    assembler.open(journal)
+    assert assembler.add(2, b'cc', buffer=False) == [2]
+    assert assembler.buffered_bytes == 0
+    assert (tmp_path / 'spill' / '2.ts').exists()
+    assert assembler.add(1, b'bb') == []
+    assert assembler.add(0, b'aa') == [0, 1]
+    assembler.close()
+    assert (tmp_path / 'out.mp4').read_bytes() == b'aabbcc'
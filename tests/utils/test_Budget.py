@@ -0,0 +1,30 @@
+import asyncio
+
+from src.utils.Budget import ByteBudget
+
+def test_backpressure():
+    async def main():
+        budget = ByteBudget(100)
+        await budget.acquire(60)
+        waiting = asyncio.ensure_future(budget.acquire(60))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        budget.release(60)
+        await asyncio.sleep(0)
+        assert waiting.done()
+        assert budget.in_use == 60 and budget.peak == 60
+    asyncio.run(main())
+
+def test_oversized_request_when_idle():
+    async def main():
+        budget = ByteBudget(100)
+        await budget.acquire(500)
+        assert budget.in_use == 500
+        waiting = asyncio.ensure_future(budget.acquire(1))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        budget.release(500)
+        assert budget.in_use == 0
+    asyncio.run(main())
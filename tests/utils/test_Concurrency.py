@@ -0,0 +1,22 @@
+from src.utils.Scheduler import SegmentScheduler
+from src.utils.Concurrency import AIMDController
+
+def test_failure_decreases_once_per_window():
+    scheduler = SegmentScheduler(8)
+    controller = AIMDController(scheduler, min_limit=2, max_limit=16, window=60)
+    controller.on_failure('timeout')
+    assert scheduler.limit == 4
+    controller.on_failure('timeout')
+    assert scheduler.limit == 4
+    assert controller.stats()['failures'] == {'timeout' : 2}
+
+def test_increase_when_saturated_and_faster():
+    scheduler = SegmentScheduler(2)
+    scheduler._in_flight = 2
+    controller = AIMDController(scheduler, max_limit=3, window=0, min_samples=1)
+    controller.on_success(0.1, 1000)
+    assert scheduler.limit == 3
+    scheduler._in_flight = 3
+    controller.on_success(0.1, 1000000)
+    assert scheduler.limit == 3
+    assert [decision.action for decision in controller.decisions] == ['increase', 'hold']
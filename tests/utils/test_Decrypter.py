@@ -0,0 +1,20 @@
+import os
+
+from Crypto.Cipher import AES
+
+from src.utils.Decrypter import Decrypter, sequence_iv
+from src.utils.EnumType import DecrptyType
+
+def test_decrypt_in_place_matches_copy():
+    key, iv = os.urandom(16), os.urandom(16)
+    plain = os.urandom(188 * 64)
+    data = AES.new(key, AES.MODE_CBC, iv).encrypt(plain)
+    decrypter = Decrypter(DecrptyType.AES)
+    assert decrypter.decrypt(data, key, '0x' + iv.hex()) == plain
+    buffer = bytearray(data)
+    assert decrypter.decrypt(buffer, key, iv, output=buffer) is buffer
+    assert buffer == plain
+
+def test_sequence_iv():
+    assert sequence_iv(1) == '0x' + '0' * 31 + '1'
+    assert bytes.fromhex(sequence_iv(258)[2:]) == (258).to_bytes(16, 'big')
@@ -0,0 +1,67 @@
+from src.utils.DownloadPlan import DownloadPlan
+
+def _playlist(count, media_sequence=0, key=True):
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4', f'#EXT-X-MEDIA-SEQUENCE:{media_sequence}']
+    if key:
+        lines.append('#EXT-X-KEY:METHOD=AES-128,URI="key.bin",IV=0x000102030405060708090a0b0c0d0e0f')
+    for i in range(count):
+        lines += ['#EXTINF:4.0,', f'seg{media_sequence + i}.ts?e=1']
+    return '\n'.join(lines + ['#EXT-X-ENDLIST', ''])
+
+def test_parse_once_per_content():
+    text = _playlist(5)
+    plan = DownloadPlan.parse(text)
+    assert DownloadPlan.parse(str(text)) is plan
+    assert plan.total == 5 and plan.encrypted
+    assert plan.key_uris == ('key.bin',)
+    assert plan.segments[0].iv == '0x000102030405060708090a0b0c0d0e0f'
+    assert [segment.filename for segment in plan.segments] == [f'{i}.ts' for i in range(5)]
+    assert plan.segments[2].duration == 4.0
+
+def test_unencrypted_plan():
+    plan = DownloadPlan.parse(_playlist(3, key=False))
+    assert not plan.encrypted
+    assert plan.key_uris == () and plan.segments[0].iv is None
+
+def test_locate_by_media_sequence():
+    old = DownloadPlan.parse(_playlist(4, media_sequence=10))
+    new = DownloadPlan.parse(_playlist(6, media_sequence=8))
+    mapped = new.locate(old.media_sequence, old.total)
+    assert [segment.uri for segment in mapped] == [segment.uri for segment in old.segments]
+    assert [segment.index for segment in mapped] == [0, 1, 2, 3]
+    assert DownloadPlan.parse(_playlist(3, media_sequence=12)).locate(10, 4) is None
+
+def test_key_rotation_and_implicit_iv():
+    text = '\n'.join([
+        '#EXTM3U', '#EXT-X-MEDIA-SEQUENCE:5',
+        '#EXT-X-KEY:METHOD=AES-128,URI="k0.key"',
+        '#EXTINF:4.0,', 'a.ts',
+        '#EXT-X-KEY:METHOD=AES-128,URI="k1.key",IV=0x0000000000000000000000000000000f',
+        '#EXTINF:4.0,', 'b.ts',
+        '#EXT-X-KEY:METHOD=NONE',
+        '#EXTINF:4.0,', 'c.ts',
+        '',
+    ])
+    plan = DownloadPlan.parse(text)
+    first, second, third = plan.segments
+    assert (first.key_uri, first.iv) == ('k0.key', '0x' + '0' * 31 + '5')
+    assert (second.key_uri, second.iv) == ('k1.key', '0x0000000000000000000000000000000f')
+    assert third.key_uri is None and third.iv is None
+    assert plan.key_uris == ('k0.key', 'k1.key')
+
+def test_locate_same_count_shifted_sequence():
+    old = DownloadPlan.parse(_playlist(4, media_sequence=10))
+    slid = DownloadPlan.parse(_playlist(4, media_sequence=11))
+    assert slid.locate(old.media_sequence, old.total) is None
+    longer = DownloadPlan.parse(_playlist(5, media_sequence=9))
+    assert DownloadPlan.parse(_playlist(5, media_sequence=10)).locate(9, 5) is None
+    assert [segment.uri for segment in longer.locate(10, 4)] == [segment.uri for segment in old.segments]
+
+def test_rebase_keeps_original_positions():
+    old = DownloadPlan.parse(_playlist(4, media_sequence=10))
+    new = DownloadPlan.parse(_playlist(6, media_sequence=8))
+    rebased = new.rebase(old.media_sequence, old.total)
+    assert rebased.media_sequence == 10 and rebased.total == 4
+    assert [segment.uri for segment in rebased.segments] == [segment.uri for segment in old.segments]
+    assert old.rebase(old.media_sequence, old.total) is old
+    assert new.rebase(20, 4) is None
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import subprocess
+
+import pytest
+
+from src.utils.FFmpegStreamer import FFmpegStreamer
+
+# 只读取参数中的输出路径, 其余行为由各测试的脚本决定
+_HEADER = '''import sys
+output = sys.argv[-1]
+'''
+
+_COPY = _HEADER + '''with open(output, 'wb') as f:
+    while True:
+        data = sys.stdin.buffer.read(65536)
+        if not data:
+            break
+        f.write(data)
+print('progress=end', flush=True)
+'''
+
+_FAIL = _HEADER + '''sys.stdin.buffer.read()
+sys.stderr.write('invalid data found\\n')
+sys.exit(1)
+'''
+
+_EXIT_EARLY = _HEADER + '''sys.exit(0)
+'''
+
+_HANG = _HEADER + '''import time
+time.sleep(60)
+'''
+
+def _fake_ffmpeg(tmp_path, body):
+    path = tmp_path / 'ffmpeg'
+    path.write_text(f'#!{sys.executable}\n' + body, encoding='utf-8')
+    os.chmod(path, 0o755)
+    return str(path)
+
+def _streamer(tmp_path, body, segments):
+    return FFmpegStreamer(
+        tmp_path / 'out.mp4',
+        len(segments),
+        segments.__getitem__,
+        executable=_fake_ffmpeg(tmp_path, body),
+    )
+
+def test_segments_are_written_in_order(tmp_path):
+    segments = [bytes([i]) * 1000 for i in range(5)]
+    streamer = _streamer(tmp_path, _COPY, segments)
+    streamer.start()
+    for index in (3, 1, 0, 4, 2):
+        streamer.notify(index)
+    streamer.finish(timeout=30)
+    assert (tmp_path / 'out.mp4').read_bytes() == b''.join(segments)
+    assert streamer.progress.get('progress') == 'end'
+
+def test_non_zero_exit_raises_with_stderr(tmp_path):
+    streamer = _streamer(tmp_path, _FAIL, [b'x' * 100])
+    streamer.start()
+    streamer.notify(0)
+    with pytest.raises(subprocess.CalledProcessError) as info:
+        streamer.finish(timeout=30)
+    assert b'invalid data found' in info.value.stderr
+
+def test_broken_pipe_raises(tmp_path):
+    segments = [b'x' * (4 * 1024 * 1024)] * 2
+    streamer = _streamer(tmp_path, _EXIT_EARLY, segments)
+    streamer.start()
+    streamer.notify(0)
+    streamer.notify(1)
+    with pytest.raises(subprocess.CalledProcessError):
+        streamer.finish(timeout=30)
+
+def test_hung_ffmpeg_is_killed_on_timeout(tmp_path):
+    streamer = _streamer(tmp_path, _HANG, [b'x' * 100])
+    streamer.start()
+    streamer.notify(0)
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        streamer.finish(timeout=0.5)
+    assert time.monotonic() - start < 10
+    assert streamer._process.poll() is not None
@@ -0,0 +1,35 @@
+import os
+import errno
+
+import pytest
+
+from src.utils import FileCopy
+from src.utils.FileCopy import copy_range
+
+def _copy(tmp_path):
+    src = tmp_path / 'src'
+    dst = tmp_path / 'dst'
+    src.write_bytes(b'0123456789')
+    dst.write_bytes(b'abcdef')
+    src_fd = os.open(src, os.O_RDONLY)
+    dst_fd = os.open(dst, os.O_WRONLY)
+    try:
+        copy_range(src_fd, dst_fd, 4, src_offset=3, dst_offset=2)
+    finally:
+        os.close(src_fd)
+        os.close(dst_fd)
+    return dst.read_bytes()
+
+def test_copy_range(tmp_path):
+    assert _copy(tmp_path) == b'ab3456'
+
+@pytest.mark.parametrize('kernel_copy', ['copy_file_range', 'sendfile'])
+def test_copy_range_fallback(tmp_path, monkeypatch, kernel_copy):
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, 'unsupported')
+    for name in ('copy_file_range', 'sendfile'):
+        if name == kernel_copy:
+            monkeypatch.setattr(FileCopy.os, name, unsupported, raising=False)
+        else:
+            monkeypatch.delattr(FileCopy.os, name, raising=False)
+    assert _copy(tmp_path) == b'ab3456'
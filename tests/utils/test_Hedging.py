@@ -0,0 +1,18 @@
+from src.utils.Hedging import HedgeTracker
+
+def test_threshold_follows_percentile():
+    tracker = HedgeTracker(0.9, min_samples=5, min_delay=0.5)
+    for _ in range(4):
+        tracker.record(1.0)
+    assert tracker.threshold() is None
+    for elapsed in (1.0, 1.0, 1.0, 1.0, 1.0, 8.0):
+        tracker.record(elapsed)
+    assert tracker.threshold() == 8.0
+    tracker.on_issued()
+    tracker.on_won()
+    assert tracker.stats()['issued'] == 1 and tracker.stats()['won'] == 1
+
+def test_min_delay():
+    tracker = HedgeTracker(0.5, min_samples=1, min_delay=2.0)
+    tracker.record(0.1)
+    assert tracker.threshold() == 2.0
@@ -0,0 +1,42 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.Config.Config import config
+from src.utils.HttpClient import HttpClient
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = (self.headers.get('X-Test', '') + '|' + self.headers.get('Cookie', '')).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', 'session=abc')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def test_connections_are_reused_across_threads(monkeypatch):
+    monkeypatch.setattr(config, 'proxies', {'http' : None})
+    monkeypatch.setattr(config, 'headers', {'X-Test' : 'config'})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/page'
+    client = HttpClient(pool_maxsize=2)
+    try:
+        assert client.get(url).text == 'config|'
+        assert client.get(url, headers={'X-Test' : 'override'}).text == 'override|session=abc'
+        threads = [threading.Thread(target=lambda: [client.get(url) for _ in range(5)]) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        entry = client.stats()[f'127.0.0.1:{server.server_address[1]}']
+        assert entry['requests'] == 12
+        assert entry['connections'] <= 2
+        assert 1 <= entry['idle'] <= entry['connections']
+    finally:
+        client.close()
+        server.shutdown()
@@ -0,0 +1,59 @@
+from src.utils.Journal import CompletionJournal
+
+def test_mark_and_reload(tmp_path):
+    path = tmp_path / 'abc.journal'
+    journal = CompletionJournal(path, 5)
+    journal.reset()
+    journal.mark(0)
+    journal.mark(3)
+    journal.mark(3)
+    journal.close()
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('4')
+    reloaded = CompletionJournal(path, 5)
+    assert reloaded.load()
+    assert reloaded.missing() == [1, 2, 4]
+    assert reloaded.completed == 2
+    reloaded.mark(2)
+    reloaded.close()
+    again = CompletionJournal(path, 5)
+    assert again.load()
+    assert again.missing() == [1, 4]
+
+def test_total_mismatch_is_not_trusted(tmp_path):
+    path = tmp_path / 'abc.journal'
+    journal = CompletionJournal(path, 5)
+    journal.mark(1)
+    journal.close()
+    assert not CompletionJournal(path, 6).load()
+
+def test_media_sequence_in_header(tmp_path):
+    path = tmp_path / 'abc.journal'
+    journal = CompletionJournal(path, 5, media_sequence=7)
+    journal.reset()
+    journal.mark(2)
+    journal.close()
+    assert CompletionJournal.read_header(path) == (5, 7)
+    assert CompletionJournal(path, 5, media_sequence=7).load()
+    assert not CompletionJournal(path, 5, media_sequence=8).load()
+
+def test_legacy_header_without_media_sequence(tmp_path):
+    path = tmp_path / 'abc.journal'
+    path.write_text('5\n1\n', encoding='utf-8')
+    assert CompletionJournal.read_header(path) == (5, None)
+    journal = CompletionJournal(path, 5, media_sequence=3)
+    assert journal.load()
+    assert journal.missing() == [0, 2, 3, 4]
+
+def test_marks_are_written_on_flush(tmp_path):
+    path = tmp_path / 'abc.journal'
+    journal = CompletionJournal(path, 5)
+    journal.reset()
+    journal.mark(1)
+    journal.mark(3)
+    assert path.read_text(encoding='utf-8') == '5 0\n'
+    journal.flush()
+    assert path.read_text(encoding='utf-8') == '5 0\n1\n3\n'
+    journal.mark(4)
+    journal.close()
+    assert path.read_text(encoding='utf-8') == '5 0\n1\n3\n4\n'
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from src.utils.KeyCache import KeyCache
+
+def test_concurrent_requests_fetch_once():
+    cache = KeyCache()
+    calls = []
+
+    async def fetch(uri):
+        calls.append(uri)
+        await asyncio.sleep(0.01)
+        return uri.encode().ljust(16, b'0')
+
+    async def main():
+        return await asyncio.gather(*(cache.get('a.key', fetch) for _ in range(5)), cache.get('b.key', fetch))
+
+    keys = asyncio.run(main())
+    assert calls == ['a.key', 'b.key']
+    assert keys[0] == b'a.key00000000000' and len(set(keys[:5])) == 1
+    assert asyncio.run(cache.get('a.key', fetch)) == keys[0]
+    assert len(calls) == 2
+
+def test_failed_fetch_is_not_cached():
+    cache = KeyCache()
+    attempts = []
+
+    async def fetch(uri):
+        attempts.append(uri)
+        if len(attempts) == 1:
+            raise ValueError('bad key')
+        return b'k' * 16
+
+    with pytest.raises(ValueError):
+        asyncio.run(cache.get('a.key', fetch))
+    assert asyncio.run(cache.get('a.key', fetch)) == b'k' * 16
+
+def test_least_recently_used_is_evicted():
+    cache = KeyCache(capacity=2)
+    cache.put('a', b'1' * 16)
+    cache.put('b', b'2' * 16)
+    assert cache.get_cached('a') is not None
+    cache.put('c', b'3' * 16)
+    assert cache.get_cached('b') is None
+    assert cache.get_cached('a') == b'1' * 16
+    assert len(cache) == 2
@@ -0,0 +1,65 @@
+from pathlib import Path
+
+import m3u8
+import pytest
+
+from src.Config.Config import config
+from src.utils.Decrypter import is_encrypted
+from src.utils.M3u8Parser import iter_segments, parse_byterange, parse_media_playlist
+
+_FIXTURE_DIR = Path(__file__).resolve().parents[2] / 'test_files' / 'm3u8'
+
+def _playlists():
+    # 除自带的样例外, 也检查下载过程中保存的m3u8
+    paths = sorted(_FIXTURE_DIR.glob('*.m3u8'))
+    if config.tmp_m3u8_dir.exists():
+        paths += sorted(config.tmp_m3u8_dir.glob('*.m3u8'))
+    return paths
+
+def _key(key):
+    if key is None or (key.method or 'NONE').upper() == 'NONE':
+        return None
+    return (key.method, key.uri, key.iv)
+
+@pytest.mark.parametrize('path', _playlists(), ids=lambda path: path.name)
+def test_matches_m3u8_loads(path):
+    text = path.read_text(encoding='utf-8')
+    expected = m3u8.loads(text)
+    playlist = parse_media_playlist(text)
+    assert playlist.media_sequence == (expected.media_sequence or 0)
+    assert playlist.target_duration == expected.target_duration
+    assert playlist.is_endlist == expected.is_endlist
+    assert len(playlist.segments) == len(expected.segments)
+    for segment, other in zip(playlist.segments, expected.segments):
+        assert segment.uri == other.uri
+        assert segment.duration == other.duration
+        assert segment.title == other.title
+        assert segment.byterange == other.byterange
+        assert segment.discontinuity == other.discontinuity
+        assert segment.media_sequence == other.media_sequence
+        assert _key(segment.key) == _key(other.key)
+    assert is_encrypted(text) == any(_key(key) for key in expected.keys)
+
+def test_keys_are_shared_between_segments():
+    playlist = parse_media_playlist((_FIXTURE_DIR / 'rotation.m3u8').read_text(encoding='utf-8'))
+    segments = playlist.segments
+    assert segments[0].key is segments[9].key
+    assert segments[0].key is not segments[10].key
+    assert segments[10].key.uri == 'key?id=1,v=2'
+    assert segments[20].key is None
+    assert len(playlist.keys) == 4 and None in playlist.keys
+
+def test_iter_segments_is_lazy():
+    lines = iter(['#EXTM3U', '#EXTINF:4.0,', 'a.ts', '#EXTINF:4.0,', 'b.ts'])
+    segments = iter_segments(lines)
+    assert next(segments).uri == 'a.ts'
+    assert next(lines) == '#EXTINF:4.0,'
+
+def test_master_playlist_is_rejected():
+    with pytest.raises(ValueError):
+        parse_media_playlist('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1280000\nlow.m3u8\n')
+
+def test_parse_byterange():
+    assert parse_byterange('75232@150464') == (75232, 150464)
+    assert parse_byterange('75232', default_offset=75232) == (75232, 75232)
+    assert parse_byterange('100') == (100, 0)
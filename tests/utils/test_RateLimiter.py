@@ -0,0 +1,33 @@
+import time
+import asyncio
+
+from src.utils.RateLimiter import BandwidthLimiter
+
+def test_limits_rate():
+    async def main():
+        limiter = BandwidthLimiter(100_000, burst=10_000)
+        start = time.monotonic()
+        for _ in range(5):
+            await limiter.consume('a', 10_000)
+        return time.monotonic() - start
+    assert 0.3 < asyncio.run(main()) < 1.0
+
+def test_weighted_and_runtime_change():
+    async def main():
+        limiter = BandwidthLimiter(1, burst=1)
+        limiter.register('a', weight=3)
+        limiter.register('b', weight=1)
+        await limiter.consume('a', 1)
+        order = []
+
+        async def worker(key):
+            await limiter.consume(key, 1)
+            order.append(key)
+
+        tasks = [asyncio.ensure_future(worker(key)) for key in 'bbaa']
+        await asyncio.sleep(0.05)
+        assert not order
+        limiter.set_rate(None)
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        assert order[:2] == ['a', 'a']
+    asyncio.run(main())
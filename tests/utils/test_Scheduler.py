@@ -0,0 +1,76 @@
+import asyncio
+
+from src.utils.Scheduler import SegmentScheduler
+
+def test_fair_share():
+    async def main():
+        scheduler = SegmentScheduler(2)
+        scheduler.register('a')
+        scheduler.register('b')
+        await scheduler.acquire('a')
+        await scheduler.acquire('a')
+        waiting_a = asyncio.ensure_future(scheduler.acquire('a'))
+        waiting_b = asyncio.ensure_future(scheduler.acquire('b'))
+        await asyncio.sleep(0)
+        scheduler.release('a')
+        await asyncio.sleep(0)
+        assert waiting_b.done() and not waiting_a.done()
+        scheduler.release('a')
+        await asyncio.sleep(0)
+        assert waiting_a.done()
+        assert scheduler.in_flight == 2
+    asyncio.run(main())
+
+def test_weighted_share():
+    async def main():
+        scheduler = SegmentScheduler(4)
+        scheduler.register('a', weight=3)
+        scheduler.register('b', weight=1)
+        for _ in range(4):
+            await scheduler.acquire('c')
+        granted = []
+
+        async def worker(key):
+            await scheduler.acquire(key)
+            granted.append(key)
+
+        tasks = [asyncio.ensure_future(worker(key)) for key in 'abababab']
+        await asyncio.sleep(0)
+        for _ in range(4):
+            scheduler.release('c')
+        await asyncio.sleep(0)
+        assert sorted(granted) == ['a', 'a', 'a', 'b']
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    asyncio.run(main())
+
+def test_freed_capacity_goes_to_remaining():
+    async def main():
+        scheduler = SegmentScheduler(2)
+        scheduler.register('a')
+        scheduler.register('b')
+        await scheduler.acquire('a')
+        await scheduler.acquire('b')
+        waiting = [asyncio.ensure_future(scheduler.acquire('a')) for _ in range(2)]
+        await asyncio.sleep(0)
+        scheduler.release('b')
+        scheduler.unregister('b')
+        await asyncio.sleep(0)
+        assert sum(task.done() for task in waiting) == 1
+        assert scheduler.stats()['a']['running'] == 2
+    asyncio.run(main())
+
+def test_try_acquire_uses_only_idle_slots():
+    async def main():
+        scheduler = SegmentScheduler(2)
+        scheduler.register('a')
+        assert scheduler.try_acquire('a')
+        assert scheduler.try_acquire('a')
+        assert not scheduler.try_acquire('a')
+        scheduler.release('a')
+        waiting = asyncio.ensure_future(scheduler.acquire('b'))
+        await asyncio.sleep(0)
+        assert waiting.done()
+        assert not scheduler.try_acquire('a')
+    asyncio.run(main())
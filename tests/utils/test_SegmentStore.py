@@ -0,0 +1,28 @@
+from src.utils.SegmentStore import PackedSegmentStore, write_at
+
+def test_out_of_order_writes_read_back_in_order(tmp_path):
+    store = PackedSegmentStore(tmp_path / 'abc.pack', 3)
+    store.load()
+    for index, data in ((2, b'cc'), (0, b'aaaa'), (1, b'b')):
+        offset = store.allocate(len(data))
+        checksum = write_at(store.data_path, offset, data)
+        store.commit(index, offset, len(data), checksum)
+    store.close()
+
+    reloaded = PackedSegmentStore(tmp_path / 'abc.pack', 3)
+    reloaded.load()
+    assert sorted(reloaded.records) == [0, 1, 2]
+    assert reloaded.read(2) == b'cc'
+    assert b''.join(reloaded.iter_chunks(chunk_size=3)) == b'aaaabcc'
+    reloaded.remove()
+    assert list(tmp_path.iterdir()) == []
+
+def test_index_is_written_on_flush(tmp_path):
+    store = PackedSegmentStore(tmp_path / 'abc.pack', 2)
+    store.load()
+    offset = store.allocate(2)
+    store.commit(0, offset, 2, write_at(store.data_path, offset, b'aa'))
+    assert not store.index_path.exists() or store.index_path.read_text(encoding='utf-8') == ''
+    store.flush()
+    assert store.index_path.read_text(encoding='utf-8').split() == ['0', str(offset), '2', str(store.records[0].checksum)]
+    store.close()
@@ -0,0 +1,35 @@
+import time
+
+from src.utils.TokenLifetime import TokenLifetime, parse_expiry
+
+def test_parse_expiry():
+    expires = int(time.time()) + 600
+    assert parse_expiry(f'https://a.com/v/index.m3u8?token=x&expires={expires}') == expires
+    assert parse_expiry(f'https://a.com/v/index.m3u8?e={expires * 1000}') == expires
+    assert parse_expiry('https://a.com/v/index.m3u8?e=12') is None
+    assert parse_expiry('https://a.com/v/index.m3u8') is None
+
+def test_refresh_before_expiry():
+    lifetime = TokenLifetime(margin=0.2, min_delay=0)
+    lifetime.on_fetched([f'https://a.com/index.m3u8?expires={int(time.time()) + 100}'])
+    assert 75 < lifetime.refresh_delay() <= 80
+    unknown = TokenLifetime()
+    unknown.on_fetched(['https://a.com/index.m3u8'])
+    assert unknown.refresh_delay() is None
+    unknown.on_expired()
+    unknown.on_fetched(['https://a.com/index.m3u8'])
+    assert unknown.lifetime == 30
+
+def test_spurious_early_expiry_is_floored_and_recovers():
+    lifetime = TokenLifetime(margin=0.2, min_delay=1, min_lifetime=30, growth=1.5)
+    lifetime.on_fetched(['https://a.com/index.m3u8'])
+    lifetime.on_expired()
+    lifetime.on_fetched(['https://a.com/index.m3u8'])
+    assert lifetime.lifetime == 30
+    assert 23 < lifetime.refresh_delay() <= 24
+    # 刷新前没有再过期, 有效期逐步放宽
+    lifetime.on_fetched(['https://a.com/index.m3u8'])
+    assert lifetime.lifetime == 45
+    lifetime.on_expired()
+    lifetime.on_fetched(['https://a.com/index.m3u8'])
+    assert lifetime.lifetime == 30
@@ -0,0 +1,72 @@
+from src.utils.TsValidator import TsValidator
+
+def _packet(counter, pcr=None):
+    if pcr is None:
+        return bytes([0x47, 0x01, 0x00, 0x10 | counter]) + b'\xff' * 184
+    base, extension = divmod(pcr, 300)
+    field = bytes([
+        0x10,
+        (base >> 25) & 0xff,
+        (base >> 17) & 0xff,
+        (base >> 9) & 0xff,
+        (base >> 1) & 0xff,
+        ((base & 1) << 7) | 0x7e | (extension >> 8),
+        extension & 0xff,
+    ])
+    return bytes([0x47, 0x01, 0x00, 0x30 | counter, len(field)]) + field + b'\xff' * (183 - len(field))
+
+def _segment(count, seconds=0.0):
+    packets = [_packet(i % 16) for i in range(count)]
+    if seconds:
+        packets[0] = _packet(0, pcr=27_000_000)
+        packets[-1] = _packet((count - 1) % 16, pcr=27_000_000 + int(seconds * 27_000_000))
+    return b''.join(packets)
+
+def test_valid_segment_with_padding():
+    validator = TsValidator()
+    data = _segment(40, seconds=2.0)
+    padding = 16 - len(data) % 16
+    assert validator.validate(data, 2.0) is None
+    assert validator.validate(data + bytes([padding]) * padding, 2.0) is None
+
+def test_detects_damage():
+    validator = TsValidator(max_continuity_errors=0)
+    data = bytearray(_segment(40, seconds=2.0))
+    assert validator.validate(data[:-100]) is not None
+    assert validator.validate(data, 6.0) is not None
+    broken_sync = bytearray(data)
+    broken_sync[188 * 3] = 0
+    assert '第3个' in validator.validate(broken_sync)
+    broken_counter = bytearray(data)
+    broken_counter[188 * 5 + 3] = 0x10 | 9
+    assert validator.validate(broken_counter) is not None
+
+def test_validate_file_region(tmp_path):
+    data = _segment(20)
+    path = tmp_path / 'pack'
+    path.write_bytes(b'\x00' * 100 + data)
+    validator = TsValidator()
+    assert validator.validate_file(path, 100, len(data)) is None
+    assert validator.validate_file(path) is not None
+
+def test_duplicates_discontinuity_and_null_packets_are_allowed():
+    validator = TsValidator(max_continuity_errors=0)
+    packets = [_packet(0), _packet(1), _packet(1), _packet(2)]
+    # 带不连续标志的包重新开始计数
+    packets.append(bytes([0x47, 0x01, 0x00, 0x30 | 9, 1, 0x80]) + b'\xff' * 182)
+    packets.append(bytes([0x47, 0x1f, 0xff, 0x10 | 7]) + b'\xff' * 184)
+    packets.append(_packet(10))
+    assert validator.validate(b''.join(packets)) is None
+    packets[3] = _packet(5)
+    assert validator.validate(b''.join(packets)) is not None
+
+def test_validate_file_maps_only_the_segment(tmp_path):
+    import mmap
+    data = _segment(30)
+    offset = mmap.ALLOCATIONGRANULARITY + 1000
+    path = tmp_path / 'pack'
+    path.write_bytes(b'\x00' * offset + data + b'\x00' * 500)
+    validator = TsValidator()
+    assert validator.validate_file(path, offset, len(data)) is None
+    assert validator.validate_file(path, offset + 1, len(data) - 1) is not None
+    assert validator.validate_file(path, offset, len(data) + 600) is not None